@@ -14,18 +14,29 @@
 # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-import pandas as pd
 import boto3
+import csv
 import json
 import logging
 import argparse
+import os
+import re
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 # Command line arguments
 parser = argparse.ArgumentParser(description='Batch registration of LoRaWAN devices for AWS IoT Core for LoRaWAN')
 parser.add_argument('inputfilename', type=str,  help='Path to CSV file to process')
-# parser.add_argument('--errorfilename', type=str, help='Path to CSV file to store failed registrations', required=True)
+parser.add_argument('--errorfilename', type=str, help='Path to CSV file to store failed registrations, numbered if it exists (default: <inputfilename>.failed.csv)')
+parser.add_argument('--journalfilename', type=str, help='Path to journal file of registered DevEuis used to resume an interrupted run (default: <inputfilename>.journal)')
+parser.add_argument('--concurrency', '-c', type=int, default=8, help='Number of concurrent API calls')
+parser.add_argument('--rate', type=float, default=10, help='Maximum number of API calls per second')
 parser.add_argument('--verbose', '-v', action='count', default=1, help='Provide more output')
-parser.add_argument('--dryrun', '-d', action='count', default=1, help='Do everything but API calls')
+parser.add_argument('--dryrun', '-d', action='store_true', help='Do everything but API calls')
+parser.add_argument('--dryrunlatency', type=float, default=0, help='Simulated API latency in seconds for a dry run')
+parser.add_argument('--skipexisting', '-s', action='store_true', help='Skip devices with a DevEui already registered in AWS IoT Core for LoRaWAN')
 parser.add_argument('--region', "-r", type=str, help='AWS region', required=True)
 args = parser.parse_args()
 args.verbose = 70 - (10*args.verbose) if args.verbose > 0 else 0
@@ -36,29 +47,110 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(mes
                     datefmt='%Y-%m-%d %H:%M:%S')
 
 # AWS IoT Wireless client
-if args.dryrun == 1:
+if not args.dryrun or args.skipexisting:
     iotwireless_client = boto3.client('iotwireless', region_name=args.region)
-else:
+if args.dryrun:
     logger.info("Dry run, not creating wireless devices")
 
+# Input validation
+REQUIRED_COLUMNS = ["Type", "DevEui", "AppKey", "AppEui", "DeviceProfileId", "ServiceProfileId",
+                    "DestinationName", "AuthenticationMethod", "Name", "Description"]
+SUPPORTED_TYPES = ["LoRaWAN"]
+SUPPORTED_AUTHENTICATION_METHODS = ["OtaaV1_0_x"]
+HEX_16 = re.compile("^[0-9a-fA-F]{16}$")
+HEX_32 = re.compile("^[0-9a-fA-F]{32}$")
 
 
+class RateLimiter:
+    """ Spaces out API calls of all worker threads to at most 'rate' calls per second """
 
-def register_wireless_device(devicerow) -> bool:
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.next_call = time.monotonic()
+        self.lock = threading.Lock()
 
-    if (devicerow.Type != "LoRaWAN"):
-        logger.error("Allowed device types are: LoRaWAN")
-        return False;
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            wait_until = max(self.next_call, now)
+            self.next_call = wait_until + self.interval
+        if wait_until > now:
+            time.sleep(wait_until - now)
 
-    if (devicerow.AuthenticationMethod == "OtaaV1_0_x"):
-        authentication_data = {
-            "AppKey": devicerow.AppKey,
-            "AppEui": devicerow.AppEui
-        }
-    else:
-        logger.error(f"Authentication method {devicerow.AuthenticationMethod} not supported, skipping row for device id {devicerow.DeviceId}")
-        return False
 
+class Journal:
+    """ Append-only file with one DevEui per line for each successfully registered device
+
+        A read-only journal (e.g. for a dry run) reads the DevEuis of earlier runs, but neither creates
+        nor writes the file.
+    """
+
+    def __init__(self, filename: str, read_only: bool = False):
+        self.completed = set()
+        if os.path.exists(filename):
+            with open(filename) as f:
+                self.completed = {line.strip() for line in f if line.strip()}
+        self.file = None if read_only else open(filename, "a")
+        self.lock = threading.Lock()
+
+    def record(self, dev_eui: str):
+        if self.file is None:
+            return
+        with self.lock:
+            self.file.write(dev_eui + "\n")
+            self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+def unused_filename(filename: str) -> str:
+    """ Returns filename if it does not exist, otherwise the first of <name>.2<ext>, <name>.3<ext>, ... which does not exist """
+    root, extension = os.path.splitext(filename)
+    candidate, number = filename, 1
+    while os.path.exists(candidate):
+        number += 1
+        candidate = f"{root}.{number}{extension}"
+    return candidate
+
+
+class FailureWriter:
+    """ Writes failed rows incrementally to a CSV file with the same format as the input file
+
+        Each run writes a new file, so the file of an earlier run is kept. A run validates all rows and
+        retries all rows which are not in the journal, so its file is the complete input for the next retry.
+    """
+
+    def __init__(self, filename: str, columns: list):
+        self.filename = unused_filename(filename)
+        self.columns = columns
+        self.file = None
+        self.writer = None
+        self.lock = threading.Lock()
+
+    def write(self, devicerow, error: str):
+        with self.lock:
+            if self.writer is None:
+                self.file = open(self.filename, "x", newline="")
+                self.writer = csv.writer(self.file, delimiter=';', quotechar='|')
+                self.writer.writerow(self.columns + ["Error"])
+            self.writer.writerow([getattr(devicerow, column) for column in self.columns] + [error])
+            self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+def register_wireless_device(devicerow) -> str:
+    """ Registers a wireless device, returns None on success and an error message otherwise """
+
+    # Rows are validated by validate_device_row before, see SUPPORTED_AUTHENTICATION_METHODS
+    authentication_data = {
+        "AppKey": devicerow.AppKey,
+        "AppEui": devicerow.AppEui
+    }
 
     create_wireless_device_input = {
                         "Type": devicerow.Type,
@@ -75,33 +167,178 @@ def register_wireless_device(devicerow) -> bool:
     }
     logger.info(f"Creating device with DevEui {devicerow.DevEui}")
     logger.debug(f"Creating wireless device with data {json.dumps(create_wireless_device_input, indent=4)}")
+    rate_limiter.wait()
     try: 
-        if args.dryrun == 1:
+        if not args.dryrun:
             iotwireless_client.create_wireless_device(**create_wireless_device_input)        
+        elif args.dryrunlatency > 0:
+            time.sleep(args.dryrunlatency)
     except Exception as e:
         logger.error(f"Error creating wireless device {e}")
-        return False
+        return str(e)
         
-    return True    
+    return None    
+
+
+def read_device_rows(f):
+    """ Returns the column names of the input file and a generator yielding its rows one by one as
+        (line number, named tuple), so that memory consumption does not depend on the size of the file.
+        Missing values at the end of a row are read as empty strings. """
+    reader = csv.reader(f, delimiter=';', quotechar='|')
+    columns = next(reader)
+    device_row_type = namedtuple("DeviceRow", columns, rename=True)
+    column_count = len(columns)
+
+    def rows():
+        for row in reader:
+            if not row:
+                continue
+            if len(row) < column_count:
+                row = row + [""] * (column_count - len(row))
+            yield reader.line_num, device_row_type(*row[:column_count])
+
+    return columns, rows()
+
+
+def validate_device_row(devicerow) -> str:
+    """ Checks a row without calling any API, returns None for a valid row and an error message otherwise """
+    for column in REQUIRED_COLUMNS:
+        if column != "Description" and not getattr(devicerow, column):
+            return f"Value for {column} missing"
+    if devicerow.Type not in SUPPORTED_TYPES:
+        return f"Allowed device types are: {', '.join(SUPPORTED_TYPES)}"
+    if devicerow.AuthenticationMethod not in SUPPORTED_AUTHENTICATION_METHODS:
+        return f"Authentication method {devicerow.AuthenticationMethod} not supported"
+    if not HEX_16.match(devicerow.DevEui):
+        return f"DevEui {devicerow.DevEui} is not a 16 digit hexadecimal value"
+    if not HEX_16.match(devicerow.AppEui):
+        return f"AppEui {devicerow.AppEui} is not a 16 digit hexadecimal value"
+    if not HEX_32.match(devicerow.AppKey):
+        return "AppKey is not a 32 digit hexadecimal value"
+    return None
+
 
-logger.info(f"Loading input file {args.inputfilename}")
-df = pd.read_csv(args.inputfilename, delimiter=';', quotechar='|')
-df_failed = pd.DataFrame().reindex_like(df)
+def list_registered_dev_euis() -> set:
+    """ Returns DevEuis (lower case) of all LoRaWAN devices registered in the region """
+    dev_euis = set()
+    request = {"WirelessDeviceType": "LoRaWAN", "MaxResults": 250}
+    while True:
+        response = iotwireless_client.list_wireless_devices(**request)
+        for device in response.get("WirelessDeviceList", []):
+            dev_eui = device.get("LoRaWAN", {}).get("DevEui")
+            if dev_eui:
+                dev_euis.add(dev_eui.lower())
+        if not response.get("NextToken"):
+            return dev_euis
+        request["NextToken"] = response["NextToken"]
+
+
+def build_dev_eui_index(filename: str) -> dict:
+    """ Validates all rows of the input file and returns an index of DevEui (lower case) to the line
+        number of the only row which will be registered for this DevEui. Invalid rows, duplicates and
+        devices which are already registered are written to the error file. """
+    index = {}
+    invalid_count = 0
+    duplicate_count = 0
+    existing_count = 0
+
+    with open(filename, newline="", encoding="utf-8-sig") as f:
+        _, rows = read_device_rows(f)
+        for line_number, devicerow in rows:
+            error = validate_device_row(devicerow)
+            dev_eui = devicerow.DevEui.lower()
+            if error is None and dev_eui in index:
+                error = f"Duplicate DevEui, already used in line {index[dev_eui]}"
+                duplicate_count += 1
+            elif error is not None:
+                invalid_count += 1
+
+            if error is not None:
+                logger.error(f"Line {line_number}: {error}")
+                failures.write(devicerow, error)
+                continue
+
+            if dev_eui in registered_dev_euis:
+                existing_count += 1
+                continue
+
+            index[dev_eui] = line_number
+
+    logger.info(f"Validation found {len(index)} devices to register, {invalid_count} invalid rows, {duplicate_count} duplicate DevEuis, {existing_count} devices already registered")
+    return index
+
+
+def process_device_row(device_row) -> bool:
+    error = register_wireless_device(device_row)
+    if error is None:
+        journal.record(device_row.DevEui)
+        return True
+    failures.write(device_row, error)
+    return False
+
+
+logger.info(f"Reading input file {args.inputfilename}")
+input_file = open(args.inputfilename, newline="", encoding="utf-8-sig")
+columns, device_rows = read_device_rows(input_file)
+
+missing_columns = [column for column in REQUIRED_COLUMNS if column not in columns]
+if missing_columns:
+    raise SystemExit(f"Input file is missing the columns {', '.join(missing_columns)}")
+
+rate_limiter = RateLimiter(args.rate)
+# A dry run must not mark devices as registered for subsequent runs
+journal = Journal(args.journalfilename or args.inputfilename + ".journal", read_only=args.dryrun)
+failures = FailureWriter(args.errorfilename or args.inputfilename + ".failed.csv", columns)
+
+registered_dev_euis = {dev_eui.lower() for dev_eui in journal.completed}
+if args.skipexisting:
+    logger.info("Listing registered LoRaWAN devices")
+    registered_dev_euis |= list_registered_dev_euis()
+
+dev_eui_index = build_dev_eui_index(args.inputfilename)
 
 success_count = 0
 failure_count = 0
+skipped_count = 0
+counter_lock = threading.Lock()
+# Limits the number of rows read ahead of the workers
+in_flight = threading.BoundedSemaphore(args.concurrency * 2)
+start_time = time.monotonic()
 
-for device_row in df.itertuples(index=False, name="DeviceRow"):
-    logger.info(f"Adding device with data {device_row}")
-    if register_wireless_device(device_row)         :
-        success_count += 1
-    else:
-        failure_count += 1
-#        df_failed.append(pd.Series(device_row), ignore_index=True)
-        
-    
-logger.info("Successfully added {} devices, failed to add {} devices".format(success_count, failure_count))
 
-# if failure_count > 0:
-#    logger.info("Writing list of failed devices to {}".format(args.errorfilename))
-#    df_failed.to_csv(args.errorfilename, sep=';', index=True)   
\ No newline at end of file
+def on_row_processed(future):
+    global success_count, failure_count
+    try:
+        succeeded = future.result()
+    except Exception as e:
+        logger.error(f"Error processing device row {e}")
+        succeeded = False
+    with counter_lock:
+        if succeeded:
+            success_count += 1
+        else:
+            failure_count += 1
+    in_flight.release()
+
+
+with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+    for line_number, device_row in device_rows:
+        # Only the row indexed for a DevEui is registered, all other rows were skipped or reported during validation
+        if dev_eui_index.get(device_row.DevEui.lower()) != line_number:
+            skipped_count += 1
+            continue
+        logger.debug(f"Adding device with data {device_row}")
+        in_flight.acquire()
+        executor.submit(process_device_row, device_row).add_done_callback(on_row_processed)
+
+elapsed = time.monotonic() - start_time
+input_file.close()
+journal.close()
+failures.close()
+
+logger.info("Successfully added {} devices, failed to add {} devices, skipped {} rows (invalid, duplicate or already registered)".format(success_count, failure_count, skipped_count))
+logger.info("Processed {} devices in {:.2f} s ({:.1f} devices/s){}".format(success_count + failure_count, elapsed,
+            (success_count + failure_count) / elapsed if elapsed > 0 else 0, " (dry run)" if args.dryrun else ""))
+
+if failure_count > 0:
+    logger.info("List of failed devices written to {}".format(failures.filename))
@@ -56,7 +56,7 @@ class LorawanConnectivityWatchdogStack(cdk.Stack):
 
         iot_events_input = iotevents.CfnInput(self, "LoRaWANGatewayConnectivityStatusInput",
                                               input_definition=inputDefinitionProperty,
-                                              input_name="LoRaWANGatewayConnectivityStatusInput",
+                                              input_name=lorawan_gateway_monitoring_detectormodel.input_name,
                                               input_description="Input for connectivity status updates for LoRaWAN gateways"
 
                                               )
@@ -69,8 +69,8 @@ class LorawanConnectivityWatchdogStack(cdk.Stack):
                                                       detector_model_definition=detector_model_definition,
                                                       detector_model_name="LoRaWANGatewayConnectivityModel",
                                                       detector_model_description="Detector model for LoRaWAN gateway connectivity status",
-                                                      key="gatewayid",
-                                                      evaluation_method="BATCH",
+                                                      key=lorawan_gateway_monitoring_detectormodel.key,
+                                                      evaluation_method=lorawan_gateway_monitoring_detectormodel.evaluation_method,
                                                       role_arn=iot_events_execution_role.role_arn)
 
         ####################################################################################
@@ -100,6 +100,29 @@ class LorawanConnectivityWatchdogStack(cdk.Stack):
 
         get_wireless_gateway_statistics_lambda.add_environment("IOT_EVENTS_INPUT_NAME", "LoRaWANGatewayConnectivityStatusInput")
 
+        ####################################################################################
+        # Lambda function PutCloudwatchMetricsLambda
+
+        # Lambda function PutCloudwatchMetricsLambda: Execution Role
+        put_cloudwatch_metrics_lambda_role = iam.Role(self, "PutCloudwatchMetricsLambdaExecutionRole", assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"))
+        put_cloudwatch_metrics_lambda_role.add_managed_policy(iam.ManagedPolicy.from_aws_managed_policy_name("service-role/AWSLambdaBasicExecutionRole"))
+        put_cloudwatch_metrics_lambda_role.add_to_policy(iam.PolicyStatement(
+            resources=["*"],
+            actions=["cloudwatch:PutMetricData"],
+            conditions={"StringEquals": {"cloudwatch:namespace": "LoRaWAN"}}
+        ))
+
+        # Lambda function PutCloudwatchMetricsLambda: Lambda function configuration
+        put_cloudwatch_metrics_lambda = lambda_.Function(self, "PutCloudwatchMetricsLambda",
+                                                         code=lambda_.Code.asset("src_put_cloudwatch_metrics"),
+                                                         runtime=lambda_.Runtime.PYTHON_3_7,
+                                                         handler="lambda.handler",
+                                                         role=put_cloudwatch_metrics_lambda_role,
+                                                         timeout=cdk.Duration.seconds(25)
+                                                         )
+
+        put_cloudwatch_metrics_lambda.add_environment("METRICS_MODE", "api")
+
         ####################################################################################
         # SNS topic
         sns_topic = sns.Topic(self, "LoRaWANGatewayNotificationTopic",
@@ -127,14 +150,27 @@ class LorawanConnectivityWatchdogStack(cdk.Stack):
                                                  # payload=task_input_payload
                                                  )
 
+        # State 'Publish gateway metrics to CloudWatch': the statistics Lambda returns the datapoints in "Metrics"
+        metrics_invoke_state = tasks.LambdaInvoke(self,
+                                                  "Publish gateway metrics to CloudWatch",
+                                                  result_path="$.cloudwatch_metrics",
+                                                  lambda_function=put_cloudwatch_metrics_lambda,
+                                                  payload=sfn.TaskInput.from_json_path_at("$.wireless_gateway_stats.Payload")
+                                                  )
+
         # Stat 'Did IoT events ingestion run successfull?'
         choice_lambda_state = sfn.Choice(self, "Did IoT events ingestion run successfull?")
-        choice_lambda_state.when(sfn.Condition.number_equals("$.wireless_gateway_stats.Payload.status", 200), success_state)
+        choice_lambda_state.when(sfn.Condition.number_equals("$.wireless_gateway_stats.Payload.status", 200), metrics_invoke_state)
         choice_lambda_state.otherwise(failure_state)
 
-        
-        # Define transitions        
+        # State 'Were the gateway metrics published?'
+        choice_metrics_state = sfn.Choice(self, "Were the gateway metrics published?")
+        choice_metrics_state.when(sfn.Condition.number_equals("$.cloudwatch_metrics.Payload.status", 200), success_state)
+        choice_metrics_state.otherwise(failure_state)
+
+        # Define transitions
         lambda_invoke_state.next(choice_lambda_state)
+        metrics_invoke_state.next(choice_metrics_state)
         
 
         # Crreate a state machine
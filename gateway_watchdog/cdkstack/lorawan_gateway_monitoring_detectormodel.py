@@ -16,6 +16,9 @@
 
 
 initial_state_name = "Initial"
+key = "gatewayid"
+evaluation_method = "BATCH"
+input_name = "LoRaWANGatewayConnectivityStatusInput"
 
 
 def get_states(self):
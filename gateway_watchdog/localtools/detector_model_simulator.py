@@ -0,0 +1,567 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+#
+# Local simulator for AWS IoT Events detector models.
+#
+# Interprets the state definition of cdkstack/lorawan_gateway_monitoring_detectormodel.py (or any
+# other list of states in the same format) without deploying it:
+# - one detector instance per key value, created on the first input for that key
+# - onEnter, onInput and onExit events, transitionEvents and their conditions
+# - setVariable, setTimer, resetTimer and clearTimer
+# - other actions (iotTopicPublish, sns, ...) are not executed but reported with their evaluated
+#   MQTT topic and payload
+# - SERIAL and BATCH evaluation methods
+#
+# Time is the timestamp of the replayed inputs, not the wall clock. Pending timers of all detectors
+# are kept in one heap, so inputs can be replayed much faster than real time.
+#
+# Benchmark:
+#   python localtools/detector_model_simulator.py --gateways 10000 --events 1000000
+#
+
+import argparse
+import heapq
+import itertools
+import os
+import random
+import re
+import sys
+import time
+from collections import Counter, namedtuple
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cdkstack"))
+
+import lorawan_gateway_monitoring_detectormodel  # noqa: E402
+
+# Action which is not executed by the simulator, e.g. iotTopicPublish or sns
+EmittedAction = namedtuple("EmittedAction", ["timestamp", "key", "state", "event_name", "action_type", "mqtt_topic", "payload", "action"])
+
+EVALUATION_METHODS = ("SERIAL", "BATCH")
+
+
+class ExpressionError(Exception):
+    """Raised when an expression can not be parsed"""
+    pass
+
+
+####################################################################################
+# Expressions
+
+TOKEN_REGEX = re.compile(r"""\s*(?:
+    (?P<number>\d+(?:\.\d+)?)
+    |(?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+    |(?P<variable>\$variable\.[A-Za-z_]\w*)
+    |(?P<input>\$input\.[A-Za-z_][\w.]*)
+    |(?P<name>[A-Za-z_]\w*)
+    |(?P<operator>&&|\|\||==|!=|<=|>=|[-+*/%<>!(),])
+    )""", re.VERBOSE)
+
+BINARY_OPERATOR_PRECEDENCE = {
+    "||": 1,
+    "&&": 2,
+    "==": 3, "!=": 3,
+    "<": 4, "<=": 4, ">": 4, ">=": 4,
+    "+": 5, "-": 5,
+    "*": 6, "/": 6, "%": 6
+}
+
+
+class EvaluationContext:
+    """ Values an expression is evaluated with """
+    __slots__ = ["variables", "input_name", "message", "timed_out"]
+
+    def __init__(self, variables: dict, input_name: str = None, message: dict = None, timed_out: str = None):
+        self.variables = variables
+        self.input_name = input_name
+        self.message = message
+        self.timed_out = timed_out
+
+
+def tokenize(expression: str) -> list:
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = TOKEN_REGEX.match(expression, position)
+        if match is None or match.end() == position:
+            raise ExpressionError(f"Unexpected character at position {position} of expression {expression}")
+        tokens.append((match.lastgroup, match.group(match.lastgroup)))
+        position = match.end()
+    return tokens
+
+
+def to_string(value) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def add(a, b):
+    if a is None or b is None:
+        return None
+    if isinstance(a, str) or isinstance(b, str):
+        return to_string(a) + to_string(b)
+    return a + b
+
+
+def arithmetic(operation):
+    def evaluate(a, b):
+        if a is None or b is None:
+            return None
+        return operation(a, b)
+    return evaluate
+
+
+def comparison(operation):
+    def evaluate(a, b):
+        if a is None or b is None:
+            return False
+        return operation(a, b)
+    return evaluate
+
+
+BINARY_OPERATORS = {
+    "+": add,
+    "-": arithmetic(lambda a, b: a - b),
+    "*": arithmetic(lambda a, b: a * b),
+    "/": arithmetic(lambda a, b: a / b),
+    "%": arithmetic(lambda a, b: a % b),
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": comparison(lambda a, b: a < b),
+    "<=": comparison(lambda a, b: a <= b),
+    ">": comparison(lambda a, b: a > b),
+    ">=": comparison(lambda a, b: a >= b)
+}
+
+FUNCTIONS = {
+    "isUndefined": lambda value: value is None,
+    "isNull": lambda value: value is None,
+    "isNumeric": lambda value: isinstance(value, (int, float)) and not isinstance(value, bool),
+    "isString": lambda value: isinstance(value, str),
+    "isBoolean": lambda value: isinstance(value, bool)
+}
+
+
+class ExpressionParser:
+    """ Compiles an AWS IoT Events expression into a function of an EvaluationContext """
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        self.tokens = tokenize(expression)
+        self.position = 0
+
+    def compile(self):
+        if not self.tokens:
+            raise ExpressionError("Empty expression")
+        function = self.parse_binary(1)
+        if self.position != len(self.tokens):
+            raise ExpressionError(f"Unexpected token {self.tokens[self.position][1]} in expression {self.expression}")
+        return function
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def take(self, value: str = None):
+        token = self.peek()
+        if token[0] is None or (value is not None and token[1] != value):
+            raise ExpressionError(f"Expected {value or 'a value'} in expression {self.expression}")
+        self.position += 1
+        return token
+
+    def parse_binary(self, min_precedence: int):
+        left = self.parse_unary()
+        while True:
+            kind, value = self.peek()
+            precedence = BINARY_OPERATOR_PRECEDENCE.get(value) if kind == "operator" else None
+            if precedence is None or precedence < min_precedence:
+                return left
+            self.position += 1
+            right = self.parse_binary(precedence + 1)
+            left = self.binary(value, left, right)
+
+    @staticmethod
+    def binary(operator: str, left, right):
+        if operator == "&&":
+            return lambda context: bool(left(context)) and bool(right(context))
+        if operator == "||":
+            return lambda context: bool(left(context)) or bool(right(context))
+        operation = BINARY_OPERATORS[operator]
+        return lambda context: operation(left(context), right(context))
+
+    def parse_unary(self):
+        kind, value = self.peek()
+        if kind == "operator" and value == "!":
+            self.position += 1
+            operand = self.parse_unary()
+            return lambda context: not operand(context)
+        if kind == "operator" and value == "-":
+            self.position += 1
+            operand = self.parse_unary()
+            return lambda context: None if operand(context) is None else -operand(context)
+        return self.parse_primary()
+
+    def parse_primary(self):
+        kind, value = self.take()
+        if kind == "number":
+            constant = float(value) if "." in value else int(value)
+            return lambda context: constant
+        if kind == "string":
+            constant = re.sub(r"\\(.)", r"\1", value[1:-1])
+            return lambda context: constant
+        if kind == "variable":
+            name = value[len("$variable."):]
+            return lambda context: context.variables.get(name)
+        if kind == "input":
+            input_name, _, path = value[len("$input."):].partition(".")
+            keys = path.split(".") if path else []
+            return lambda context: self.input_value(context, input_name, keys)
+        if kind == "operator" and value == "(":
+            function = self.parse_binary(1)
+            self.take(")")
+            return function
+        if kind == "name":
+            if value in ("true", "false"):
+                constant = value == "true"
+                return lambda context: constant
+            return self.parse_call(value)
+        raise ExpressionError(f"Unexpected token {value} in expression {self.expression}")
+
+    def parse_call(self, name: str):
+        self.take("(")
+        argument = self.parse_binary(1)
+        self.take(")")
+        if name == "timeout":
+            return lambda context: context.timed_out is not None and context.timed_out == argument(context)
+        function = FUNCTIONS.get(name)
+        if function is None:
+            raise ExpressionError(f"Unsupported function {name} in expression {self.expression}")
+        return lambda context: function(argument(context))
+
+    @staticmethod
+    def input_value(context: EvaluationContext, input_name: str, keys: list):
+        if context.input_name != input_name:
+            return None
+        value = context.message
+        for key in keys:
+            if not isinstance(value, dict):
+                return None
+            value = value.get(key)
+        return value
+
+
+def compile_expression(expression):
+    if not isinstance(expression, str):
+        # E.g. "seconds": 300
+        return lambda context: expression
+    return ExpressionParser(expression).compile()
+
+
+####################################################################################
+# Detector model
+
+class CompiledEvent:
+    __slots__ = ["name", "condition", "actions", "next_state"]
+
+    def __init__(self, event: dict):
+        self.name = event.get("eventName")
+        self.condition = compile_expression(event.get("condition", "true"))
+        self.actions = [self.compile_action(action) for action in event.get("actions", [])]
+        self.next_state = event.get("nextState")
+
+    @staticmethod
+    def compile_action(action: dict) -> tuple:
+        """ Returns (action type, variable/timer name or MQTT topic expression, value expression, action) """
+        if "setVariable" in action:
+            return ("setVariable", action["setVariable"]["variableName"], compile_expression(action["setVariable"]["value"]), action)
+        if "setTimer" in action:
+            timer = action["setTimer"]
+            seconds = timer.get("durationExpression", timer.get("seconds"))
+            return ("setTimer", timer["timerName"], compile_expression(seconds), action)
+        if "resetTimer" in action:
+            return ("resetTimer", action["resetTimer"]["timerName"], None, action)
+        if "clearTimer" in action:
+            return ("clearTimer", action["clearTimer"]["timerName"], None, action)
+
+        (action_type, spec), = action.items()
+        mqtt_topic = spec.get("mqttTopic")
+        content = spec.get("payload", {}).get("contentExpression")
+        return (action_type,
+                compile_expression(mqtt_topic) if mqtt_topic is not None else None,
+                compile_expression(content) if content is not None else None,
+                action)
+
+
+class CompiledState:
+    __slots__ = ["name", "on_enter", "on_input", "transitions", "on_exit"]
+
+    def __init__(self, state: dict):
+        self.name = state["stateName"]
+        self.on_enter = [CompiledEvent(e) for e in state.get("onEnter", {}).get("events", [])]
+        self.on_input = [CompiledEvent(e) for e in state.get("onInput", {}).get("events", [])]
+        self.transitions = [CompiledEvent(e) for e in state.get("onInput", {}).get("transitionEvents", [])]
+        self.on_exit = [CompiledEvent(e) for e in state.get("onExit", {}).get("events", [])]
+
+
+class Detector:
+    """ Instance of the detector model for one key value """
+    __slots__ = ["key", "state", "variables", "timers"]
+
+    def __init__(self, key: str, state: CompiledState):
+        self.key = key
+        self.state = state
+        self.variables = {}
+        # timer name -> (deadline, sequence number of the heap entry, duration in seconds)
+        self.timers = {}
+
+
+class DetectorModelSimulator:
+    """ Executes a detector model definition locally
+
+        Parameters
+        ----------
+        states : list
+            States of the detector model definition, e.g. lorawan_gateway_monitoring_detectormodel.get_states(...)
+        initial_state_name : str
+            Name of the state new detectors start in
+        key : str
+            Attribute of the input messages which identifies the detector instance
+        evaluation_method : str
+            SERIAL: actions of an event are visible to the conditions of the following events
+            BATCH: all events of an input are evaluated with the variables before the input
+        on_action : function
+            Called with an EmittedAction for every action which is not executed by the simulator.
+            By default, these are appended to the list 'emitted_actions'.
+    """
+
+    def __init__(self, states: list, initial_state_name: str, key: str, evaluation_method: str = "BATCH", on_action=None):
+        if evaluation_method not in EVALUATION_METHODS:
+            raise ValueError(f"evaluation_method must be one of {EVALUATION_METHODS}")
+        self.states = {state["stateName"]: CompiledState(state) for state in states}
+        self.initial_state = self.states[initial_state_name]
+        self.key = key
+        self.batch = evaluation_method == "BATCH"
+        self.emitted_actions = []
+        self.on_action = on_action if on_action is not None else self.emitted_actions.append
+        self.detectors = {}
+        self.now = None
+        self.inputs_processed = 0
+        self.timers_fired = 0
+        # (deadline, sequence number, detector, timer name)
+        self._timer_heap = []
+        self._sequence = itertools.count()
+
+    def advance(self, timestamp: float) -> None:
+        """ Moves the clock forward and fires all timers with a deadline up to the timestamp """
+        if self.now is not None and timestamp < self.now:
+            raise ValueError(f"Timestamp {timestamp} is before the current time {self.now}")
+        heap = self._timer_heap
+        while heap and heap[0][0] <= timestamp:
+            deadline, sequence, detector, timer_name = heapq.heappop(heap)
+            timer = detector.timers.get(timer_name)
+            if timer is None or timer[1] != sequence:
+                # Timer was cleared or set again
+                continue
+            del detector.timers[timer_name]
+            self.now = deadline
+            self.timers_fired += 1
+            self._on_input(detector, EvaluationContext(detector.variables, timed_out=timer_name))
+        self.now = timestamp
+
+    def put_message(self, input_name: str, message: dict, timestamp: float) -> None:
+        """ Processes an input message like BatchPutMessage """
+        self.advance(timestamp)
+        key_value = message.get(self.key)
+        detector = self.detectors.get(key_value)
+        if detector is None:
+            detector = Detector(key_value, self.initial_state)
+            self.detectors[key_value] = detector
+            self._run_events(detector, detector.state.on_enter, EvaluationContext(detector.variables))
+        self.inputs_processed += 1
+        self._on_input(detector, EvaluationContext(detector.variables, input_name, message))
+
+    def replay(self, inputs) -> None:
+        """ Processes an iterable of (timestamp, input name, message) sorted by timestamp """
+        for timestamp, input_name, message in inputs:
+            self.put_message(input_name, message, timestamp)
+
+    def pending_timers(self) -> int:
+        return sum(len(detector.timers) for detector in self.detectors.values())
+
+    def state_counts(self) -> Counter:
+        return Counter(detector.state.name for detector in self.detectors.values())
+
+    def _on_input(self, detector: Detector, context: EvaluationContext) -> None:
+        state = detector.state
+        if self.batch:
+            # Conditions and values see the variables before the input
+            context.variables = dict(detector.variables)
+        self._run_events(detector, state.on_input, context)
+        for transition in state.transitions:
+            if transition.condition(context):
+                self._run_actions(detector, transition, context)
+                self._run_events(detector, state.on_exit, EvaluationContext(detector.variables))
+                detector.state = self.states[transition.next_state]
+                self._run_events(detector, detector.state.on_enter, EvaluationContext(detector.variables))
+                return
+
+    def _run_events(self, detector: Detector, events: list, context: EvaluationContext) -> None:
+        for event in events:
+            if event.condition(context):
+                self._run_actions(detector, event, context)
+
+    def _run_actions(self, detector: Detector, event: CompiledEvent, context: EvaluationContext) -> None:
+        for action_type, name_or_topic, expression, action in event.actions:
+            if action_type == "setVariable":
+                detector.variables[name_or_topic] = expression(context)
+            elif action_type == "setTimer":
+                self._set_timer(detector, name_or_topic, expression(context))
+            elif action_type == "resetTimer":
+                timer = detector.timers.get(name_or_topic)
+                if timer is not None:
+                    self._set_timer(detector, name_or_topic, timer[2])
+            elif action_type == "clearTimer":
+                detector.timers.pop(name_or_topic, None)
+            else:
+                self.on_action(EmittedAction(self.now, detector.key, detector.state.name, event.name, action_type,
+                                             name_or_topic(context) if name_or_topic is not None else None,
+                                             expression(context) if expression is not None else None,
+                                             action))
+
+    def _set_timer(self, detector: Detector, timer_name: str, seconds: float) -> None:
+        sequence = next(self._sequence)
+        deadline = self.now + seconds
+        detector.timers[timer_name] = (deadline, sequence, seconds)
+        heapq.heappush(self._timer_heap, (deadline, sequence, detector, timer_name))
+
+
+def gateway_monitoring_simulator(on_action=None) -> DetectorModelSimulator:
+    """ Returns a simulator for the gateway monitoring detector model of this stack """
+    model = lorawan_gateway_monitoring_detectormodel
+    stack = SimpleNamespace(region="us-east-1", account="123456789012")
+    return DetectorModelSimulator(model.get_states(stack), model.initial_state_name, model.key,
+                                  model.evaluation_method, on_action)
+
+
+####################################################################################
+# Benchmark
+
+def generate_status_events(gateways: int, events: int, interval_seconds: float, disconnect_probability: float, seed: int = 0):
+    """ Yields (timestamp, input name, message): every gateway reports its status every interval_seconds.
+        A gateway disconnects with disconnect_probability per report and reconnects with probability 0.5. """
+    rng = random.Random(seed)
+    connected = [True] * gateways
+    input_name = lorawan_gateway_monitoring_detectormodel.input_name
+    for i in range(events):
+        gateway = i % gateways
+        if connected[gateway]:
+            connected[gateway] = rng.random() >= disconnect_probability
+        else:
+            connected[gateway] = rng.random() < 0.5
+        timestamp = (i // gateways) * interval_seconds + gateway * interval_seconds / gateways
+        yield (timestamp, input_name, {
+            "gatewayid": f"gateway-{gateway:08d}",
+            "last_connection_status": "Connected" if connected[gateway] else "Disconnected",
+            "timestamp_iso8601": str(timestamp)
+        })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays simulated gateway status events through the gateway monitoring detector model")
+    parser.add_argument("--gateways", type=int, default=10000, help="Number of gateways")
+    parser.add_argument("--events", type=int, default=1000000, help="Number of status events")
+    parser.add_argument("--interval", type=float, default=60, help="Seconds between two status events of a gateway")
+    parser.add_argument("--disconnectprobability", type=float, default=0.01, help="Probability of a gateway to disconnect per status event")
+    args = parser.parse_args()
+
+    action_counts = Counter()
+    simulator = gateway_monitoring_simulator(on_action=lambda action: action_counts.update([(action.state, action.action_type)]))
+    events = generate_status_events(args.gateways, args.events, args.interval, args.disconnectprobability)
+
+    start = time.perf_counter()
+    simulator.replay(events)
+    elapsed = time.perf_counter() - start
+
+    print(f"Replayed {simulator.inputs_processed} events of {len(simulator.detectors)} gateways in {elapsed:.2f}s "
+          f"({simulator.inputs_processed / elapsed:,.0f} events/s, {simulator.now / max(elapsed, 1e-9):,.0f}x real time)")
+    print(f"Timers fired: {simulator.timers_fired}, pending: {simulator.pending_timers()}")
+    print(f"Detector states: {dict(simulator.state_counts())}")
+    for (state, action_type), count in sorted(action_counts.items()):
+        print(f"Actions on entering {state}: {action_type}={count}")
+
+
+def status_message(gateway_id: str, status: str) -> dict:
+    return {"gatewayid": gateway_id, "last_connection_status": status, "timestamp_iso8601": "2021-01-01T00:00:00"}
+
+
+def test_expressions():
+    context = EvaluationContext({"count": 2, "gatewayid": "gw1"}, "In", {"a": {"b": "x"}})
+    assert compile_expression("$variable.count + 1")(context) == 3
+    assert compile_expression("'topic/'+$variable.gatewayid")(context) == "topic/gw1"
+    assert compile_expression("$input.In.a.b == 'x' && !($variable.missing == true)")(context) is True
+    assert compile_expression("$variable.missing != true")(context) is True
+    assert compile_expression("$input.Other.a == 'x'")(context) is False
+    assert compile_expression("2 + 3 * 4 > 13 || false")(context) is True
+    assert compile_expression("timeout('T')")(context) is False
+    assert compile_expression("isUndefined($variable.missing)")(context) is True
+
+
+def test_gateway_disconnect_after_timer():
+    simulator = gateway_monitoring_simulator()
+    input_name = lorawan_gateway_monitoring_detectormodel.input_name
+    simulator.put_message(input_name, status_message("gw1", "Connected"), 0)
+    assert simulator.detectors["gw1"].state.name == "Connected"
+    assert [(a.action_type, a.mqtt_topic) for a in simulator.emitted_actions] == [
+        ("iotTopicPublish", "awsiotcorelorawan/events/presence/connected/gw1"),
+        ("sns", None)
+    ]
+    assert simulator.emitted_actions[1].payload == "RECONNECTED: Gateway gw1 has established a connection to AWS IoT Core for LoRaWAN"
+
+    # A short disconnect is not reported
+    simulator.put_message(input_name, status_message("gw1", "Disconnected"), 60)
+    simulator.put_message(input_name, status_message("gw1", "Connected"), 120)
+    simulator.advance(1000)
+    assert simulator.detectors["gw1"].state.name == "Connected"
+    assert len(simulator.emitted_actions) == 2
+
+    # Repeated disconnected status does not restart the timer
+    simulator.put_message(input_name, status_message("gw1", "Disconnected"), 1000)
+    simulator.put_message(input_name, status_message("gw1", "Disconnected"), 1200)
+    simulator.advance(1299)
+    assert simulator.detectors["gw1"].state.name == "Connected"
+    simulator.advance(1300)
+    assert simulator.detectors["gw1"].state.name == "Disconnected"
+    assert simulator.emitted_actions[2].timestamp == 1300
+    assert simulator.emitted_actions[2].mqtt_topic == "awsiotcorelorawan/events/presence/disconnected/gw1"
+    assert simulator.detectors["gw1"].variables["input_message_count"] == 6
+    assert simulator.detectors["gw1"].variables["disconnected_timer_pending"] is False
+
+
+def test_one_detector_per_gateway():
+    simulator = gateway_monitoring_simulator()
+    simulator.replay(generate_status_events(gateways=100, events=10000, interval_seconds=60, disconnect_probability=0.05))
+    assert len(simulator.detectors) == 100
+    assert simulator.inputs_processed == 10000
+    assert simulator.timers_fired > 0
+    assert sum(simulator.state_counts().values()) == 100
+
+
+if __name__ == "__main__":
+    main()
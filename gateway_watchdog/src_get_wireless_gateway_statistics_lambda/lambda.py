@@ -94,6 +94,8 @@ def handler(event, context):
 
     gateway_ids = []
     errors = []
+    # Datapoints for the Lambda function in src_put_cloudwatch_metrics, invoked by the next state of the state machine
+    metrics = []
 
     try:
         if ("GatewayId" in event):
@@ -121,13 +123,18 @@ def handler(event, context):
 
                 put_events_message(gateway_id,
                                    connection_status=updated_connection_status, last_uplink_received_timestamp_ms=updated_last_uplink_received_timestamp_ms)
+                metrics.append({"GatewayId": gateway_id, "MetricName": "Connected",
+                                "MetricValueNumeric": 1 if updated_connection_status == "Connected" else 0})
+                metrics.append({"GatewayId": gateway_id, "MetricName": "SecondsSinceLastUplink",
+                                "MetricValueNumeric": max(0, round(time.time() - updated_last_uplink_received_timestamp_ms / 1000))})
             else:
                 logger.info(f"Gateway {gateway_id} is lacking 'ConnectionStastus', must has never yet connected. Ignoring it.")
 
         result = {
             "status": 200,
             "timestamp_ms": str(round(time.time())),
-            "errors": errors
+            "errors": errors,
+            "Metrics": metrics
         }
         return result
     except Exception as e:
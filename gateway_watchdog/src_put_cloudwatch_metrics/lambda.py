@@ -21,6 +21,8 @@ import logging
 import os
 import sys
 
+from metrics_publisher import MetricsPublisher, MODE_API, AGGREGATION_VALUES
+
 # Define parameters for check of input validity
 OBLIGATORY_PARAMETERS = ["GatewayId", "MetricName", "MetricValueNumeric"]
 
@@ -44,6 +46,16 @@ else:
 
 logger.info(f"TEST_MODE is {TEST_MODE}")
 
+# Publish metrics with PutMetricData ("api") or as embedded metric format lines written to the log ("emf")
+METRICS_MODE = os.environ.get("METRICS_MODE", MODE_API)
+# Send all distinct values ("values") or statistic sets ("statistics") with PutMetricData
+METRICS_AGGREGATION = os.environ.get("METRICS_AGGREGATION", AGGREGATION_VALUES)
+
+metrics_publisher = MetricsPublisher(namespace="LoRaWAN",
+                                     mode=METRICS_MODE,
+                                     client=client_cloudwatch,
+                                     aggregation=METRICS_AGGREGATION)
+
 
 class MissingParameterInEvent(Exception):
     """Raised when the parameter is missing"""
@@ -51,42 +63,33 @@ class MissingParameterInEvent(Exception):
 
 
 def put_cloudwatch_metric_number(metric_name: str, metric_value: int, gatewayid: str) -> None:
-    response = client_cloudwatch.put_metric_data(
-        MetricData=[
-            {
-                'MetricName': metric_name,
-                'Dimensions': [
-                    {
-                        'Name': 'GATEWAYID',
-                        'Value': gatewayid
-                    }
-                ],
-                'Unit': 'None',
-                'Value': metric_value
-            },
-        ],
-        Namespace='LoRaWAN'
-    )
+    """ Buffers a datapoint, it is published on the next metrics_publisher.flush() """
+    metrics_publisher.put(metric_name, metric_value, {"GATEWAYID": gatewayid})
 
 
 def handler(event, context):
     logger.info("Received event: %s" % json.dumps(event))
 
+    # A list of datapoints can be provided in "Metrics", otherwise the event is a single datapoint
+    metrics = event.get("Metrics", [event])
+
     # Check if all the necessary params are included and return an error ststus otherwise
-    for i in OBLIGATORY_PARAMETERS:
-        if i not in event:
-            logger.error(f"Parameter {i} missing ")
-            return {
-                "status": 500,
-                "errormessage": f"Parameter {i} missing"
-            }
+    for metric in metrics:
+        for i in OBLIGATORY_PARAMETERS:
+            if i not in metric:
+                logger.error(f"Parameter {i} missing ")
+                return {
+                    "status": 500,
+                    "errormessage": f"Parameter {i} missing"
+                }
 
     try:
-
-        response = put_cloudwatch_metric_number(metric_name=event.get("MetricName"),
-                                                metric_value=event.get("MetricValueNumeric"),
-                                                gatewayid=event.get("GatewayId")
-                                                )
+        for metric in metrics:
+            put_cloudwatch_metric_number(metric_name=metric.get("MetricName"),
+                                         metric_value=metric.get("MetricValueNumeric"),
+                                         gatewayid=metric.get("GatewayId")
+                                         )
+        response = metrics_publisher.flush()
         result = {
             "status": 200,
             "trace": response
@@ -0,0 +1,332 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+#
+# Buffering publisher for CloudWatch metrics.
+#
+# Datapoints are buffered per metric name, dimensions and unit and published on flush():
+# - MODE_API: with as few PutMetricData calls as possible. Datapoints of the same metric are sent
+#   as one MetricDatum with Values/Counts arrays (AGGREGATION_VALUES) or as a statistic set
+#   (AGGREGATION_STATISTICS), and up to max_datums_per_request MetricDatums are sent per call, as
+#   long as the estimated size of the request stays below max_request_bytes.
+# - MODE_EMF: as CloudWatch Embedded Metric Format lines written to stdout. AWS Lambda sends
+#   them to CloudWatch Logs, which extracts the metrics without any PutMetricData call.
+#
+
+import json
+import sys
+from collections import OrderedDict
+from time import time
+from urllib.parse import quote
+
+MODE_API = "api"
+MODE_EMF = "emf"
+
+AGGREGATION_VALUES = "values"
+AGGREGATION_STATISTICS = "statistics"
+
+# Limits of PutMetricData
+MAX_DATUMS_PER_REQUEST = 1000
+MAX_VALUES_PER_DATUM = 150
+MAX_REQUEST_BYTES = 1000000
+# Reserved for the parameters of a request other than MetricData (Action, Version, Namespace)
+REQUEST_OVERHEAD_BYTES = 1024
+
+# Limits of the embedded metric format
+MAX_METRICS_PER_EMF_LINE = 100
+MAX_VALUES_PER_EMF_METRIC = 100
+
+
+def chunks(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def query_size(value, prefix: str) -> int:
+    """ Returns the size of a value in the form-encoded query protocol of PutMetricData, e.g.
+        "MetricData.member.1.Values.member.1=-80&". Larger than the size in the JSON protocol. """
+    if isinstance(value, dict):
+        return sum(query_size(item, f"{prefix}.{key}") for key, item in value.items())
+    if isinstance(value, list):
+        return sum(query_size(item, f"{prefix}.member.{i + 1}") for i, item in enumerate(value))
+    return len(quote(prefix, safe="")) + len(quote(str(value), safe="")) + 2
+
+
+def datum_size(datum: dict) -> int:
+    """ Returns the size of a MetricDatum in a request, assuming the largest index in MetricData """
+    return query_size(datum, f"MetricData.member.{MAX_DATUMS_PER_REQUEST}")
+
+
+def batches(metric_data: list, max_datums: int, max_bytes: int):
+    """ Splits MetricDatums into batches of at most max_datums datums and max_bytes bytes """
+    batch, batch_bytes = [], REQUEST_OVERHEAD_BYTES
+    for datum in metric_data:
+        size = datum_size(datum)
+        if batch and (len(batch) == max_datums or batch_bytes + size > max_bytes):
+            yield batch
+            batch, batch_bytes = [], REQUEST_OVERHEAD_BYTES
+        batch.append(datum)
+        batch_bytes += size
+    if batch:
+        yield batch
+
+
+class MetricsPublisher:
+    """ Buffers datapoints and publishes them in batches
+
+        Parameters
+        ----------
+        namespace : str
+            CloudWatch namespace of the metrics
+        mode : str
+            MODE_API to use PutMetricData, MODE_EMF to write embedded metric format lines
+        client : botocore client
+            CloudWatch client, only required for MODE_API
+        aggregation : str
+            AGGREGATION_VALUES keeps all distinct values (percentiles remain available),
+            AGGREGATION_STATISTICS sends SampleCount, Sum, Minimum and Maximum only
+        max_datums_per_request : int
+            Maximum number of MetricDatums per PutMetricData call
+        max_request_bytes : int
+            Maximum size of a PutMetricData request
+        stream
+            Output for MODE_EMF, stdout by default
+    """
+
+    def __init__(self, namespace: str, mode: str = MODE_API, client=None, aggregation: str = AGGREGATION_VALUES,
+                 max_datums_per_request: int = MAX_DATUMS_PER_REQUEST, max_request_bytes: int = MAX_REQUEST_BYTES,
+                 stream=None):
+        if mode not in (MODE_API, MODE_EMF):
+            raise ValueError(f"mode must be {MODE_API} or {MODE_EMF}")
+        if aggregation not in (AGGREGATION_VALUES, AGGREGATION_STATISTICS):
+            raise ValueError(f"aggregation must be {AGGREGATION_VALUES} or {AGGREGATION_STATISTICS}")
+        if mode == MODE_API and client is None:
+            raise ValueError(f"A CloudWatch client is required for mode {MODE_API}")
+        self.namespace = namespace
+        self.mode = mode
+        self.client = client
+        self.aggregation = aggregation
+        self.max_datums_per_request = max_datums_per_request
+        self.max_request_bytes = max_request_bytes
+        self.stream = stream
+        # (metric name, dimensions as tuple of (name, value), unit) -> OrderedDict of value -> count
+        self._buffer = OrderedDict()
+
+    def put(self, metric_name: str, value: float, dimensions: dict = None, unit: str = "None") -> None:
+        """ Adds a datapoint to the buffer """
+        key = (metric_name, tuple(sorted((dimensions or {}).items())), unit)
+        values = self._buffer.setdefault(key, OrderedDict())
+        values[value] = values.get(value, 0) + 1
+
+    def pending(self) -> int:
+        """ Returns the number of buffered datapoints """
+        return sum(sum(values.values()) for values in self._buffer.values())
+
+    def flush(self) -> list:
+        """ Publishes and clears the buffer
+
+            Returns
+            -------
+            List of PutMetricData responses (MODE_API) or of written lines (MODE_EMF)
+        """
+        buffer, self._buffer = self._buffer, OrderedDict()
+        if not buffer:
+            return []
+        if self.mode == MODE_EMF:
+            return self._flush_emf(buffer)
+        return self._flush_api(buffer)
+
+    def _metric_data(self, buffer: OrderedDict) -> list:
+        metric_data = []
+        for (metric_name, dimensions, unit), values in buffer.items():
+            datum = {
+                "MetricName": metric_name,
+                "Dimensions": [{"Name": name, "Value": value} for name, value in dimensions],
+                "Unit": unit
+            }
+            if self.aggregation == AGGREGATION_STATISTICS:
+                metric_data.append(dict(datum, StatisticValues={
+                    "SampleCount": sum(values.values()),
+                    "Sum": sum(value * count for value, count in values.items()),
+                    "Minimum": min(values),
+                    "Maximum": max(values)
+                }))
+                continue
+            for chunk in chunks(list(values.items()), MAX_VALUES_PER_DATUM):
+                metric_data.append(dict(datum,
+                                        Values=[value for value, count in chunk],
+                                        Counts=[count for value, count in chunk]))
+        return metric_data
+
+    def _flush_api(self, buffer: OrderedDict) -> list:
+        return [self.client.put_metric_data(Namespace=self.namespace, MetricData=metric_data)
+                for metric_data in batches(self._metric_data(buffer), self.max_datums_per_request, self.max_request_bytes)]
+
+    def _flush_emf(self, buffer: OrderedDict) -> list:
+        timestamp = int(time() * 1000)
+
+        # Metrics with the same dimensions share an embedded metric format line
+        metrics_by_dimensions = OrderedDict()
+        for (metric_name, dimensions, unit), values in buffer.items():
+            metrics_by_dimensions.setdefault(dimensions, []).append((metric_name, unit, values))
+
+        lines = []
+        for dimensions, metrics in metrics_by_dimensions.items():
+            # A metric name may only appear once per line, additional values go to further lines
+            entries = []
+            for metric_name, unit, values in metrics:
+                expanded = [value for value, count in values.items() for _ in range(count)]
+                for i, chunk in enumerate(chunks(expanded, MAX_VALUES_PER_EMF_METRIC)):
+                    entries.append((i, metric_name, unit, chunk))
+            entries.sort(key=lambda entry: entry[0])
+
+            line_entries = []
+            for entry in entries:
+                if len(line_entries) == MAX_METRICS_PER_EMF_LINE or any(e[1] == entry[1] for e in line_entries):
+                    lines.append(self._emf_line(timestamp, dimensions, line_entries))
+                    line_entries = []
+                line_entries.append(entry)
+            lines.append(self._emf_line(timestamp, dimensions, line_entries))
+
+        stream = self.stream or sys.stdout
+        for line in lines:
+            stream.write(line + "\n")
+        stream.flush()
+        return lines
+
+    def _emf_line(self, timestamp: int, dimensions: tuple, entries: list) -> str:
+        document = {
+            "_aws": {
+                "Timestamp": timestamp,
+                "CloudWatchMetrics": [{
+                    "Namespace": self.namespace,
+                    "Dimensions": [[name for name, value in dimensions]],
+                    "Metrics": [{"Name": metric_name, "Unit": unit} for _, metric_name, unit, _ in entries]
+                }]
+            }
+        }
+        document.update(dimensions)
+        for _, metric_name, unit, values in entries:
+            document[metric_name] = values if len(values) > 1 else values[0]
+        return json.dumps(document)
+
+
+class RecordingCloudWatchClient:
+    """ Records PutMetricData calls, for tests """
+
+    def __init__(self):
+        self.calls = []
+
+    def put_metric_data(self, **kwargs):
+        self.calls.append(kwargs)
+        return {"ResponseMetadata": {"HTTPStatusCode": 200}}
+
+
+def test_api_batching():
+    client = RecordingCloudWatchClient()
+    publisher = MetricsPublisher("LoRaWAN", client=client, max_datums_per_request=2)
+    for gateway_id in ["gw1", "gw2", "gw3"]:
+        publisher.put("Connected", 1, {"GATEWAYID": gateway_id})
+    publisher.put("Connected", 1, {"GATEWAYID": "gw1"})
+    publisher.put("Connected", 0, {"GATEWAYID": "gw1"})
+    assert publisher.pending() == 5
+
+    publisher.flush()
+    assert publisher.pending() == 0
+    assert [len(call["MetricData"]) for call in client.calls] == [2, 1]
+    assert client.calls[0]["MetricData"][0] == {
+        "MetricName": "Connected",
+        "Dimensions": [{"Name": "GATEWAYID", "Value": "gw1"}],
+        "Unit": "None",
+        "Values": [1, 0],
+        "Counts": [2, 1]
+    }
+    assert publisher.flush() == []
+    assert len(client.calls) == 2
+
+
+def test_api_values_limit():
+    client = RecordingCloudWatchClient()
+    publisher = MetricsPublisher("LoRaWAN", client=client)
+    for value in range(MAX_VALUES_PER_DATUM + 1):
+        publisher.put("Rssi", value, {"GATEWAYID": "gw1"})
+    publisher.flush()
+    assert len(client.calls) == 1
+    assert [len(datum["Values"]) for datum in client.calls[0]["MetricData"]] == [MAX_VALUES_PER_DATUM, 1]
+
+
+def test_api_request_size_limit():
+    client = RecordingCloudWatchClient()
+    publisher = MetricsPublisher("LoRaWAN", client=client, max_request_bytes=100000)
+    # 100 gateways with 150 distinct values each exceed 100 kB long before max_datums_per_request
+    for gateway in range(100):
+        for value in range(MAX_VALUES_PER_DATUM):
+            publisher.put("SecondsSinceLastUplink", value, {"GATEWAYID": f"{gateway:016x}"}, unit="Seconds")
+    publisher.flush()
+    assert len(client.calls) > 1
+    assert sum(len(call["MetricData"]) for call in client.calls) == 100
+    for call in client.calls:
+        assert REQUEST_OVERHEAD_BYTES + sum(datum_size(datum) for datum in call["MetricData"]) <= 100000
+
+
+def test_api_statistic_sets():
+    client = RecordingCloudWatchClient()
+    publisher = MetricsPublisher("LoRaWAN", client=client, aggregation=AGGREGATION_STATISTICS)
+    for value in [-80, -90, -80]:
+        publisher.put("Rssi", value, {"GATEWAYID": "gw1"})
+    publisher.flush()
+    assert client.calls[0]["MetricData"][0]["StatisticValues"] == {
+        "SampleCount": 3, "Sum": -250, "Minimum": -90, "Maximum": -80
+    }
+
+
+def test_emf():
+    import io
+    stream = io.StringIO()
+    publisher = MetricsPublisher("LoRaWAN", mode=MODE_EMF, stream=stream)
+    publisher.put("Connected", 1, {"GATEWAYID": "gw1"})
+    publisher.put("Uplinks", 3, {"GATEWAYID": "gw1"}, unit="Count")
+    publisher.put("Connected", 0, {"GATEWAYID": "gw2"})
+    lines = publisher.flush()
+    assert stream.getvalue() == "".join(line + "\n" for line in lines)
+    assert len(lines) == 2
+
+    document = json.loads(lines[0])
+    assert document["GATEWAYID"] == "gw1"
+    assert document["Connected"] == 1
+    assert document["Uplinks"] == 3
+    directive = document["_aws"]["CloudWatchMetrics"][0]
+    assert directive["Namespace"] == "LoRaWAN"
+    assert directive["Dimensions"] == [["GATEWAYID"]]
+    assert directive["Metrics"] == [{"Name": "Connected", "Unit": "None"}, {"Name": "Uplinks", "Unit": "Count"}]
+
+
+def test_emf_values_limit():
+    import io
+    publisher = MetricsPublisher("LoRaWAN", mode=MODE_EMF, stream=io.StringIO())
+    for value in range(MAX_VALUES_PER_EMF_METRIC + 1):
+        publisher.put("Rssi", value % 2, {"GATEWAYID": "gw1"})
+    lines = [json.loads(line) for line in publisher.flush()]
+    assert [len(line["Rssi"]) if isinstance(line["Rssi"], list) else 1 for line in lines] == [MAX_VALUES_PER_EMF_METRIC, 1]
+
+
+if __name__ == "__main__":
+    test_api_batching()
+    test_api_values_limit()
+    test_api_request_size_limit()
+    test_api_statistic_sets()
+    test_emf()
+    test_emf_values_limit()
@@ -30,12 +30,28 @@ import boto3
 import base64
 import traceback
 import logging
+import os
 import sys
 
+from downlink_queue import DownlinkQueue, SentDownlinks, DUPLICATE, COALESCED
+
+# Import payload encoders.
+#
+# If you want to implement additional payload encoders, please add a module "mylorawandevice.py"
+# with a function "payload_from_dict(command: dict, fport: int)" which returns a base64-encoded
+# binary payload, import it below and add it to PAYLOAD_ENCODERS.
+import rfi_power_switch
+import dragino_interval
+
+PAYLOAD_ENCODERS = {
+    "rfi_power_switch": rfi_power_switch.payload_from_dict,
+    "dragino_interval": dragino_interval.payload_from_dict
+}
 
 # Define parameters for check of input validity
 OBLIGATORY_PARAMETERS = ["WirelessDeviceId",
                          "PayloadData", "TransmitMode", "FPort"]
+OBLIGATORY_COMMAND_PARAMETERS = ["Command", "PayloadEncoderName", "TransmitMode", "FPort"]
 
 # Function name for logging
 FUNCTION_NAME = "SendDownlinkPayload"
@@ -47,6 +63,24 @@ logger.setLevel(logging.INFO)
 # Create an instance of a low-level client representing AWS IoT Core for LoRaWAN
 client = boto3.client("iotwireless")
 
+# Downlinks to the same device and FPort replace each other unless COALESCE_SAME_FPORT is 'false'
+COALESCE_SAME_FPORT = os.environ.get("COALESCE_SAME_FPORT", "true") == "true"
+# Identical downlinks sent to the same device within this period of time are dropped
+# (same default as the parameter DuplicateWindowSeconds in template.yaml)
+DUPLICATE_WINDOW_SECONDS = float(os.environ.get("DUPLICATE_WINDOW_SECONDS", "10"))
+# The API is called once per device, so the number of downlinks per invocation is limited to complete
+# within the timeout of the AWS Lambda function (same default as MaxDownlinksPerInvocation in template.yaml)
+MAX_DOWNLINKS_PER_INVOCATION = int(os.environ.get("MAX_DOWNLINKS_PER_INVOCATION", "50"))
+
+# Sent downlinks are kept for the lifetime of the AWS Lambda execution environment, so that duplicates
+# are also detected across invocations. Pending downlinks are queued per invocation, see new_queue:
+# only downlinks passed together in one "Downlinks" list are coalesced.
+sent_downlinks = SentDownlinks(DUPLICATE_WINDOW_SECONDS)
+
+
+def new_queue() -> DownlinkQueue:
+    return DownlinkQueue(coalesce_same_fport=COALESCE_SAME_FPORT, sent_downlinks=sent_downlinks)
+
 
 class MissingParameterInEvent(Exception):
     """Raised when the parameter is missing"""
@@ -82,9 +116,34 @@ def lambda_handler(event, context):
         TransmitMode : int
             Please consult AWS IoT Core for LoRaWAN documentation for details.
 
+        Downlinks : list (optional)
+            List of up to MAX_DOWNLINKS_PER_INVOCATION downlinks with the parameters above. If
+            provided, the downlinks are coalesced per device before sending, see send_downlinks.
+
+        Command, PayloadEncoderName (optional)
+            JSON command to encode with a payload encoder instead of providing PayloadData,
+            see send_command.
+
+        An identical downlink sent to the same device within DUPLICATE_WINDOW_SECONDS is dropped.
+
         """
     logger.info("Received event: %s" % json.dumps(event))
 
+    if "Downlinks" in event:
+        error = check_batch("Downlinks", event["Downlinks"])
+        if error:
+            return error
+        if not all(isinstance(downlink, dict) for downlink in event["Downlinks"]):
+            logger.error("Entries of Downlinks must be objects")
+            return {
+                "status": 500,
+                "errormessage": "Entries of Downlinks must be objects"
+            }
+        return send_downlinks(event["Downlinks"])
+
+    if "Command" in event:
+        return send_command(event)
+
     # Check if all the necessary params are included and return an error ststus otherwise
     for i in OBLIGATORY_PARAMETERS:
         if not i in event:
@@ -104,6 +163,190 @@ def lambda_handler(event, context):
 
     print(f"Decoded data : {payload_data_decoded}")
 
+    downlink_queue = new_queue()
+    if downlink_queue.enqueue(device_id, fport, transmit_mode, payload_data_decoded) == DUPLICATE:
+        logger.info(f"Dropping duplicate downlink for WirelessDeviceId {device_id}")
+        return {
+            "status": 200,
+            "Dropped": DUPLICATE,
+            "ParameterTrace": {
+                "PayloadData": payload_data_decoded,
+                "WirelessDeviceId": device_id,
+                "Fport": fport,
+                "TransmitMode": transmit_mode
+            }
+        }
+
+    return flush_device_queue(downlink_queue, device_id)[-1]
+
+
+def check_batch(name: str, items) -> dict:
+    """ Returns an error result if a batch of downlinks is not a list or too large, None otherwise """
+    if not isinstance(items, list):
+        logger.error(f"Parameter {name} must be a list")
+        return {
+            "status": 500,
+            "errormessage": f"Parameter {name} must be a list"
+        }
+    if len(items) > MAX_DOWNLINKS_PER_INVOCATION:
+        logger.error(f"Parameter {name} has {len(items)} entries, more than {MAX_DOWNLINKS_PER_INVOCATION}")
+        return {
+            "status": 500,
+            "errormessage": f"Parameter {name} must have at most {MAX_DOWNLINKS_PER_INVOCATION} entries"
+        }
+    return None
+
+
+def send_downlinks(downlinks: list) -> dict:
+    """ Coalesces and sends a list of downlinks
+
+        Each entry of the list has the same parameters as a single downlink event (see lambda_handler).
+        Pending downlinks are grouped per WirelessDeviceId, superseded downlinks on the same FPort
+        and exact duplicates are dropped before calling the API. All entries are validated before
+        any downlink is queued, invalid entries are reported in "Results".
+
+        Downlinks of separate invocations are not coalesced, only exact duplicates within
+        DUPLICATE_WINDOW_SECONDS are dropped across invocations.
+    """
+    errors = []
+    valid_downlinks = []
+
+    for downlink in downlinks:
+        missing = [i for i in OBLIGATORY_PARAMETERS if i not in downlink]
+        if missing:
+            logger.error(f"Parameter {missing[0]} missing ")
+            errors.append({
+                "status": 500,
+                "errormessage": f"Parameter {missing[0]} missing"
+            })
+            continue
+        try:
+            payload_data_decoded = base64.b64decode(downlink["PayloadData"]).decode("utf-8")
+        except (ValueError, TypeError) as e:
+            logger.error(f"Invalid PayloadData for WirelessDeviceId {downlink['WirelessDeviceId']} : " + str(e))
+            errors.append({
+                "status": 500,
+                "errormessage": f"Invalid PayloadData for WirelessDeviceId {downlink['WirelessDeviceId']}: {e}"
+            })
+            continue
+        valid_downlinks.append((downlink["WirelessDeviceId"], downlink["FPort"], downlink["TransmitMode"], payload_data_decoded))
+
+    downlink_queue = new_queue()
+    coalesced_count = 0
+    duplicate_count = 0
+    for valid_downlink in valid_downlinks:
+        enqueue_result = downlink_queue.enqueue(*valid_downlink)
+        if enqueue_result == COALESCED:
+            coalesced_count += 1
+        elif enqueue_result == DUPLICATE:
+            duplicate_count += 1
+
+    return flush_queue(downlink_queue, coalesced_count, duplicate_count, errors)
+
+
+def send_command(event: dict) -> dict:
+    """ Encodes a JSON command with a payload encoder and sends it to one or many devices
+
+        Parameters
+        ----------
+        Command : dict
+            Command to encode, e.g. {"interval": 60}
+        PayloadEncoderName : str
+            Name of the payload encoder, one of PAYLOAD_ENCODERS
+        WirelessDeviceId : str
+            AWS IoT Core for LoRaWAN Device Id
+        WirelessDeviceIds : list
+            Use instead of WirelessDeviceId to send the same command to up to
+            MAX_DOWNLINKS_PER_INVOCATION devices. The command is encoded only once.
+        FPort : int
+        TransmitMode : int
+    """
+    for i in OBLIGATORY_COMMAND_PARAMETERS:
+        if i not in event:
+            logger.error(f"Parameter {i} missing ")
+            return {
+                "status": 500,
+                "errormessage": f"Parameter {i} missing"
+            }
+
+    encoder_name = event["PayloadEncoderName"]
+    if encoder_name not in PAYLOAD_ENCODERS:
+        logger.error(f"Unknown payload encoder {encoder_name}")
+        return {
+            "status": 500,
+            "errormessage": "PayloadEncoderName must have one of the following values: " + ", ".join(PAYLOAD_ENCODERS)
+        }
+
+    if "WirelessDeviceIds" in event:
+        error = check_batch("WirelessDeviceIds", event["WirelessDeviceIds"])
+        if error:
+            return error
+
+    device_ids = event.get("WirelessDeviceIds") or [event.get("WirelessDeviceId")]
+    if None in device_ids:
+        logger.error("Parameter WirelessDeviceId missing ")
+        return {
+            "status": 500,
+            "errormessage": "Parameter WirelessDeviceId missing"
+        }
+
+    (fport, transmit_mode) = (event["FPort"], event["TransmitMode"])
+
+    try:
+        payload_data = PAYLOAD_ENCODERS[encoder_name](event["Command"], fport)
+    except Exception as e:
+        logger.error(f"Error encoding command with {encoder_name} : " + str(e))
+        return {
+            "status": 500,
+            "errormessage": str(e)
+        }
+
+    logger.info(f"Encoded command {json.dumps(event['Command'])} to {payload_data} for {len(device_ids)} device(s)")
+
+    downlink_queue = new_queue()
+    coalesced_count = 0
+    duplicate_count = 0
+    for device_id in device_ids:
+        enqueue_result = downlink_queue.enqueue(device_id, fport, transmit_mode, payload_data)
+        if enqueue_result == COALESCED:
+            coalesced_count += 1
+        elif enqueue_result == DUPLICATE:
+            duplicate_count += 1
+
+    return flush_queue(downlink_queue, coalesced_count, duplicate_count, [])
+
+
+def flush_queue(downlink_queue: DownlinkQueue, coalesced_count: int, duplicate_count: int, errors: list) -> dict:
+    """ Sends all pending downlinks of a queue and summarizes the results """
+    queue_depth = {device_id: downlink_queue.depth(device_id) for device_id in downlink_queue.devices()}
+    logger.info(f"Queue depth per device: {json.dumps(queue_depth)}, coalesced {coalesced_count}, duplicates {duplicate_count}")
+
+    results = []
+    for device_id in downlink_queue.devices():
+        results.extend(flush_device_queue(downlink_queue, device_id))
+    results.extend(errors)
+
+    return {
+        "status": 200 if all(r["status"] == 200 for r in results) else 500,
+        "QueueDepth": queue_depth,
+        "Coalesced": coalesced_count,
+        "Duplicates": duplicate_count,
+        "Results": results
+    }
+
+
+def flush_device_queue(downlink_queue: DownlinkQueue, device_id: str) -> list:
+    """ Sends all pending downlinks of a device and returns a list with a result per downlink """
+    results = []
+    for (fport, transmit_mode, payload_data_decoded) in downlink_queue.drain(device_id):
+        result = send_downlink(device_id, fport, transmit_mode, payload_data_decoded)
+        if result["status"] == 200:
+            downlink_queue.mark_sent(device_id, fport, transmit_mode, payload_data_decoded)
+        results.append(result)
+    return results
+
+
+def send_downlink(device_id: str, fport: int, transmit_mode: int, payload_data_decoded: str) -> dict:
     try:
         response = client.send_data_to_wireless_device(TransmitMode=transmit_mode,
                                                        Id=device_id,
@@ -0,0 +1,199 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+#
+# Per-device downlink queue.
+#
+# Class A devices can only receive one downlink per uplink, so sending several configuration
+# commands to the same device within a short period of time only fills up the device queue
+# of AWS IoT Core for LoRaWAN. This module keeps pending downlinks per WirelessDeviceId and
+# - coalesces commands on the same FPort (the last writer wins), if enabled
+# - drops exact duplicates of pending downlinks and of downlinks sent recently
+#
+# A DownlinkQueue holds the downlinks of one invocation. SentDownlinks remembers the downlinks sent
+# within the duplicate window and can be kept for the lifetime of the AWS Lambda execution environment.
+#
+
+from collections import OrderedDict
+from time import time
+
+# Results of DownlinkQueue.enqueue
+QUEUED = "queued"
+COALESCED = "coalesced"
+DUPLICATE = "duplicate"
+
+
+class SentDownlinks:
+    """ Downlinks sent within the last duplicate_window_seconds, for duplicate detection across invocations
+
+        Parameters
+        ----------
+        duplicate_window_seconds : float
+            Identical downlinks (FPort, TransmitMode and PayloadData) to the same device are duplicates
+            if they were sent less than this amount of seconds ago. Use 0 to disable.
+    """
+
+    def __init__(self, duplicate_window_seconds: float = 0):
+        self.duplicate_window_seconds = duplicate_window_seconds
+        # (WirelessDeviceId, (fport, transmit_mode, payload_data)) -> timestamp of sending, oldest first
+        self._sent = OrderedDict()
+
+    def __len__(self):
+        return len(self._sent)
+
+    def _prune(self, now: float) -> None:
+        """ Forgets downlinks outside of the duplicate window to keep memory bounded """
+        while self._sent:
+            key, sent_at = next(iter(self._sent.items()))
+            if now - sent_at < self.duplicate_window_seconds:
+                break
+            del self._sent[key]
+
+    def is_duplicate(self, device_id: str, downlink: tuple, now: float = None) -> bool:
+        if self.duplicate_window_seconds <= 0:
+            return False
+        self._prune(time() if now is None else now)
+        return (device_id, downlink) in self._sent
+
+    def mark_sent(self, device_id: str, downlink: tuple, now: float = None) -> None:
+        if self.duplicate_window_seconds <= 0:
+            return
+        now = time() if now is None else now
+        self._prune(now)
+        self._sent.pop((device_id, downlink), None)
+        self._sent[(device_id, downlink)] = now
+
+
+class DownlinkQueue:
+    """ Pending downlinks per WirelessDeviceId
+
+        Parameters
+        ----------
+        coalesce_same_fport : bool
+            If True, a downlink replaces a pending downlink for the same device and FPort
+        duplicate_window_seconds : float
+            Identical downlinks (FPort, TransmitMode and PayloadData) to the same device are dropped
+            if they were sent less than this amount of seconds ago. Use 0 to disable.
+        sent_downlinks : SentDownlinks
+            Recently sent downlinks, e.g. shared by the queues of several invocations. Replaces
+            duplicate_window_seconds.
+    """
+
+    def __init__(self, coalesce_same_fport: bool = True, duplicate_window_seconds: float = 0,
+                 sent_downlinks: SentDownlinks = None):
+        self.coalesce_same_fport = coalesce_same_fport
+        self.sent_downlinks = sent_downlinks if sent_downlinks is not None else SentDownlinks(duplicate_window_seconds)
+        # WirelessDeviceId -> OrderedDict of key -> (fport, transmit_mode, payload_data)
+        self._pending = {}
+
+    def _key(self, fport, transmit_mode, payload_data):
+        if self.coalesce_same_fport:
+            return fport
+        return (fport, transmit_mode, payload_data)
+
+    def enqueue(self, device_id: str, fport: int, transmit_mode: int, payload_data: str, now: float = None) -> str:
+        """ Adds a downlink to the queue of a device
+
+            Returns
+            -------
+            QUEUED, COALESCED (a pending downlink on the same FPort was replaced) or DUPLICATE (dropped)
+        """
+        downlink = (fport, transmit_mode, payload_data)
+        if self.sent_downlinks.is_duplicate(device_id, downlink, now):
+            return DUPLICATE
+
+        pending = self._pending.setdefault(device_id, OrderedDict())
+        key = self._key(fport, transmit_mode, payload_data)
+        previous = pending.get(key)
+        if previous == downlink:
+            return DUPLICATE
+
+        # The superseding downlink is sent after all other pending downlinks
+        pending.pop(key, None)
+        pending[key] = downlink
+        return QUEUED if previous is None else COALESCED
+
+    def depth(self, device_id: str = None) -> int:
+        """ Returns the number of pending downlinks for a device or for all devices if device_id is None """
+        if device_id is not None:
+            return len(self._pending.get(device_id, ()))
+        return sum(len(pending) for pending in self._pending.values())
+
+    def devices(self) -> list:
+        """ Returns WirelessDeviceIds with pending downlinks in order of the first enqueue """
+        return [device_id for device_id, pending in self._pending.items() if pending]
+
+    def drain(self, device_id: str) -> list:
+        """ Removes and returns pending downlinks of a device as a list of (fport, transmit_mode, payload_data) """
+        pending = self._pending.pop(device_id, None)
+        return list(pending.values()) if pending else []
+
+    def mark_sent(self, device_id: str, fport: int, transmit_mode: int, payload_data: str, now: float = None) -> None:
+        """ Remembers a sent downlink for duplicate detection """
+        self.sent_downlinks.mark_sent(device_id, (fport, transmit_mode, payload_data), now)
+
+
+def test_coalescing():
+    queue = DownlinkQueue(coalesce_same_fport=True)
+    assert queue.enqueue("dev1", 1, 1, "AQAAPA==") == QUEUED
+    assert queue.enqueue("dev1", 1, 1, "AQAAHg==") == COALESCED
+    assert queue.enqueue("dev1", 2, 1, "AA==") == QUEUED
+    assert queue.enqueue("dev1", 2, 1, "AA==") == DUPLICATE
+    assert queue.enqueue("dev2", 1, 1, "AQAAPA==") == QUEUED
+    assert queue.depth("dev1") == 2
+    assert queue.depth() == 3
+    assert queue.devices() == ["dev1", "dev2"]
+    assert queue.drain("dev1") == [(1, 1, "AQAAHg=="), (2, 1, "AA==")]
+    assert queue.depth() == 1
+
+
+def test_without_coalescing():
+    queue = DownlinkQueue(coalesce_same_fport=False)
+    assert queue.enqueue("dev1", 1, 1, "AQAAPA==") == QUEUED
+    assert queue.enqueue("dev1", 1, 1, "AQAAHg==") == QUEUED
+    assert queue.enqueue("dev1", 1, 1, "AQAAPA==") == DUPLICATE
+    assert queue.drain("dev1") == [(1, 1, "AQAAPA=="), (1, 1, "AQAAHg==")]
+
+
+def test_duplicate_window():
+    queue = DownlinkQueue(duplicate_window_seconds=10)
+    queue.enqueue("dev1", 1, 1, "AA==", now=100)
+    for downlink in queue.drain("dev1"):
+        queue.mark_sent("dev1", *downlink, now=100)
+    assert queue.enqueue("dev1", 1, 1, "AA==", now=105) == DUPLICATE
+    assert queue.enqueue("dev1", 1, 1, "AA==", now=111) == QUEUED
+
+
+def test_sent_downlinks_shared_and_pruned():
+    sent_downlinks = SentDownlinks(duplicate_window_seconds=10)
+    first = DownlinkQueue(sent_downlinks=sent_downlinks)
+    first.mark_sent("dev1", 1, 1, "AA==", now=100)
+    first.mark_sent("dev2", 1, 1, "AA==", now=104)
+    second = DownlinkQueue(sent_downlinks=sent_downlinks)
+    assert second.devices() == []
+    assert second.enqueue("dev1", 1, 1, "AA==", now=105) == DUPLICATE
+    assert len(sent_downlinks) == 2
+    assert second.enqueue("dev3", 1, 1, "AA==", now=110) == QUEUED
+    assert len(sent_downlinks) == 1
+    sent_downlinks.mark_sent("dev3", (1, 1, "AA=="), now=120)
+    assert len(sent_downlinks) == 1
+
+
+if __name__ == "__main__":
+    test_coalescing()
+    test_without_coalescing()
+    test_duplicate_window()
+    test_sent_downlinks_shared_and_pruned()
@@ -0,0 +1,71 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+#
+# Downlink encoder for the interval commands of Dragino devices (e.g. LHT65, LSE01, LDS01, LSN50).
+#
+# Commands:
+#   {"interval": 60}  -> 0100003C  (TDC, transmit interval in seconds as 24-bit big-endian value)
+#
+
+import base64
+import struct
+
+# The 24-bit interval is packed as the lower three bytes of a 32-bit integer behind the command byte
+SET_INTERVAL_COMMAND = struct.Struct(">I")
+
+INTERVAL_COMMAND_TYPE = 0x01
+INTERVAL_MAX_SECONDS = 0xFFFFFF
+
+
+def payload_from_dict(command: dict, fport: int = None) -> str:
+    """ Encodes a command into a base64-encoded binary payload.
+            Parameters
+            ----------
+            command : dict
+                Command to encode, see the list of commands above
+            fport: int
+                FPort the downlink will be sent to. Dragino devices accept commands on any FPort.
+
+            Returns
+            -------
+            Base64-encoded binary payload
+
+        """
+    if "interval" not in command:
+        raise ValueError("Command must contain 'interval'")
+
+    interval = command["interval"]
+    if not 0 < interval <= INTERVAL_MAX_SECONDS:
+        raise ValueError(f"interval must be between 1 and {INTERVAL_MAX_SECONDS} seconds")
+
+    payload = SET_INTERVAL_COMMAND.pack(INTERVAL_COMMAND_TYPE << 24 | interval)
+    return base64.b64encode(payload).decode("utf-8")
+
+
+def test_downlink_encoding():
+    test_definition = [
+        {"input": {"interval": 60}, "output": "AQAAPA=="},
+        {"input": {"interval": 30}, "output": "AQAAHg=="},
+        {"input": {"interval": 1200}, "output": "AQAEsA=="}
+    ]
+
+    for test in test_definition:
+        assert payload_from_dict(test.get("input")) == test.get("output")
+
+
+if __name__ == "__main__":
+    test_downlink_encoding()
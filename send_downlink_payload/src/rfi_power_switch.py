@@ -0,0 +1,86 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+#
+# Downlink encoder for the RFI power switch (see workshop/sampledecoder for the uplink decoder).
+#
+# Commands:
+#   {"switch_status": "off"}  -> 00
+#   {"switch_status": "on"}   -> 01
+#   {"interval": 60}          -> F0003C  (interval in seconds, 30..3600)
+#   {"interval": null}        -> F0      (request the current interval)
+#
+
+import base64
+import struct
+
+SWITCH_COMMAND = struct.Struct(">B")
+SET_INTERVAL_COMMAND = struct.Struct(">BH")
+
+SWITCH_STATUS_VALUES = {"off": 0x00, "on": 0x01}
+INTERVAL_MESSAGE_TYPE = 0xF0
+INTERVAL_MIN_SECONDS = 30
+INTERVAL_MAX_SECONDS = 3600
+
+
+def payload_from_dict(command: dict, fport: int = None) -> str:
+    """ Encodes a command into a base64-encoded binary payload.
+            Parameters
+            ----------
+            command : dict
+                Command to encode, see the list of commands above
+            fport: int
+                FPort the downlink will be sent to. The RFI power switch does not use it.
+
+            Returns
+            -------
+            Base64-encoded binary payload
+
+        """
+    if "switch_status" in command:
+        status = SWITCH_STATUS_VALUES.get(command["switch_status"])
+        if status is None:
+            raise ValueError(f"switch_status must be one of {list(SWITCH_STATUS_VALUES)}")
+        payload = SWITCH_COMMAND.pack(status)
+    elif "interval" in command:
+        interval = command["interval"]
+        if interval is None:
+            payload = SWITCH_COMMAND.pack(INTERVAL_MESSAGE_TYPE)
+        elif INTERVAL_MIN_SECONDS <= interval <= INTERVAL_MAX_SECONDS:
+            payload = SET_INTERVAL_COMMAND.pack(INTERVAL_MESSAGE_TYPE, interval)
+        else:
+            raise ValueError(f"interval must be between {INTERVAL_MIN_SECONDS} and {INTERVAL_MAX_SECONDS} seconds")
+    else:
+        raise ValueError("Command must contain 'switch_status' or 'interval'")
+
+    return base64.b64encode(payload).decode("utf-8")
+
+
+def test_downlink_encoding():
+    test_definition = [
+        {"input": {"switch_status": "off"}, "output": "AA=="},
+        {"input": {"switch_status": "on"}, "output": "AQ=="},
+        {"input": {"interval": None}, "output": "8A=="},
+        {"input": {"interval": 60}, "output": "8AA8"},
+        {"input": {"interval": 30}, "output": "8AAe"}
+    ]
+
+    for test in test_definition:
+        assert payload_from_dict(test.get("input")) == test.get("output")
+
+
+if __name__ == "__main__":
+    test_downlink_encoding()
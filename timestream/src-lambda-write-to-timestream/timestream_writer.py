@@ -0,0 +1,294 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+#
+# Writes to Amazon Timestream with retries of single records and a dead-letter sink.
+#
+# Raising from the Lambda function after a failed write_records makes AWS IoT Core invoke it again
+# with the whole uplink, which rewrites the records accepted before and loses all of them once the
+# retries are exhausted. TimestreamWriter instead handles the errors of write_records itself:
+#
+#   - RejectedRecordsException: the records which are not listed in RejectedRecords were written.
+#     Rejected records with a permanent reason (e.g. a different value for an existing measure, a
+#     time outside of the retention) go to the dead-letter sink, the others are retried.
+#   - ThrottlingException, InternalServerException: no record was written, all records are retried.
+#   - ValidationException: the records can not be written, they go to the dead-letter sink.
+#   - Other errors (e.g. AccessDeniedException, ResourceNotFoundException) are raised.
+#
+# Retries wait with exponential backoff and full jitter. Records which are still not written after
+# max_attempts go to the dead-letter sink. Dead letters are JSON objects
+#
+#   {"database": ..., "table": ..., "common_attributes": {...}, "record": {...}, "reason": ...}
+#
+# which can be written again with write_records once the cause is fixed. Sinks:
+#
+#   - S3DeadLetterSink: one JSON Lines object per write in an Amazon S3 bucket
+#   - LocalDeadLetterSink: JSON Lines file, e.g. for local runs
+#   - LoggingDeadLetterSink: logs the dead letters if no bucket is configured
+#   - MemoryDeadLetterSink: keeps the dead letters in a list, for tests
+#
+
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger("WriteToTimestream")
+
+RETRYABLE_ERRORS = frozenset(["ThrottlingException", "InternalServerException"])
+DEAD_LETTER_ERRORS = frozenset(["ValidationException"])
+
+# Parts of RejectedRecords reasons which do not change by retrying
+PERMANENT_REJECTION_REASONS = ("already exists", "time range", "retention", "version", "invalid", "not valid", "exceeds", "dimension")
+
+WriteResult = namedtuple("WriteResult", ["written", "retried", "dead_lettered"])
+WriteResult.__doc__ = """ Number of records written, number of retries of records and number of records sent to the dead-letter sink """
+
+
+def is_permanent_rejection(rejected_record: dict) -> bool:
+    """ Returns True if a rejected record of RejectedRecordsException will be rejected again """
+    if rejected_record.get("ExistingVersion") is not None:
+        return True
+    reason = (rejected_record.get("Reason") or "").lower()
+    return any(part in reason for part in PERMANENT_REJECTION_REASONS)
+
+
+class MemoryDeadLetterSink:
+    """ Keeps the dead letters in the list dead_letters """
+
+    def __init__(self):
+        self.dead_letters = []
+
+    def put(self, dead_letters: list) -> None:
+        self.dead_letters.extend(dead_letters)
+
+
+class LoggingDeadLetterSink:
+    """ Logs each dead letter as error """
+
+    def put(self, dead_letters: list) -> None:
+        for dead_letter in dead_letters:
+            logger.error("Dead letter: %s" % json.dumps(dead_letter))
+
+
+class LocalDeadLetterSink:
+    """ Appends the dead letters to a JSON Lines file """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def put(self, dead_letters: list) -> None:
+        with open(self.path, "a") as f:
+            for dead_letter in dead_letters:
+                f.write(json.dumps(dead_letter) + "\n")
+
+
+class S3DeadLetterSink:
+    """ Writes the dead letters of each write as JSON Lines object <prefix>YYYY/MM/DD/<uuid>.jsonl to an Amazon S3 bucket
+
+        Parameters
+        ----------
+        s3 : boto3 S3 client
+        bucket : str
+            Name of the bucket
+        prefix : str
+            Prefix of the object keys
+    """
+
+    def __init__(self, s3, bucket: str, prefix: str = "timestream-dead-letters/"):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def put(self, dead_letters: list) -> None:
+        if not dead_letters:
+            return
+        key = f"{self.prefix}{datetime.now(timezone.utc):%Y/%m/%d}/{uuid.uuid4()}.jsonl"
+        body = "".join(json.dumps(dead_letter) + "\n" for dead_letter in dead_letters)
+        self.s3.put_object(Bucket=self.bucket, Key=key, Body=body.encode("utf-8"), ContentType="application/x-ndjson")
+
+
+def dead_letter_sink_from_environment():
+    """ Returns an S3DeadLetterSink for DEAD_LETTER_BUCKET, a LocalDeadLetterSink for DEAD_LETTER_FILE or a LoggingDeadLetterSink """
+    bucket = os.environ.get("DEAD_LETTER_BUCKET")
+    if bucket:
+        import boto3
+        return S3DeadLetterSink(boto3.client("s3"), bucket, os.environ.get("DEAD_LETTER_PREFIX", "timestream-dead-letters/"))
+    path = os.environ.get("DEAD_LETTER_FILE")
+    if path:
+        return LocalDeadLetterSink(path)
+    return LoggingDeadLetterSink()
+
+
+class TimestreamWriter:
+    """ Writes records with write_records, retrying records which can be written later
+
+        Parameters
+        ----------
+        timestream : boto3 timestream-write client
+        database : str
+            Name of the Amazon Timestream database
+        dead_letter_sink : object
+            Object with method put(dead_letters: list) for records which can not be written
+        max_attempts : int
+            Maximum number of write_records calls per record
+        base_delay : float
+            Maximum seconds to wait before the first retry, doubled for every further retry
+        max_delay : float
+            Maximum seconds to wait before a retry
+        sleep : function
+            Function to wait for a number of seconds
+    """
+
+    def __init__(self, timestream, database: str, dead_letter_sink, max_attempts: int = 4, base_delay: float = 0.1,
+                 max_delay: float = 2.0, sleep=time.sleep):
+        self.timestream = timestream
+        self.database = database
+        self.dead_letter_sink = dead_letter_sink
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+
+    def _dead_letter(self, table: str, common_attributes: dict, record: dict, reason: str) -> dict:
+        return {"database": self.database, "table": table, "common_attributes": common_attributes, "record": record, "reason": reason}
+
+    def write(self, table: str, common_attributes: dict, records: list) -> WriteResult:
+        """ Writes records to a table and returns a WriteResult """
+        pending = records
+        dead_letters = []
+        written = 0
+        retried = 0
+        attempt = 0
+        while pending:
+            attempt += 1
+            try:
+                self.timestream.write_records(DatabaseName=self.database, TableName=table,
+                                              CommonAttributes=common_attributes, Records=pending)
+                written += len(pending)
+                break
+            except ClientError as e:
+                code = e.response.get("Error", {}).get("Code")
+                if code == "RejectedRecordsException":
+                    rejected_records = e.response.get("RejectedRecords", [])
+                    written += len(pending) - len(rejected_records)
+                    retry = []
+                    for rejected_record in rejected_records:
+                        record = pending[rejected_record["RecordIndex"]]
+                        if is_permanent_rejection(rejected_record) or attempt >= self.max_attempts:
+                            dead_letters.append(self._dead_letter(table, common_attributes, record, rejected_record.get("Reason")))
+                        else:
+                            retry.append(record)
+                elif code in RETRYABLE_ERRORS and attempt < self.max_attempts:
+                    retry = pending
+                elif code in RETRYABLE_ERRORS or code in DEAD_LETTER_ERRORS:
+                    reason = f"{code}: {e.response.get('Error', {}).get('Message')}"
+                    dead_letters.extend(self._dead_letter(table, common_attributes, record, reason) for record in pending)
+                    retry = []
+                else:
+                    raise
+
+            if retry:
+                retried += len(retry)
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+                logger.warning(f"Retrying {len(retry)} records for table {table} in {delay:.2f}s")
+                self.sleep(delay)
+            pending = retry
+
+        if dead_letters:
+            logger.error(f"Sending {len(dead_letters)} records for table {table} to the dead-letter sink")
+            self.dead_letter_sink.put(dead_letters)
+        return WriteResult(written, retried, len(dead_letters))
+
+
+class _StandInTimestream:
+    """ timestream-write client which fails write_records with the given error responses, then succeeds """
+
+    def __init__(self, responses: list):
+        self.responses = list(responses)
+        self.calls = []
+
+    def write_records(self, **kwargs):
+        self.calls.append(kwargs["Records"])
+        if self.responses:
+            raise ClientError(self.responses.pop(0), "WriteRecords")
+        return {"RecordsIngested": {"Total": len(kwargs["Records"])}}
+
+
+def _rejected(*rejected_records) -> dict:
+    return {"Error": {"Code": "RejectedRecordsException", "Message": "One or more records have been rejected."},
+            "RejectedRecords": list(rejected_records)}
+
+
+RECORDS = [{"MeasureName": name, "MeasureValue": "1"} for name in ["temperature", "humidity", "light", "co2"]]
+
+
+def test_retries_only_rejected_records():
+    timestream = _StandInTimestream([_rejected({"RecordIndex": 1, "Reason": "Throttled, try again"},
+                                               {"RecordIndex": 3, "Reason": "A record with the same dimensions already exists",
+                                                "ExistingVersion": 1})])
+    sink = MemoryDeadLetterSink()
+    delays = []
+    result = TimestreamWriter(timestream, "db", sink, sleep=delays.append).write("telemetry", {"Time": "1"}, RECORDS)
+    assert result == WriteResult(written=3, retried=1, dead_lettered=1)
+    assert timestream.calls == [RECORDS, [RECORDS[1]]]
+    assert len(delays) == 1 and 0 <= delays[0] <= 0.1
+    assert sink.dead_letters == [{"database": "db", "table": "telemetry", "common_attributes": {"Time": "1"}, "record": RECORDS[3],
+                                  "reason": "A record with the same dimensions already exists"}]
+
+
+def test_retries_throttling_and_dead_letters_after_max_attempts():
+    throttled = {"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"}}
+    timestream = _StandInTimestream([throttled] * 3)
+    result = TimestreamWriter(timestream, "db", MemoryDeadLetterSink(), sleep=lambda delay: None).write("metadata", {}, RECORDS)
+    assert result == WriteResult(written=4, retried=12, dead_lettered=0)
+
+    timestream = _StandInTimestream([throttled] * 4)
+    sink = MemoryDeadLetterSink()
+    result = TimestreamWriter(timestream, "db", sink, sleep=lambda delay: None).write("metadata", {}, RECORDS)
+    assert result == WriteResult(written=0, retried=12, dead_lettered=4)
+    assert len(timestream.calls) == 4
+    assert [dead_letter["reason"] for dead_letter in sink.dead_letters] == ["ThrottlingException: Rate exceeded"] * 4
+
+    timestream = _StandInTimestream([{"Error": {"Code": "ResourceNotFoundException", "Message": "Table not found"}}])
+    try:
+        TimestreamWriter(timestream, "db", sink, sleep=lambda delay: None).write("metadata", {}, RECORDS)
+        assert False
+    except ClientError:
+        pass
+
+
+def test_local_dead_letter_sink():
+    import tempfile
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "dead_letters.jsonl")
+        sink = LocalDeadLetterSink(path)
+        sink.put([{"record": RECORDS[0]}])
+        sink.put([{"record": RECORDS[1]}])
+        with open(path) as f:
+            assert [json.loads(line)["record"] for line in f] == RECORDS[:2]
+
+
+if __name__ == "__main__":
+    test_retries_only_rejected_records()
+    test_retries_throttling_and_dead_letters_after_max_attempts()
+    test_local_dead_letter_sink()
@@ -32,6 +32,16 @@ from time import time
 
 import boto3
 
+from uplink import Uplink
+from timestream_records import RecordBuilder, combine_writes, TELEMETRY, METADATA
+from timestream_writer import TimestreamWriter, dead_letter_sink_from_environment
+
+try:
+    # Provided by the layer of the payload decoders of transform_binary_payload
+    from decoder_schemas import schema_of
+except ImportError:
+    schema_of = None
+
 
 # Function name for logging
 FUNCTION_NAME = "WriteToTimestream"
@@ -56,16 +66,36 @@ DB_NAME = os.environ.get('DB_NAME')
 # Amazon Timestream table names
 TABLE_NAME_TELEMETRY = os.environ.get('TABLE_NAME_TELEMETRY')
 TABLE_NAME_METADATA = os.environ.get('TABLE_NAME_METADATA')
-
-
-def dict_to_records(data):
-    records = []
-    for k, v in data.items():
-        records.append({
-            'MeasureName': k,
-            'MeasureValue': str(v)
-        })
-    return records
+TABLE_NAMES = {TELEMETRY: TABLE_NAME_TELEMETRY, METADATA: TABLE_NAME_METADATA}
+# Name of an optional measure of TABLE_NAME_TELEMETRY for the time of the invocation
+INGEST_TIME_MEASURE = os.environ.get('INGEST_TIME_MEASURE') or None
+# Opt-in for writing the integer fields of the decoder output schemas as BIGINT instead of DOUBLE. A measure
+# name can only have one type per table, so enable it only for a new table (see README.md).
+BIGINT_INTEGER_MEASURES = os.environ.get('BIGINT_INTEGER_MEASURES', 'false').lower() == 'true'
+
+# Retries rejected records and sends records which can not be written to DEAD_LETTER_BUCKET
+writer = TimestreamWriter(timestream, DB_NAME, dead_letter_sink_from_environment())
+
+# Dimensions and metadata records are cached across invocations of a warm Lambda container.
+# Attributes added by the transformation function are not written as measures.
+# Numbers are written as DOUBLE, integer fields of the decoder outputs as BIGINT only with BIGINT_INTEGER_MEASURES.
+record_builder = RecordBuilder(excluded_measures=["status", "decoder_name", "WirelessDeviceId", "DevEui"],
+                               ingest_time_measure=INGEST_TIME_MEASURE,
+                               schema_of=schema_of if BIGINT_INTEGER_MEASURES else None)
+
+
+def prepare_writes(message: dict, ingest_time_ms: int) -> list:
+    """ Returns one write to TABLE_NAME_TELEMETRY and one write per gateway to TABLE_NAME_METADATA for a message,
+        the latter with the additional dimension GatewayEui """
+    input_transformed = message.get("transformed_payload")
+    uplink = Uplink.from_event(message.get("lns_payload"))
+    device_id = uplink.wireless_device_id
+    if uplink.dev_eui is None or uplink.fport is None:
+        raise InvalidInputException("WirelessMetadata.LoRaWAN must contain DevEui and FPort")
+
+    logger.info("Uplink: %s" % repr(uplink))
+    return record_builder.writes(uplink, device_id, input_transformed, ingest_time_ms,
+                                 input_transformed.get("decoder_name"))
 
 
 def lambda_handler(event, context):
@@ -109,20 +139,29 @@ def lambda_handler(event, context):
             },
             "timestamp": 1639411314702
             }
-        Please note that for each of key/value pair inside "payload" attribute a new  measurement with type 
-        measure_value::double will be written in a "lorawan2timestreamLoRaWANTelemetryTable" table
+        Please note that for each of key/value pair inside "transformed_payload" attribute a new measurement will be
+        written in a "lorawan2timestreamLoRaWANTelemetryTable" table: numbers as measure_value::double (integer fields
+        of the decoder's output schema as measure_value::bigint if BIGINT_INTEGER_MEASURES is "true"), strings as
+        measure_value::varchar and booleans as
+        measure_value::boolean. Objects and arrays are not written.
 
         Please note that for each entry in "LoRaWAN.Gateways"  measurements will be written lorawan2timestreamLoRaWANMetadataTable" table:
         - Rssi
         - Snr
 
+        The time of the measurements is "LoRaWAN.Timestamp", or the time of the invocation if it is missing.
+        If INGEST_TIME_MEASURE is set, the time of the invocation is written as measure with this name.
+        The event can also be a list of such messages, e.g. for writing buffered or archived uplinks, which
+        are written with as few write_records calls as possible.
+
         Returns
         -------
         This function returns a JSON object with the following keys:
 
         - status: 200 on successful
 
-        Exception is raised by this function in case of an error.
+        Records which Amazon Timestream rejects permanently are sent to the dead-letter sink instead of
+        raising, see timestream_writer.py. Exception is raised by this function in case of any other error.
 
 
     """
@@ -130,77 +169,18 @@ def lambda_handler(event, context):
     try:
         logger.info("Received event: %s" % json.dumps(event))
 
-        # Store event input
-        input_transformed = event.get("transformed_payload")
-        device_id = event.get("lns_payload").get("WirelessDeviceId")
-        metadata = event.get("lns_payload").get("WirelessMetadata")["LoRaWAN"]
-
-        logger.info("Metadata: % s" % json.dumps(metadata))
-
-        # Define Amazon Timestream dimensions
-        dimensions = [
-            {'Name': 'DeviceId', 'Value': str(device_id)},
-            {'Name': 'DevEui', 'Value': str(metadata["DevEui"])},
-            {'Name': 'FPort', 'Value': str(metadata["FPort"])},
-        ]
-
-        logger.info("Dimensions: %s" % json.dumps(dimensions))
-
-        if "status" in input_transformed:
-            del input_transformed["status"]
-        if "decoder_name" in input_transformed:
-            del input_transformed["decoder_name"]
-        if "WirelessDeviceId" in input_transformed:
-            del input_transformed["WirelessDeviceId"]
-        if "DevEui" in input_transformed:
-            del input_transformed["DevEui"]
-        
-
-        # Convert decoded payload to Amazon Timestream records
-        payload_records = dict_to_records(input_transformed)
-        logger.info("Payload records: % s" %
-                    json.dumps(payload_records))
-
-        # Write records to Amazon Timestream table TABLE_NAME_TELEMETRY
-        timestream.write_records(DatabaseName=DB_NAME,
-                                 TableName=TABLE_NAME_TELEMETRY,
-                                 CommonAttributes={
-                                     'Dimensions': dimensions,
-                                     'MeasureValueType': 'DOUBLE',
-                                     'Time': str(int(time() * 1000)),
-                                     'TimeUnit': 'MILLISECONDS'
-                                 },
-                                 Records=payload_records)
-
-        # Iterate over each of gateways in LoRaWAN metadata
-        for gateway_metadata in metadata["Gateways"]:
-            dimensions_per_gateway = dimensions.copy()
-
-            # Add GatewayEUI to dimensions
-            dimensions_per_gateway.append(
-                {'Name': "GatewayEui", 'Value': str(gateway_metadata["GatewayEui"])})
-            logger.info("Dimensions for gateway: %s" %
-                        json.dumps(dimensions_per_gateway))
-
-            # Create Amazon Timestream records
-            records_per_gateway = dict_to_records({
-                "Rssi": gateway_metadata["Rssi"],
-                "Snr": gateway_metadata["Snr"],
-                "Frequency": metadata["Frequency"],
-                "DataRate": metadata["DataRate"]
-
-            })
-
-            # Write records to Amazon Timestream table TABLE_NAME_METADATA
-            timestream.write_records(DatabaseName=DB_NAME,
-                                     TableName=TABLE_NAME_METADATA,
-                                     CommonAttributes={
-                                         'Dimensions': dimensions_per_gateway,
-                                         'MeasureValueType': 'DOUBLE',
-                                         'Time': str(int(time() * 1000)),
-                                         'TimeUnit': 'MILLISECONDS'
-                                     },
-                                     Records=records_per_gateway)
+        # A list of messages is written together
+        messages = event if isinstance(event, list) else [event]
+        ingest_time_ms = int(time() * 1000)
+        writes = []
+        for message in messages:
+            writes.extend(prepare_writes(message, ingest_time_ms))
+
+        # Records carry their dimensions and time, so the writes of all gateways and messages are combined
+        for write in combine_writes(writes):
+            logger.info("Records: %s" % json.dumps(write.records))
+            write_result = writer.write(TABLE_NAMES[write.table], write.common_attributes, write.records)
+            logger.info("Write result: %s" % repr(write_result))
 
         # Define the output of AWS Lambda function
         result = {
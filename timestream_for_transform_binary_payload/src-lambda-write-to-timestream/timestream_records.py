@@ -0,0 +1,415 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+#
+# Preparation of the Amazon Timestream writes for an uplink:
+#
+#   - one write of the decoded payload to the telemetry table with the dimensions DeviceId, DevEui and FPort
+#   - one write of Rssi, Snr, Frequency and DataRate per gateway to the metadata table with the
+#     additional dimension GatewayEui
+#
+# The time of the records is the Timestamp of the uplink from the LoRaWAN network server, so uplinks
+# which are written late (e.g. retried or replayed) keep their time. The time of the write can be added
+# as an additional measure. combine_writes moves the dimensions and the time into each record, so the
+# writes of several uplinks or gateways can share one write_records call.
+#
+# Numbers are written as DOUBLE, strings as VARCHAR and booleans as BOOLEAN. Objects, arrays and None are
+# not written. With the output schema of the decoder (decoder_schemas.py), integer fields are written as
+# BIGINT; the set of integer fields is resolved once per decoder, FPort and message type.
+#
+# A device sends with few FPorts via few gateways, so the dimension lists of its writes repeat from
+# uplink to uplink. DimensionCache builds each of them once and keeps them in a bounded LRU. The
+# dimension lists and records are shared between writes and must not be modified.
+#
+# This module and timestream_writer.py are copied into both Amazon Timestream samples, see TIMESTREAM_COPIES.
+# Change all copies together, test_copies_are_identical checks them in a checkout of the repository.
+#
+# Usage:
+#   python timestream_records.py --uplinks 100000     Benchmarks the preparation of the writes
+#
+
+import argparse
+import logging
+import random
+import time
+from collections import namedtuple
+from functools import lru_cache
+
+from uplink import Uplink, GatewayReception, read_copies
+
+logger = logging.getLogger(__name__)
+
+TELEMETRY = "telemetry"
+METADATA = "metadata"
+
+# Maximum number of records of one write_records call
+MAX_RECORDS_PER_WRITE = 100
+
+# Paths of the copies of this module and timestream_writer.py, relative to the root of the repository
+TIMESTREAM_COPIES = {
+    module: [f"timestream/src-lambda-write-to-timestream/{module}",
+             f"timestream_for_transform_binary_payload/src-lambda-write-to-timestream/{module}"]
+    for module in ["timestream_records.py", "timestream_writer.py"]
+}
+
+TimestreamWrite = namedtuple("TimestreamWrite", ["table", "common_attributes", "records"])
+TimestreamWrite.__doc__ = """ Arguments of timestream.write_records for table TELEMETRY or METADATA """
+
+
+class DimensionCache:
+    """ Bounded LRU of Amazon Timestream dimension lists per (DeviceId, DevEui, FPort, GatewayEui)
+
+        dimensions(device_id, dev_eui, fport, gateway_eui) returns the dimensions of a write, with
+        GatewayEui if gateway_eui is not None.
+
+        Parameters
+        ----------
+        maxsize : int
+            Maximum number of dimension lists, e.g. the number of devices times their FPorts and gateways
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        # lru_cache keeps the hits cheaper than building the dimensions
+        self.dimensions = lru_cache(maxsize=maxsize)(self._dimensions)
+
+    def __len__(self):
+        return self.dimensions.cache_info().currsize
+
+    @property
+    def hits(self) -> int:
+        return self.dimensions.cache_info().hits
+
+    @property
+    def misses(self) -> int:
+        return self.dimensions.cache_info().misses
+
+    def _dimensions(self, device_id: str, dev_eui: str, fport: int, gateway_eui: str) -> list:
+        if gateway_eui is None:
+            return [
+                {'Name': 'DeviceId', 'Value': str(device_id)},
+                {'Name': 'DevEui', 'Value': dev_eui},
+                {'Name': 'FPort', 'Value': str(fport)},
+            ]
+        # Shares the dicts of the dimensions without gateway
+        return self.dimensions(device_id, dev_eui, fport, None) + [{'Name': 'GatewayEui', 'Value': str(gateway_eui)}]
+
+
+def _measure_record(name: str, value) -> dict:
+    return {'MeasureName': name, 'MeasureValue': str(value)}
+
+
+class RecordBuilder:
+    """ Prepares the Amazon Timestream writes of uplinks
+
+        Records of Rssi, Snr, Frequency and DataRate take few distinct values and are shared between
+        writes. Records of the decoded payload are built per uplink.
+
+        Parameters
+        ----------
+        dimension_cache : DimensionCache
+            Cache of the dimension lists, by default a DimensionCache of 4096 entries
+        excluded_measures : iterable
+            Keys of the decoded payload which are not written as measures, e.g. "status"
+        metadata_cache_size : int
+            Maximum number of shared records of the metadata table
+        ingest_time_measure : str
+            Name of a measure of the telemetry table for the time of the write in milliseconds since epoch,
+            None to not write it
+        schema_of : function
+            decoder_schemas.schema_of, to write the integer fields of the decoder outputs as BIGINT
+    """
+
+    def __init__(self, dimension_cache: DimensionCache = None, excluded_measures=(), metadata_cache_size: int = 4096,
+                 ingest_time_measure: str = None, schema_of=None):
+        self.dimension_cache = dimension_cache if dimension_cache is not None else DimensionCache()
+        self.excluded_measures = frozenset(excluded_measures)
+        self.ingest_time_measure = ingest_time_measure
+        self.schema_of = schema_of
+        # typed, as records of 2 and 2.0 differ
+        self.metadata_record = lru_cache(maxsize=metadata_cache_size, typed=True)(_measure_record)
+        self._integer_fields = lru_cache(maxsize=metadata_cache_size)(self._resolve_integer_fields)
+
+    @staticmethod
+    def common_attributes(dimensions: list, time_ms) -> dict:
+        return {
+            'Dimensions': dimensions,
+            'MeasureValueType': 'DOUBLE',
+            'Time': str(time_ms),
+            'TimeUnit': 'MILLISECONDS'
+        }
+
+    def _resolve_integer_fields(self, decoder_name: str, fport: int, variant) -> frozenset:
+        schema = self.schema_of(decoder_name)
+        if schema is None:
+            return frozenset()
+        return frozenset(name for name, field in schema.fields_for(fport, variant).items() if field.types == ("integer",))
+
+    def integer_fields(self, decoder_name: str, fport: int, decoded: dict) -> frozenset:
+        """ Returns the names of the integer fields of a decoder output, empty without schema_of or schema """
+        if self.schema_of is None or decoder_name is None:
+            return frozenset()
+        schema = self.schema_of(decoder_name)
+        if schema is None:
+            return frozenset()
+        variant = decoded.get(schema.variant_field) if schema.variant_field is not None else None
+        try:
+            return self._integer_fields(decoder_name, fport, variant)
+        except TypeError:
+            # Unhashable value of the variant field, i.e. not one of the declared variants
+            return self._integer_fields(decoder_name, fport, None)
+
+    def telemetry_records(self, decoded: dict, integer_fields: frozenset = frozenset()) -> list:
+        excluded = self.excluded_measures
+        records = []
+        append = records.append
+        for k, v in decoded.items():
+            if k in excluded:
+                continue
+            value_type = type(v)
+            if value_type is float or (value_type is int and k not in integer_fields):
+                append({'MeasureName': k, 'MeasureValue': str(v)})
+            elif value_type is int:
+                append({'MeasureName': k, 'MeasureValue': str(v), 'MeasureValueType': 'BIGINT'})
+            elif value_type is bool:
+                append({'MeasureName': k, 'MeasureValue': 'true' if v else 'false', 'MeasureValueType': 'BOOLEAN'})
+            elif value_type is str:
+                append({'MeasureName': k, 'MeasureValue': v, 'MeasureValueType': 'VARCHAR'})
+        return records
+
+    def writes(self, uplink: Uplink, device_id: str, decoded: dict, ingest_time_ms: int, decoder_name: str = None) -> list:
+        """ Returns the list of TimestreamWrite for an uplink and its decoded payload
+
+            The time of the records is the Timestamp of the uplink, or ingest_time_ms if the uplink has none.
+            decoder_name selects the output schema for the types of the records.
+        """
+        dimensions = self.dimension_cache.dimensions
+        time_string = str(uplink_time_ms(uplink, ingest_time_ms))
+        telemetry_records = self.telemetry_records(decoded, self.integer_fields(decoder_name, uplink.fport, decoded))
+        if self.ingest_time_measure is not None:
+            telemetry_records.append({'MeasureName': self.ingest_time_measure, 'MeasureValue': str(ingest_time_ms)})
+        writes = [TimestreamWrite(TELEMETRY,
+                                  self.common_attributes(dimensions(device_id, uplink.dev_eui, uplink.fport, None), time_string),
+                                  telemetry_records)]
+        if uplink.gateways:
+            record = self.metadata_record
+            uplink_records = [record('Frequency', uplink.frequency), record('DataRate', uplink.data_rate)]
+            for gateway in uplink.gateways:
+                writes.append(TimestreamWrite(
+                    METADATA,
+                    self.common_attributes(dimensions(device_id, uplink.dev_eui, uplink.fport, gateway.gateway_eui), time_string),
+                    [record('Rssi', gateway.rssi), record('Snr', gateway.snr)] + uplink_records))
+        return writes
+
+
+def uplink_time_ms(uplink: Uplink, default: int) -> int:
+    """ Returns the Timestamp of the uplink in milliseconds since epoch, or default if it is missing or invalid """
+    try:
+        time_ms = uplink.timestamp_ms()
+    except ValueError:
+        logger.warning("Invalid Timestamp %r of uplink of %s, using the time of the write", uplink.timestamp, uplink.dev_eui)
+        return default
+    return default if time_ms is None else time_ms
+
+
+def combine_writes(writes: list, max_records: int = MAX_RECORDS_PER_WRITE) -> list:
+    """ Combines writes into as few writes per table as possible, with at most max_records records each
+
+        The dimensions and time of the common attributes of the writes are moved into their records.
+    """
+    records_per_table = {}
+    for write in writes:
+        dimensions = write.common_attributes['Dimensions']
+        time_string = write.common_attributes['Time']
+        records_per_table.setdefault(write.table, []).extend(
+            {**record, 'Dimensions': dimensions, 'Time': time_string} for record in write.records)
+
+    combined = []
+    for table, records in records_per_table.items():
+        for start in range(0, len(records), max_records):
+            combined.append(TimestreamWrite(table, {'MeasureValueType': 'DOUBLE', 'TimeUnit': 'MILLISECONDS'},
+                                            records[start:start + max_records]))
+    return combined
+
+
+def _uncached_writes(uplink: Uplink, device_id: str, decoded: dict, time_ms: int) -> list:
+    """ Preparation of the writes without RecordBuilder, as reference for the benchmark """
+    def dict_to_records(data):
+        records = []
+        for k, v in data.items():
+            records.append({
+                'MeasureName': k,
+                'MeasureValue': str(v)
+            })
+        return records
+
+    dimensions = [
+        {'Name': 'DeviceId', 'Value': str(device_id)},
+        {'Name': 'DevEui', 'Value': uplink.dev_eui},
+        {'Name': 'FPort', 'Value': str(uplink.fport)},
+    ]
+    writes = [TimestreamWrite(TELEMETRY, RecordBuilder.common_attributes(dimensions, time_ms), dict_to_records(decoded))]
+    for gateway in uplink.gateways:
+        dimensions_per_gateway = dimensions + [{'Name': "GatewayEui", 'Value': str(gateway.gateway_eui)}]
+        records_per_gateway = dict_to_records({
+            "Rssi": gateway.rssi,
+            "Snr": gateway.snr,
+            "Frequency": uplink.frequency,
+            "DataRate": uplink.data_rate
+        })
+        writes.append(TimestreamWrite(METADATA, RecordBuilder.common_attributes(dimensions_per_gateway, time_ms), records_per_gateway))
+    return writes
+
+
+def generate_uplinks(count: int, devices: int, gateways: int, seed: int = 0) -> list:
+    """ Returns (uplink, device_id, decoded) of simulated devices, each received by up to three gateways """
+    rng = random.Random(seed)
+    gateway_euis = [f"dca632fffe{i:06x}" for i in range(gateways)]
+    device_gateways = [rng.sample(gateway_euis, min(gateways, rng.randint(1, 3))) for _ in range(devices)]
+    uplinks = []
+    for _ in range(count):
+        device = rng.randrange(devices)
+        uplink = Uplink(wireless_device_id=f"device-{device}", dev_eui=f"a84041{device:010x}", fport=2,
+                        frequency=867100000 + 200000 * rng.randrange(8), data_rate=rng.randrange(6),
+                        gateways=tuple(GatewayReception(eui, rng.randint(-120, -40), rng.randint(-20, 10) / 4)
+                                       for eui in device_gateways[device]))
+        decoded = {"temperature": rng.randint(-100, 400) / 10, "humidity": rng.randint(0, 100), "light": rng.randint(0, 1000),
+                   "motion": rng.randint(0, 10), "co2": rng.randint(400, 2000), "vdd": rng.randint(3000, 3600)}
+        uplinks.append((uplink, uplink.wireless_device_id, decoded))
+    return uplinks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the preparation of Amazon Timestream writes per uplink")
+    parser.add_argument("--uplinks", type=int, default=100000, help="Number of uplinks")
+    parser.add_argument("--devices", type=int, default=1000, help="Number of devices")
+    parser.add_argument("--gateways", type=int, default=50, help="Number of gateways")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of runs per variant")
+    args = parser.parse_args()
+
+    uplinks = generate_uplinks(args.uplinks, args.devices, args.gateways)
+    builder = RecordBuilder()
+    for name, prepare in [("without cache", _uncached_writes), ("RecordBuilder", builder.writes)]:
+        elapsed = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            for uplink, device_id, decoded in uplinks:
+                prepare(uplink, device_id, decoded, 1607352108000)
+            elapsed = min(elapsed, time.perf_counter() - start)
+        print(f"{name}: {len(uplinks)} uplinks in {elapsed:.2f}s ({elapsed / len(uplinks) * 1e6:.2f} us per uplink, best of {args.repeat})")
+    cache = builder.dimension_cache
+    print(f"Dimension cache: {len(cache)} entries, {cache.hits} hits, {cache.misses} misses")
+
+
+def test_dimension_cache():
+    cache = DimensionCache(maxsize=3)
+    dimensions = cache.dimensions("device", "a84041d55182720b", 2, None)
+    assert dimensions == [{'Name': 'DeviceId', 'Value': 'device'}, {'Name': 'DevEui', 'Value': 'a84041d55182720b'},
+                          {'Name': 'FPort', 'Value': '2'}]
+    assert cache.dimensions("device", "a84041d55182720b", 2, None) is dimensions
+    with_gateway = cache.dimensions("device", "a84041d55182720b", 2, "dca632fffe45b3c0")
+    assert with_gateway[:3] == dimensions and with_gateway[0] is dimensions[0]
+    assert with_gateway[3] == {'Name': 'GatewayEui', 'Value': 'dca632fffe45b3c0'}
+    assert (cache.hits, cache.misses, len(cache)) == (2, 2, 2)
+
+    cache.dimensions("device", "a84041d55182720b", 3, None)
+    cache.dimensions("device", "a84041d55182720b", 4, None)
+    assert len(cache) == 3
+    assert cache.dimensions("device", "a84041d55182720b", 2, None) is not dimensions
+
+
+def test_writes_match_uncached_writes():
+    builder = RecordBuilder(DimensionCache(maxsize=16))
+    for uplink, device_id, decoded in generate_uplinks(200, 20, 5):
+        assert builder.writes(uplink, device_id, decoded, 1000) == _uncached_writes(uplink, device_id, decoded, 1000)
+
+    uplink = Uplink(dev_eui="a84041d55182720b", fport=2)
+    writes = RecordBuilder(excluded_measures=["status", "DevEui"]).writes(
+        uplink, "device", {"temperature": 22.6, "status": 200, "DevEui": "a84041d55182720b"}, 1000)
+    assert writes == [TimestreamWrite(TELEMETRY, RecordBuilder.common_attributes(
+        DimensionCache().dimensions("device", "a84041d55182720b", 2, None), 1000), [{'MeasureName': 'temperature', 'MeasureValue': '22.6'}])]
+
+
+def test_measure_value_types():
+    class Field:
+        def __init__(self, *types):
+            self.types = types
+
+    class Schema:
+        variant_field = "mode"
+
+        @staticmethod
+        def fields_for(fport=None, variant=None):
+            fields = {"temperature": Field("number"), "count": Field("integer"), "co2": Field("integer", "array")}
+            if variant == 2:
+                fields["distance"] = Field("integer")
+            return fields
+
+    decoded = {"temperature": 22, "count": 3, "co2": 776, "distance": 120, "mode": 2, "alarm": True,
+               "state": "open", "status": {"lowBattery": False}, "extTemp": [1.5], "light": None}
+    builder = RecordBuilder(schema_of=lambda decoder_name: Schema if decoder_name == "test" else None)
+    assert builder.telemetry_records(decoded) == [
+        {'MeasureName': 'temperature', 'MeasureValue': '22'},
+        {'MeasureName': 'count', 'MeasureValue': '3'},
+        {'MeasureName': 'co2', 'MeasureValue': '776'},
+        {'MeasureName': 'distance', 'MeasureValue': '120'},
+        {'MeasureName': 'mode', 'MeasureValue': '2'},
+        {'MeasureName': 'alarm', 'MeasureValue': 'true', 'MeasureValueType': 'BOOLEAN'},
+        {'MeasureName': 'state', 'MeasureValue': 'open', 'MeasureValueType': 'VARCHAR'}]
+
+    records = builder.writes(Uplink(dev_eui="a84041d55182720b", fport=2), "device", decoded, 1000, "test")[0].records
+    assert [record.get('MeasureValueType', 'DOUBLE') for record in records] == \
+        ['DOUBLE', 'BIGINT', 'DOUBLE', 'BIGINT', 'DOUBLE', 'BOOLEAN', 'VARCHAR']
+    assert builder.integer_fields("test", 2, {"mode": 1}) == {"count"}
+    assert builder.integer_fields("test", 2, {"mode": [1]}) == {"count"}
+    assert builder.integer_fields("unknown", 2, decoded) == frozenset()
+
+
+def test_time_from_uplink():
+    uplink = Uplink(dev_eui="a84041d55182720b", fport=2, timestamp="2020-12-07T14:41:48Z")
+    writes = RecordBuilder(ingest_time_measure="ingest_time").writes(uplink, "device", {"temperature": 22.6}, 1607352110000)
+    assert writes[0].common_attributes['Time'] == "1607352108000"
+    assert writes[0].records[-1] == {'MeasureName': 'ingest_time', 'MeasureValue': '1607352110000'}
+
+    assert uplink_time_ms(Uplink(timestamp="2020-12-07T14:41:48.25Z"), 1000) == 1607352108250
+    assert uplink_time_ms(Uplink(timestamp="yesterday"), 1000) == 1000
+    assert uplink_time_ms(Uplink(), 1000) == 1000
+
+
+def test_combine_writes():
+    builder = RecordBuilder()
+    writes = []
+    for uplink, device_id, decoded in generate_uplinks(30, 10, 5):
+        writes.extend(builder.writes(uplink, device_id, decoded, 1000))
+
+    combined = combine_writes(writes, max_records=50)
+    assert [write.table for write in combined] == [TELEMETRY] * 4 + [METADATA] * 5
+    assert [len(write.records) for write in combined if write.table == TELEMETRY] == [50, 50, 50, 30]
+    assert all(write.common_attributes == {'MeasureValueType': 'DOUBLE', 'TimeUnit': 'MILLISECONDS'} for write in combined)
+    assert [record for write in combined for record in write.records] == \
+        [{**record, 'Dimensions': write.common_attributes['Dimensions'], 'Time': '1000'}
+         for table in [TELEMETRY, METADATA] for write in writes if write.table == table for record in write.records]
+    assert 'Dimensions' not in writes[0].records[0]
+
+
+def test_copies_are_identical():
+    for module, copies in TIMESTREAM_COPIES.items():
+        contents = read_copies(copies)
+        assert len(set(contents.values())) <= 1, f"Copies of {module} differ: {', '.join(contents)}"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+#
+# Parsed representation of an uplink as delivered by AWS IoT Core for LoRaWAN to an AWS IoT Rule:
+#
+#   {
+#       "WirelessDeviceId": "57728ff8-5d1d-4130-9de2-f004d8722bc2",
+#       "PayloadData": "AQDiAikEACcFBgYDCAcNYg==",
+#       "WirelessMetadata": {
+#           "LoRaWAN": {
+#               "DataRate": 0,
+#               "DevEui": "a84041d55182720b",
+#               "FPort": 2,
+#               "Frequency": 867900000,
+#               "Gateways": [{"GatewayEui": "dca632fffe45b3c0", "Rssi": -76, "Snr": 9.75}],
+#               "Timestamp": "2020-12-07T14:41:48Z"
+#           }
+#       }
+#   }
+#
+# Uplink.from_event walks the nested dicts once. Missing attributes are None, attributes of an
+# unexpected type raise InvalidUplinkException. Instances are immutable.
+#
+# Each AWS Lambda function which needs this module has a copy of it in its code or layer, see UPLINK_COPIES.
+# Change all copies together, test_copies_are_identical checks them in a checkout of the repository.
+#
+# Timestamps are parsed with a regular expression instead of datetime.fromisoformat, which on Python 3.7
+# only accepts fractions of a second with 3 or 6 digits ("2020-12-07T14:41:48.25Z" is valid ISO 8601).
+#
+
+import os
+import re
+from datetime import datetime, timedelta, timezone
+
+_TIMESTAMP_REGEX = re.compile(
+    r"^(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2}):(\d{2})(?:[.,](\d+))?(?:(Z)|([+-])(\d{2}):?(\d{2}))?$")
+
+
+# Paths of the copies of this module, relative to the root of the repository
+UPLINK_COPIES = ["transform_binary_payload/src-payload-decoders/python/uplink.py",
+                 "timestream/src-lambda-write-to-timestream/uplink.py",
+                 "timestream_for_transform_binary_payload/src-lambda-write-to-timestream/uplink.py"]
+
+
+class InvalidUplinkException(Exception):
+    """Raised when an attribute of the uplink event has an unexpected type"""
+    pass
+
+
+class _Immutable:
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(getattr(self, s) == getattr(other, s) for s in self.__slots__)
+
+    def __hash__(self):
+        return hash(tuple(getattr(self, s) for s in self.__slots__))
+
+    def __repr__(self):
+        return f"{type(self).__name__}(" + ", ".join(f"{s}={getattr(self, s)!r}" for s in self.__slots__) + ")"
+
+
+def _check(value, types, name: str):
+    if value is not None and (not isinstance(value, types) or isinstance(value, bool)):
+        raise InvalidUplinkException(f"Attribute {name} has unexpected type {type(value).__name__}")
+    return value
+
+
+class GatewayReception(_Immutable):
+    """ Reception of an uplink by one gateway """
+    __slots__ = ("gateway_eui", "rssi", "snr")
+
+    def __init__(self, gateway_eui: str, rssi: float = None, snr: float = None):
+        object.__setattr__(self, "gateway_eui", gateway_eui)
+        object.__setattr__(self, "rssi", rssi)
+        object.__setattr__(self, "snr", snr)
+
+    @classmethod
+    def from_dict(cls, gateway: dict) -> "GatewayReception":
+        if not isinstance(gateway, dict):
+            raise InvalidUplinkException("Entries of WirelessMetadata.LoRaWAN.Gateways must be objects")
+        return cls(_check(gateway.get("GatewayEui"), str, "GatewayEui"),
+                   _check(gateway.get("Rssi"), (int, float), "Rssi"),
+                   _check(gateway.get("Snr"), (int, float), "Snr"))
+
+
+class Uplink(_Immutable):
+    """ Uplink of a LoRaWAN device with the metadata of the LoRaWAN network server """
+    __slots__ = ("wireless_device_id", "payload_data", "dev_eui", "fport", "frequency", "data_rate", "timestamp", "gateways")
+
+    def __init__(self, wireless_device_id: str = None, payload_data: str = None, dev_eui: str = None, fport: int = None,
+                 frequency: int = None, data_rate: int = None, timestamp: str = None, gateways: tuple = ()):
+        object.__setattr__(self, "wireless_device_id", wireless_device_id)
+        object.__setattr__(self, "payload_data", payload_data)
+        object.__setattr__(self, "dev_eui", dev_eui)
+        object.__setattr__(self, "fport", fport)
+        object.__setattr__(self, "frequency", frequency)
+        object.__setattr__(self, "data_rate", data_rate)
+        object.__setattr__(self, "timestamp", timestamp)
+        object.__setattr__(self, "gateways", tuple(gateways))
+
+    @classmethod
+    def from_event(cls, event: dict) -> "Uplink":
+        """ Parses an uplink event of AWS IoT Core for LoRaWAN """
+        if not isinstance(event, dict):
+            raise InvalidUplinkException("Uplink event must be an object")
+        wireless_metadata = _check(event.get("WirelessMetadata"), dict, "WirelessMetadata") or {}
+        lorawan = _check(wireless_metadata.get("LoRaWAN"), dict, "WirelessMetadata.LoRaWAN") or {}
+        gateways = lorawan.get("Gateways")
+        if gateways is None:
+            gateways = ()
+        elif not isinstance(gateways, list):
+            raise InvalidUplinkException("Attribute WirelessMetadata.LoRaWAN.Gateways must be a list")
+
+        return cls(wireless_device_id=_check(event.get("WirelessDeviceId"), str, "WirelessDeviceId"),
+                   payload_data=_check(event.get("PayloadData"), str, "PayloadData"),
+                   dev_eui=_check(lorawan.get("DevEui"), str, "DevEui"),
+                   fport=_check(lorawan.get("FPort"), int, "FPort"),
+                   frequency=_check(lorawan.get("Frequency"), int, "Frequency"),
+                   data_rate=_check(lorawan.get("DataRate"), int, "DataRate"),
+                   timestamp=_check(lorawan.get("Timestamp"), str, "Timestamp"),
+                   gateways=[GatewayReception.from_dict(gateway) for gateway in gateways])
+
+    def timestamp_ms(self) -> int:
+        """ Returns the timestamp of the LoRaWAN network server in milliseconds since epoch or None
+
+            Timestamps without time zone are UTC. Raises ValueError if the timestamp is not an ISO 8601 date and time.
+        """
+        if self.timestamp is None:
+            return None
+        return parse_timestamp_ms(self.timestamp)
+
+
+def parse_timestamp_ms(timestamp: str) -> int:
+    """ Returns an ISO 8601 date and time, e.g. "2020-12-07T14:41:48.25Z", in milliseconds since epoch """
+    match = _TIMESTAMP_REGEX.match(timestamp)
+    if match is None:
+        raise ValueError(f"Invalid timestamp {timestamp!r}")
+    year, month, day, hour, minute, second, fraction, utc, sign, offset_hours, offset_minutes = match.groups()
+    if utc is not None or sign is None:
+        tz = timezone.utc
+    else:
+        offset = timedelta(hours=int(offset_hours), minutes=int(offset_minutes))
+        tz = timezone(-offset if sign == "-" else offset)
+    # Fractions are padded or truncated to microseconds
+    microsecond = int(fraction[:6].ljust(6, "0")) if fraction is not None else 0
+    parsed = datetime(int(year), int(month), int(day), int(hour), int(minute), int(second), microsecond, tzinfo=tz)
+    return round(parsed.timestamp() * 1000)
+
+
+SAMPLE_EVENT = {
+    "WirelessDeviceId": "57728ff8-5d1d-4130-9de2-f004d8722bc2",
+    "PayloadData": "AQDiAikEACcFBgYDCAcNYg==",
+    "WirelessMetadata": {
+        "LoRaWAN": {
+            "DataRate": 0,
+            "DevEui": "a84041d55182720b",
+            "FPort": 2,
+            "Frequency": 867900000,
+            "Gateways": [
+                {"GatewayEui": "dca632fffe45b3c0", "Rssi": -76, "Snr": 9.75},
+                {"GatewayEui": "dca632fffe45b3c1", "Rssi": -90, "Snr": -2}
+            ],
+            "Timestamp": "2020-12-07T14:41:48Z"
+        }
+    }
+}
+
+
+def test_from_event():
+    uplink = Uplink.from_event(SAMPLE_EVENT)
+    assert uplink.wireless_device_id == "57728ff8-5d1d-4130-9de2-f004d8722bc2"
+    assert uplink.payload_data == "AQDiAikEACcFBgYDCAcNYg=="
+    assert uplink.dev_eui == "a84041d55182720b"
+    assert uplink.fport == 2
+    assert uplink.frequency == 867900000
+    assert uplink.data_rate == 0
+    assert uplink.gateways == (GatewayReception("dca632fffe45b3c0", -76, 9.75), GatewayReception("dca632fffe45b3c1", -90, -2))
+    assert uplink.timestamp_ms() == 1607352108000
+    assert Uplink(timestamp="2020-12-07T14:41:48.250Z").timestamp_ms() == 1607352108250
+
+
+def test_parse_timestamp_ms():
+    for timestamp, expected in [("2020-12-07T14:41:48Z", 1607352108000),
+                                ("2020-12-07T14:41:48.2Z", 1607352108200),
+                                ("2020-12-07T14:41:48.25Z", 1607352108250),
+                                ("2020-12-07T14:41:48.2504Z", 1607352108250),
+                                ("2020-12-07T14:41:48.123456789Z", 1607352108123),
+                                ("2020-12-07T14:41:48.25", 1607352108250),
+                                ("2020-12-07T15:41:48.25+01:00", 1607352108250),
+                                ("2020-12-07T13:41:48-0100", 1607352108000)]:
+        assert parse_timestamp_ms(timestamp) == expected, timestamp
+
+    for timestamp in ["yesterday", "2020-12-07", "2020-12-07T14:41:48.Z", "2020-13-07T14:41:48Z"]:
+        try:
+            parse_timestamp_ms(timestamp)
+            assert False, timestamp
+        except ValueError:
+            pass
+
+
+def test_missing_and_invalid_attributes():
+    uplink = Uplink.from_event({"PayloadData": "AA=="})
+    assert uplink.fport is None
+    assert uplink.gateways == ()
+    assert uplink.timestamp_ms() is None
+
+    for event in [{"WirelessMetadata": "LoRaWAN"},
+                  {"WirelessMetadata": {"LoRaWAN": []}},
+                  {"WirelessMetadata": {"LoRaWAN": {"FPort": "2"}}},
+                  {"WirelessMetadata": {"LoRaWAN": {"Gateways": {}}}},
+                  {"WirelessMetadata": {"LoRaWAN": {"Gateways": [{"Rssi": "-76"}]}}}]:
+        try:
+            Uplink.from_event(event)
+            assert False, event
+        except InvalidUplinkException:
+            pass
+
+
+def test_immutable():
+    uplink = Uplink.from_event(SAMPLE_EVENT)
+    for target, name in [(uplink, "fport"), (uplink.gateways[0], "rssi")]:
+        try:
+            setattr(target, name, 1)
+            assert False
+        except AttributeError:
+            pass
+    assert not hasattr(uplink, "__dict__")
+
+
+def read_copies(copies: list) -> dict:
+    """ Returns the content of the copies of a module found in the checkout of the repository, by path """
+    root = os.path.dirname(os.path.abspath(__file__))
+    while not os.path.isdir(os.path.join(root, "transform_binary_payload")) and root != os.path.dirname(root):
+        root = os.path.dirname(root)
+    contents = {}
+    for copy in copies:
+        path = os.path.join(root, copy)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                contents[copy] = f.read()
+    return contents
+
+
+def test_copies_are_identical():
+    contents = read_copies(UPLINK_COPIES)
+    assert len(set(contents.values())) <= 1, f"Copies of uplink.py differ: {', '.join(contents)}"
+
+
+if __name__ == "__main__":
+    test_from_event()
+    test_parse_timestamp_ms()
+    test_missing_and_invalid_attributes()
+    test_immutable()
+    test_copies_are_identical()
@@ -0,0 +1,323 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+#
+# Differential fuzzing and throughput comparison of the Python and Node.js binary decoders.
+#
+# Some device types have a decoder in src-payload-decoders/python and in src-payload-decoders/node.
+# For each of them, this tool generates boundary payloads (all bytes 0x00, 0x7F, 0x80, 0xFF, ...),
+# mutations of known payloads and random payloads, decodes them with both implementations and reports
+# - payloads which only one implementation can decode,
+# - fields with different values, after renaming the Node.js fields to the Python names,
+# - fields which only one implementation returns,
+# - payloads per second of each implementation, measured within the runtime.
+#
+# The Node.js decoders are run by node_decoder_runner.js, which requires node on the PATH.
+#
+# Usage:
+#   python localtools/compare_decoders.py --decoders dragino_lht65 elsys --payloads 10000
+#
+
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import Counter, namedtuple
+
+LOCALTOOLS_PATH = os.path.dirname(os.path.abspath(__file__))
+PYTHON_DECODERS_PATH = os.path.join(LOCALTOOLS_PATH, "..", "src-payload-decoders", "python")
+NODE_DECODERS_PATH = os.path.join(LOCALTOOLS_PATH, "..", "src-payload-decoders", "node")
+NODE_RUNNER_PATH = os.path.join(LOCALTOOLS_PATH, "node_decoder_runner.js")
+
+sys.path.insert(0, PYTHON_DECODERS_PATH)
+
+# seeds: known payloads (hex) which are mutated
+# lengths: payload lengths for boundary payloads
+# fports: FPorts of the generated uplinks
+# aliases: name of a Node.js field -> name of the Python field
+DecoderSpec = namedtuple("DecoderSpec", ["seeds", "lengths", "fports", "aliases"])
+
+SHARED_DECODERS = {
+    "dragino_lht65": DecoderSpec(
+        seeds=["CBF60B0D0376010ADD7FFF", "CBBDF5C6022E01F54F7FFF", "CBA407C601B80108667FFF"],
+        lengths=(11,),
+        fports=(2,),
+        aliases={}),
+    "elsys": DecoderSpec(
+        seeds=["0100E202290400270506060308070D621900E21900A3", "0100EE0224040000050007096E"],
+        lengths=(2, 3, 4, 5, 7, 10),
+        fports=(5,),
+        aliases={"x": "accX", "y": "accY", "z": "accZ", "lat": "gpsLat", "long": "gpsLong",
+                 "pulseAbs": "pulse1Abs", "pulseAbs2": "pulse2Abs",
+                 "externalTemperature": "extTemp1", "externalTemperature2": "extTemp2",
+                 "digital": "extDigital", "digital2": "extDigital2", "distance": "extDistance",
+                 "irInternalTemperature": "irTempInt", "irExternalTemperature": "irTempExt",
+                 "analogUv": "extAnalogUv"}),
+    # The Python sample decoder returns simulated temperature and humidity, the Node.js sample decoder
+    # decodes state and speed. Their outputs are not expected to match.
+    "sample_device": DecoderSpec(
+        seeds=["0001", "0105"],
+        lengths=(2,),
+        fports=(1, 2),
+        aliases={})
+}
+
+BOUNDARY_BYTES = (0x00, 0x01, 0x7F, 0x80, 0xFE, 0xFF)
+
+Divergence = namedtuple("Divergence", ["fport", "payload", "python", "node"])
+
+
+class DecoderComparison:
+    """ Result of the comparison of the two implementations of a decoder """
+
+    def __init__(self, decoder_name: str):
+        self.decoder_name = decoder_name
+        self.payload_count = 0
+        self.agreements = 0
+        self.both_failed = 0
+        self.only_python_decoded = 0
+        self.only_node_decoded = 0
+        self.value_differences = Counter()
+        self.only_in_python = Counter()
+        self.only_in_node = Counter()
+        self.examples = []
+        self.python_payloads_per_second = None
+        self.node_payloads_per_second = None
+
+    @property
+    def divergent(self) -> int:
+        return self.payload_count - self.agreements - self.both_failed
+
+    def to_dict(self) -> dict:
+        return {
+            "decoder_name": self.decoder_name,
+            "payloads": self.payload_count,
+            "agreements": self.agreements,
+            "both_failed": self.both_failed,
+            "only_python_decoded": self.only_python_decoded,
+            "only_node_decoded": self.only_node_decoded,
+            "value_differences": dict(self.value_differences),
+            "only_in_python": dict(self.only_in_python),
+            "only_in_node": dict(self.only_in_node),
+            "examples": [example._asdict() for example in self.examples],
+            "python_payloads_per_second": self.python_payloads_per_second,
+            "node_payloads_per_second": self.node_payloads_per_second
+        }
+
+
+def generate_payloads(spec: DecoderSpec, count: int, seed: int = 0) -> list:
+    """ Returns a list of (fport, payload) with boundary payloads, mutations of spec.seeds and random payloads """
+    rng = random.Random(seed)
+    payloads = []
+    for length in sorted(set(spec.lengths) | {0, 1}):
+        for value in BOUNDARY_BYTES:
+            payloads.append(bytes([value]) * length)
+        # Alternating sign bits, e.g. for 16 bit signed values
+        payloads.append(bytes([0x80, 0x00]) * (length // 2) + bytes([0x80]) * (length % 2))
+        payloads.append(bytes([0x7F, 0xFF]) * (length // 2) + bytes([0x7F]) * (length % 2))
+    seeds = [bytes.fromhex(seed_payload) for seed_payload in spec.seeds]
+    payloads.extend(seeds)
+    max_length = max([len(seed_payload) for seed_payload in seeds] + list(spec.lengths))
+
+    while len(payloads) < count:
+        if seeds and rng.random() < 0.5:
+            mutated = bytearray(rng.choice(seeds))
+            for _ in range(rng.randint(1, 3)):
+                position = rng.randrange(len(mutated))
+                mutated[position] = rng.choice(BOUNDARY_BYTES) if rng.random() < 0.3 else rng.randrange(256)
+            if rng.random() < 0.1:
+                del mutated[rng.randrange(len(mutated)):]
+            payloads.append(bytes(mutated))
+        else:
+            payloads.append(bytes(rng.randrange(256) for _ in range(rng.randint(0, max_length))))
+
+    return [(spec.fports[position % len(spec.fports)], payload) for position, payload in enumerate(payloads[:count])]
+
+
+def run_python_decoder(decoder_name: str, payloads: list, repeat: int) -> tuple:
+    """ Returns the results ({"data": ...} or {"error": ...}) and the seconds for decoding all payloads repeat times """
+    decoder = __import__(decoder_name)
+
+    def decode(fport, payload):
+        try:
+            return {"data": decoder.dict_from_bytes(payload, fport)}
+        except Exception as e:
+            return {"error": str(e)}
+
+    results = [decode(fport, payload) for fport, payload in payloads]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for fport, payload in payloads:
+            decode(fport, payload)
+    return results, time.perf_counter() - start
+
+
+def run_node_decoder(decoder_name: str, payloads: list, repeat: int) -> tuple:
+    """ Returns the results ({"data": ...} or {"error": ...}) and the seconds for decoding all payloads repeat times """
+    request = {
+        "decoder_path": os.path.join(NODE_DECODERS_PATH, decoder_name + ".js"),
+        "payloads": [[fport, payload.hex()] for fport, payload in payloads],
+        "repeat": repeat
+    }
+    process = subprocess.run(["node", NODE_RUNNER_PATH], input=json.dumps(request).encode(),
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    response = json.loads(process.stdout)
+    return response["results"], response["seconds"]
+
+
+def json_value(value):
+    """ Returns a value as Node.js would serialize it, e.g. NaN as null """
+    if isinstance(value, float) and (math.isnan(value) or math.isinf(value)):
+        return None
+    if isinstance(value, (list, tuple)):
+        return [json_value(item) for item in value]
+    if isinstance(value, dict):
+        return {key: json_value(item) for key, item in value.items()}
+    return value
+
+
+def values_equal(python_value, node_value) -> bool:
+    if isinstance(python_value, bool) or isinstance(node_value, bool):
+        return python_value is node_value
+    if isinstance(python_value, (int, float)) and isinstance(node_value, (int, float)):
+        return math.isclose(python_value, node_value, rel_tol=1e-9, abs_tol=1e-9)
+    if isinstance(python_value, list) and isinstance(node_value, list):
+        return len(python_value) == len(node_value) and all(values_equal(a, b) for a, b in zip(python_value, node_value))
+    return python_value == node_value
+
+
+def compare(decoder_name: str, spec: DecoderSpec, payloads: list, python_results: list, node_results: list,
+            max_examples: int = 5) -> DecoderComparison:
+    comparison = DecoderComparison(decoder_name)
+    for (fport, payload), python_result, node_result in zip(payloads, python_results, node_results):
+        comparison.payload_count += 1
+        python_data = python_result.get("data")
+        node_data = node_result.get("data")
+        if python_data is None and node_data is None:
+            comparison.both_failed += 1
+            continue
+        if node_data is None:
+            comparison.only_python_decoded += 1
+            diverged = True
+        elif python_data is None:
+            comparison.only_node_decoded += 1
+            diverged = True
+        else:
+            python_data = json_value(python_data)
+            node_data = {spec.aliases.get(key, key): value for key, value in node_data.items()}
+            diverged = False
+            for key in python_data.keys() | node_data.keys():
+                if key not in node_data:
+                    comparison.only_in_python[key] += 1
+                    diverged = True
+                elif key not in python_data:
+                    comparison.only_in_node[key] += 1
+                    diverged = True
+                elif not values_equal(python_data[key], node_data[key]):
+                    comparison.value_differences[key] += 1
+                    diverged = True
+        if not diverged:
+            comparison.agreements += 1
+        elif len(comparison.examples) < max_examples:
+            comparison.examples.append(Divergence(fport, payload.hex(), python_result, node_result))
+    return comparison
+
+
+def compare_decoder(decoder_name: str, payload_count: int, repeat: int, seed: int = 0) -> DecoderComparison:
+    spec = SHARED_DECODERS[decoder_name]
+    payloads = generate_payloads(spec, payload_count, seed)
+    python_results, python_seconds = run_python_decoder(decoder_name, payloads, repeat)
+    node_results, node_seconds = run_node_decoder(decoder_name, payloads, repeat)
+
+    comparison = compare(decoder_name, spec, payloads, python_results, node_results)
+    comparison.python_payloads_per_second = len(payloads) * repeat / max(python_seconds, 1e-9)
+    comparison.node_payloads_per_second = len(payloads) * repeat / max(node_seconds, 1e-9)
+    return comparison
+
+
+def print_comparison(comparison: DecoderComparison) -> None:
+    print(f"{comparison.decoder_name}: {comparison.payload_count} payloads, {comparison.agreements} identical, "
+          f"{comparison.both_failed} rejected by both, {comparison.divergent} divergent")
+    print(f"  only decoded by Python: {comparison.only_python_decoded}, only decoded by Node.js: {comparison.only_node_decoded}")
+    if comparison.value_differences:
+        print(f"  different values: {dict(comparison.value_differences.most_common())}")
+    if comparison.only_in_python:
+        print(f"  fields only in Python: {dict(comparison.only_in_python.most_common())}")
+    if comparison.only_in_node:
+        print(f"  fields only in Node.js: {dict(comparison.only_in_node.most_common())}")
+    for example in comparison.examples:
+        print(f"  e.g. FPort {example.fport} payload {example.payload}: Python {json.dumps(example.python, default=str)}, "
+              f"Node.js {json.dumps(example.node)}")
+    print(f"  throughput: Python {comparison.python_payloads_per_second:,.0f} payloads/s, "
+          f"Node.js {comparison.node_payloads_per_second:,.0f} payloads/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares the outputs and the throughput of the Python and Node.js binary decoders")
+    parser.add_argument("--decoders", nargs="+", choices=sorted(SHARED_DECODERS), default=sorted(SHARED_DECODERS),
+                        help="Decoders to compare")
+    parser.add_argument("--payloads", type=int, default=10000, help="Number of payloads per decoder")
+    parser.add_argument("--repeat", type=int, default=10, help="Number of times each payload is decoded for the throughput")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the payload generator")
+    parser.add_argument("--report", help="Path of a JSON file for the results")
+    parser.add_argument("--strict", action="store_true", help="Exit with code 1 if any output is divergent")
+    args = parser.parse_args()
+
+    comparisons = []
+    for decoder_name in args.decoders:
+        comparison = compare_decoder(decoder_name, args.payloads, args.repeat, args.seed)
+        print_comparison(comparison)
+        comparisons.append(comparison)
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump([comparison.to_dict() for comparison in comparisons], f, indent=2, default=str)
+
+    if args.strict and any(comparison.divergent for comparison in comparisons):
+        sys.exit(1)
+
+
+def test_generate_payloads():
+    spec = SHARED_DECODERS["dragino_lht65"]
+    payloads = generate_payloads(spec, 200, seed=1)
+    assert len(payloads) == 200
+    assert payloads == generate_payloads(spec, 200, seed=1)
+    assert (2, bytes(11)) in payloads
+    assert (2, b"\xff" * 11) in payloads
+    assert (2, bytes.fromhex(spec.seeds[0])) in payloads
+
+
+def test_compare():
+    spec = DecoderSpec(seeds=[], lengths=(), fports=(1,), aliases={"x": "accX"})
+    payloads = [(1, b"\x01"), (1, b"\x02"), (1, b"\x03"), (1, b"\x04")]
+    python_results = [{"data": {"accX": 1.0, "t": float("nan")}}, {"data": {"accX": 2}}, {"error": "e"}, {"error": "e"}]
+    node_results = [{"data": {"x": 1, "t": None}}, {"data": {"x": 3, "y": 0}}, {"data": {}}, {"error": "e"}]
+    comparison = compare("test", spec, payloads, python_results, node_results)
+    assert comparison.agreements == 1
+    assert comparison.both_failed == 1
+    assert comparison.only_node_decoded == 1
+    assert comparison.divergent == 2
+    assert comparison.value_differences == {"accX": 1}
+    assert comparison.only_in_node == {"y": 1}
+    assert [example.payload for example in comparison.examples] == ["02", "03"]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+// Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+// SPDX-License-Identifier: MIT-0
+
+// Permission is hereby granted, free of charge, to any person obtaining a copy of this
+// software and associated documentation files (the "Software"), to deal in the Software
+// without restriction, including without limitation the rights to use, copy, modify,
+// merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+// permit persons to whom the Software is furnished to do so.
+
+// THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+// INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+// PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+// HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+// OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+// SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+/* Runs a Node.js binary decoder for compare_decoders.py.
+
+Reads a JSON object from stdin:
+
+    {"decoder_path": "../src-payload-decoders/node/elsys.js", "payloads": [[fport, "hex"], ...], "repeat": 10}
+
+The decoder file is evaluated like in src-iotrule-transformation-nodejs/index.js. Every payload is decoded
+"repeat" times to measure the throughput. Writes a JSON object to stdout:
+
+    {"results": [{"data": {...}} or {"error": "..."}, ...], "seconds": 0.123}
+*/
+
+var fs = require('fs');
+var vm = require('vm');
+
+var input = JSON.parse(fs.readFileSync(0));
+
+vm.runInThisContext(fs.readFileSync(input.decoder_path), input.decoder_path);
+var decoder = decodeUplink
+
+var uplinks = input.payloads.map(function (payload) {
+    return { "fPort": payload[0], "bytes": Uint8Array.from(Buffer.from(payload[1], 'hex')) }
+})
+
+function decode(uplink) {
+    try {
+        var decoded = decoder(uplink)
+        if (decoded.hasOwnProperty("errors")) {
+            return { "error": String(decoded.errors) }
+        }
+        return { "data": decoded.data }
+    } catch (e) {
+        return { "error": String(e) }
+    }
+}
+
+var results = uplinks.map(decode)
+
+var start = process.hrtime.bigint()
+for (var r = 0; r < input.repeat; r++) {
+    for (var i = 0; i < uplinks.length; i++) {
+        decode(uplinks[i])
+    }
+}
+var seconds = Number(process.hrtime.bigint() - start) / 1e9
+
+process.stdout.write(JSON.stringify({ "results": results, "seconds": seconds }))
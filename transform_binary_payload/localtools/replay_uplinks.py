@@ -0,0 +1,356 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+#
+# Replay of archived uplinks through the binary decoders of the transformation function.
+#
+# Reads JSON Lines files (optionally gzip-compressed, "-" for stdin) with one uplink event of AWS IoT
+# Core for LoRaWAN per line, or with the messages republished by the AWS IoT Rule of this sample (the
+# uplink is then taken from "lns_payload"). Each uplink is decoded like by
+# src-iotrule-transformation/app.py, with PayloadDecoderName of the line or --decoder, and written as
+# a message of the AWS IoT Rule:
+#
+#   {"transformed_payload": {<decoded>, "status": 200, "decoder_name": ..., "WirelessDeviceId": ..., "DevEui": ...},
+#    "lns_payload": {"WirelessDeviceId": ..., "WirelessMetadata": ..., "PayloadData": ...}}
+#
+# Lines which can not be decoded are written to the error file with their source, line number and error.
+#
+# The input is streamed in chunks of lines. Chunks are decoded by a pool of processes (one per CPU by
+# default), at most two chunks per process are pending, and the results are written in input order,
+# so memory does not grow with the size of the archive.
+#
+# Usage:
+#   python localtools/replay_uplinks.py uplinks-2021-01-*.jsonl.gz --output decoded.jsonl.gz --errors errors.jsonl
+#   python localtools/replay_uplinks.py uplinks.jsonl --decoder routed --routes my_routes.json --output decoded.parquet
+#
+# Parquet output requires pyarrow. Its columns are wireless_device_id, dev_eui, fport, timestamp,
+# decoder_name and transformed_payload (the decoded payload as JSON string).
+#
+
+import argparse
+import base64
+import gzip
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+LOCALTOOLS_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(LOCALTOOLS_PATH, "..", "src-payload-decoders", "python"))
+sys.path.insert(0, os.path.join(LOCALTOOLS_PATH, "..", "src-iotrule-transformation"))
+
+from uplink import Uplink  # noqa: E402
+
+OUTPUT_FORMATS = ("jsonl", "parquet")
+
+PARQUET_COLUMNS = ("wireless_device_id", "dev_eui", "fport", "timestamp", "decoder_name", "transformed_payload")
+
+
+def load_transformation(routes_file: str = None):
+    """ Imports the transformation function, which resolves the decoders and the routing table """
+    if routes_file is not None:
+        os.environ["DECODER_ROUTES_FILE"] = os.path.abspath(routes_file)
+    import app
+    return app
+
+
+def open_text(path: str, mode: str):
+    if path == "-":
+        return sys.stdin if "r" in mode else sys.stdout
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t")
+    return open(path, mode)
+
+
+def read_chunks(paths: list, chunk_size: int):
+    """ Yields (source, number of the first line, lines) for chunks of the lines of the files """
+    for path in paths:
+        with open_text(path, "r") as f:
+            lines = []
+            first_line_number = 1
+            for line_number, line in enumerate(f, start=1):
+                if not lines:
+                    first_line_number = line_number
+                lines.append(line)
+                if len(lines) == chunk_size:
+                    yield path, first_line_number, lines
+                    lines = []
+            if lines:
+                yield path, first_line_number, lines
+
+
+def decode_record(app, record: dict, default_decoder_name: str) -> dict:
+    """ Decodes an archived uplink and returns the message of the AWS IoT Rule """
+    # Archives of the republished messages contain the uplink as lns_payload
+    event = record.get("lns_payload", record)
+    uplink = Uplink.from_event(event)
+    decoder_name = record.get("PayloadDecoderName", default_decoder_name)
+    route = app.select_route(decoder_name, record.get("DeviceProfileId"), uplink)
+
+    result = route.function(base64.b64decode(uplink.payload_data), uplink.fport)
+    result["status"] = 200
+    result["decoder_name"] = route.decoder_name
+    result["WirelessDeviceId"] = uplink.wireless_device_id
+    result["DevEui"] = uplink.dev_eui
+    message = {
+        "transformed_payload": result,
+        "lns_payload": {
+            "WirelessDeviceId": uplink.wireless_device_id,
+            "WirelessMetadata": event.get("WirelessMetadata"),
+            "PayloadData": uplink.payload_data
+        }
+    }
+    if "timestamp" in record:
+        message["timestamp"] = record["timestamp"]
+    return message
+
+
+def parquet_row(message: dict) -> tuple:
+    transformed_payload = message["transformed_payload"]
+    lorawan = (message["lns_payload"]["WirelessMetadata"] or {}).get("LoRaWAN") or {}
+    return (transformed_payload["WirelessDeviceId"], transformed_payload["DevEui"], lorawan.get("FPort"),
+            lorawan.get("Timestamp"), transformed_payload["decoder_name"], json.dumps(transformed_payload, default=str))
+
+
+def decode_chunk(chunk: tuple, default_decoder_name: str, output_format: str = "jsonl", routes_file: str = None) -> tuple:
+    """ Decodes a chunk of lines and returns (outputs, errors)
+
+        Outputs are JSON strings for the output format "jsonl" and row tuples for "parquet". Errors are JSON strings.
+    """
+    app = load_transformation(routes_file)
+    source, first_line_number, lines = chunk
+    outputs = []
+    errors = []
+    for line_number, line in enumerate(lines, start=first_line_number):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            message = decode_record(app, json.loads(line), default_decoder_name)
+            outputs.append(parquet_row(message) if output_format == "parquet" else json.dumps(message, default=str))
+        except Exception as e:
+            errors.append(json.dumps({"source": source, "line": line_number, "errorType": type(e).__name__,
+                                      "errorMessage": str(e), "record": line}))
+    return outputs, errors
+
+
+def decode_chunks(chunks, decode, workers: int):
+    """ Yields the results of decode(chunk) in the order of the chunks, using a pool of workers processes """
+    if workers <= 1:
+        for chunk in chunks:
+            yield decode(chunk)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(decode, chunk))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class JsonLinesWriter:
+
+    def __init__(self, path: str):
+        self.file = open_text(path, "w")
+
+    def write(self, outputs: list):
+        for output in outputs:
+            self.file.write(output)
+            self.file.write("\n")
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+
+
+class ParquetWriter:
+    """ Writes rows to a Parquet file, one row group per max_rows rows """
+
+    def __init__(self, path: str, max_rows: int = 100000):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise SystemExit("Parquet output requires pyarrow, e.g. pip install pyarrow")
+        self.pyarrow = pyarrow
+        self.schema = pyarrow.schema([("wireless_device_id", pyarrow.string()), ("dev_eui", pyarrow.string()),
+                                      ("fport", pyarrow.int32()), ("timestamp", pyarrow.string()),
+                                      ("decoder_name", pyarrow.string()), ("transformed_payload", pyarrow.string())])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+        self.max_rows = max_rows
+        self.rows = []
+
+    def write(self, rows: list):
+        self.rows.extend(rows)
+        if len(self.rows) >= self.max_rows:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            columns = list(zip(*self.rows))
+            self.writer.write_table(self.pyarrow.Table.from_arrays(
+                [self.pyarrow.array(column, type=field.type) for column, field in zip(columns, self.schema)], schema=self.schema))
+            self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+class Progress:
+
+    def __init__(self, interval_seconds: float, out=sys.stderr):
+        self.start = time.perf_counter()
+        self.last_report = self.start
+        self.interval_seconds = interval_seconds
+        self.out = out
+        self.decoded = 0
+        self.errors = 0
+
+    def update(self, decoded: int, errors: int):
+        self.decoded += decoded
+        self.errors += errors
+        now = time.perf_counter()
+        if now - self.last_report >= self.interval_seconds:
+            self.last_report = now
+            self.report(now)
+
+    def report(self, now: float = None):
+        elapsed = (now or time.perf_counter()) - self.start
+        total = self.decoded + self.errors
+        print(f"{total:,} uplinks, {self.decoded:,} decoded, {self.errors:,} errors, {elapsed:.1f}s, "
+              f"{total / max(elapsed, 1e-9):,.0f} uplinks/s", file=self.out)
+
+
+def replay(paths: list, output_path: str, errors_path: str, default_decoder_name: str = "routed",
+           output_format: str = "jsonl", routes_file: str = None, workers: int = None, chunk_size: int = 2000,
+           progress: Progress = None) -> Progress:
+    """ Decodes the uplinks of the files and writes the messages to output_path and the errors to errors_path """
+    load_transformation(routes_file)
+    workers = workers or os.cpu_count() or 1
+    progress = progress or Progress(float("inf"))
+    writer = ParquetWriter(output_path) if output_format == "parquet" else JsonLinesWriter(output_path)
+    error_writer = JsonLinesWriter(errors_path)
+
+    decode = _ChunkDecoder(default_decoder_name, output_format, routes_file)
+    try:
+        for outputs, errors in decode_chunks(read_chunks(paths, chunk_size), decode, workers):
+            writer.write(outputs)
+            error_writer.write(errors)
+            progress.update(len(outputs), len(errors))
+    finally:
+        writer.close()
+        error_writer.close()
+    return progress
+
+
+class _ChunkDecoder:
+    """ decode_chunk with fixed arguments, which can be sent to worker processes """
+
+    def __init__(self, default_decoder_name: str, output_format: str, routes_file: str):
+        self.default_decoder_name = default_decoder_name
+        self.output_format = output_format
+        self.routes_file = routes_file
+
+    def __call__(self, chunk: tuple) -> tuple:
+        return decode_chunk(chunk, self.default_decoder_name, self.output_format, self.routes_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decodes archived uplinks of AWS IoT Core for LoRaWAN with the binary decoders")
+    parser.add_argument("inputs", nargs="+", help="JSON Lines files, .gz for gzip compression, - for stdin")
+    parser.add_argument("--output", required=True, help="Output file, .gz for gzip compression of JSON Lines, - for stdout")
+    parser.add_argument("--errors", default="errors.jsonl", help="File for uplinks which can not be decoded")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, help="Output format, by default parquet for .parquet files, otherwise jsonl")
+    parser.add_argument("--decoder", default="routed", help="PayloadDecoderName for lines without PayloadDecoderName")
+    parser.add_argument("--routes", help="Routing table for the decoder 'routed', see src-iotrule-transformation/decoder_routing.py")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of decoding processes")
+    parser.add_argument("--chunk-size", type=int, default=2000, help="Number of lines per chunk")
+    parser.add_argument("--progress-interval", type=float, default=10, help="Seconds between two progress reports")
+    args = parser.parse_args()
+
+    output_format = args.format or ("parquet" if args.output.endswith(".parquet") else "jsonl")
+    progress = replay(args.inputs, args.output, args.errors, args.decoder, output_format, args.routes, args.workers,
+                      args.chunk_size, Progress(args.progress_interval))
+    progress.report()
+
+
+def _write_archive(path: str, lines: list):
+    with gzip.open(path, "wt") as f:
+        for line in lines:
+            f.write(line + "\n")
+
+
+def test_replay():
+    import tempfile
+    events = []
+    for i in range(25):
+        events.append(json.dumps({
+            "WirelessDeviceId": f"device-{i}",
+            "PayloadData": base64.b64encode(bytes.fromhex("0100E202290400270506060308070D621900E21900A3")).decode(),
+            "WirelessMetadata": {"LoRaWAN": {"DevEui": f"a84041000000{i:04x}", "FPort": 5, "Timestamp": "2021-01-01T00:00:00Z"}}
+        }))
+    events[3] = "not json"
+    events[7] = json.dumps({"PayloadData": "AA==", "WirelessMetadata": {"LoRaWAN": {"FPort": 5}}})
+
+    with tempfile.TemporaryDirectory() as directory:
+        archive = os.path.join(directory, "uplinks.jsonl.gz")
+        _write_archive(archive, events + [""])
+        for workers in [1, 2]:
+            output = os.path.join(directory, f"decoded-{workers}.jsonl")
+            errors = os.path.join(directory, f"errors-{workers}.jsonl")
+            progress = replay([archive], output, errors, default_decoder_name="elsys", workers=workers, chunk_size=4)
+            assert (progress.decoded, progress.errors) == (23, 2)
+
+            with open(output) as f:
+                messages = [json.loads(line) for line in f]
+            assert [message["lns_payload"]["WirelessDeviceId"] for message in messages] == \
+                [f"device-{i}" for i in range(25) if i not in (3, 7)]
+            assert messages[0]["transformed_payload"]["temperature"] == 22.6
+            assert messages[0]["transformed_payload"]["vdd"] == 3426
+            assert messages[0]["transformed_payload"]["decoder_name"] == "elsys"
+
+            with open(errors) as f:
+                error_records = [json.loads(line) for line in f]
+            assert [(error["line"], error["errorType"]) for error in error_records] == [(4, "JSONDecodeError"), (8, "Exception")]
+
+
+def test_replay_republished_messages():
+    import tempfile
+    message = {"transformed_payload": {"status": 200},
+               "lns_payload": {"WirelessDeviceId": "device", "PayloadData": "CwEAAAAABAAAAAA=",
+                               "WirelessMetadata": {"LoRaWAN": {"DevEui": "0025ca0000000001", "FPort": 1}}},
+               "timestamp": 1609459200000, "PayloadDecoderName": "sentrius_rs1xx"}
+    outputs, errors = decode_chunk(("test", 1, [json.dumps(message)]), "routed")
+    assert errors == []
+    decoded = json.loads(outputs[0])
+    assert decoded["transformed_payload"]["msg_type"] == "SendRTDData"
+    assert decoded["timestamp"] == 1609459200000
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "messages.jsonl")
+        with open(path, "w") as f:
+            f.write(json.dumps(message) + "\n")
+        assert list(read_chunks([path], 10)) == [(path, 1, [json.dumps(message) + "\n"])]
+
+
+if __name__ == "__main__":
+    main()
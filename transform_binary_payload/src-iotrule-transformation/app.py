@@ -18,58 +18,39 @@
 # If you want to implement additional binary decoders, please follow these steps:
 # Step 1: Choose a name for a binary decoder, for example "mylorawandevice".
 # Step 2: Implement binary decoder in a file "mylorawandevice.py". This file must contain "dict_from_payload(input:str)"
-# function, which takes a binary payload as an input and returns a dict with the decoded results.
-# Step 3: Add "import mylorawandevice.py" below
-# Step 4: Add "mylorawandevice" as a value to VALID_PAYLOAD_DECODER_NAMES
+# function, which takes a binary payload as an input and returns a dict with the decoded results. Optionally, the file
+# can contain "dict_from_bytes(decoded:bytes, fport:int)", which is called with the already base64-decoded payload
+# (bytes, bytearray or a memoryview of a larger buffer) instead, and "compiled_dict_from_bytes", a decoder generated
+# by decoder_codegen.py, which is preferred if present.
+# Step 3: Add "mylorawandevice" as a value to DECODER_NAMES in decoder_schemas.py
 #
 
 
+import base64
+import importlib
 import json
 import traceback
 import logging
+import os
 import sys
 
+from decoder_routing import default_route, load_routing_table
+from decoder_schemas import DECODER_NAMES
+from uplink import Uplink
 
-# Import binary decoders.
-#
-# If you want to implement additional binary decoders:
-# Please add "import mylorawandevice" for your binary decoders here (see "Step 3" above)
-
-import sample_device
-import dragino_lht65
-import axioma_w1
-import tabs_objectlocator
-import tabs_temphumsensor
-import elsys
-import globalsat_lt100
-import dragino_lgt92
-import dragino_lse01
-import dragino_lbt1
-import dragino_lds01
-import dragino_laq4
-import nas_um3080
-import adeunis_ftd2
-import adeunis_dc_v2
-import sentrius_rs1xx
-import meteo_helix
-import dragino_lsn50
-import dragino_llms01
-import st_nucleo_wl55jc
-
-# Allowed payload type values. This array will be used for validation of the "type" attribute for a
-# handle of a Lambda function. For each value in the list below, you should import a module with the
-# identical name.
-#
-# This module must implement "dict_from_payload(payload: str)" function which takes binary payload as
-# an input and returns a dict with decoded attribute values.
+
+# Allowed payload type values. This list is used for validation of the attribute "PayloadDecoderName".
+# It is the list of the decoders in the payload decoder layer, for each value the module with the
+# identical name is imported, see decoder_modules below.
 #
 # If you want to implement additional binary decoders:
-# please add name of your binary decoder (e.g. "mylorawandevice") here (see "Step 4" above)
-VALID_PAYLOAD_DECODER_NAMES = ["sample_device", "axioma_w1", "tabs_objectlocator", "tabs_temphumsensor",
-                               "dragino_lht65", "dragino_lgt92", "dragino_lse01", "dragino_lbt1", "dragino_lds01","dragino_laq4",
-                               "dragino_lsn50", "dragino_llms01",
-                               "elsys", "globalsat_lt100", "nas_um3080", "adeunis_ftd2", "adeunis_dc_v2",
-                               "sentrius_rs1xx", "meteo_helix", "st_nucleo_wl55jc"]
+# please add name of your binary decoder (e.g. "mylorawandevice") to DECODER_NAMES in decoder_schemas.py (see "Step 3" above)
+VALID_PAYLOAD_DECODER_NAMES = DECODER_NAMES
+
+# Value of PayloadDecoderName to select the decoder by the routing table in DECODER_ROUTES_FILE, see decoder_routing.py
+ROUTED_PAYLOAD_DECODER_NAME = "routed"
+DECODER_ROUTES_FILE = os.environ.get("DECODER_ROUTES_FILE",
+                                     os.path.join(os.path.dirname(os.path.abspath(__file__)), "decoder_routes.json"))
 
 # Function name for logging
 FUNCTION_NAME = "ConvertBinaryPayload"
@@ -85,6 +66,38 @@ class InvalidInputException(Exception):
     pass
 
 
+# Resolve the decoders and the routing table once per AWS Lambda execution environment
+decoder_modules = {name: importlib.import_module(name) for name in VALID_PAYLOAD_DECODER_NAMES}
+default_routes = {name: default_route(name, module) for name, module in decoder_modules.items()}
+decoder_routes = load_routing_table(DECODER_ROUTES_FILE, decoder_modules)
+
+
+def validate_payload_decoder_name(payload_decoder_name: str):
+    """ Raises InvalidInputException unless PayloadDecoderName is a decoder name or "routed" """
+    # Validate existence of payload type
+    if payload_decoder_name is None:
+        raise InvalidInputException(
+            "PayloadDecoderName is not specified")
+
+    # Validate  if payload type is in the list of allowed values
+    if payload_decoder_name != ROUTED_PAYLOAD_DECODER_NAME and payload_decoder_name not in VALID_PAYLOAD_DECODER_NAMES:
+        raise InvalidInputException(
+            "PayloadDecoderName have one of the following values:"+(".".join(VALID_PAYLOAD_DECODER_NAMES)))
+
+
+def select_route(payload_decoder_name: str, device_profile_id: str, uplink: Uplink):
+    """ Returns the decoder route for PayloadDecoderName, which is a decoder name or "routed" """
+    validate_payload_decoder_name(payload_decoder_name)
+
+    if payload_decoder_name == ROUTED_PAYLOAD_DECODER_NAME:
+        route = decoder_routes.lookup(device_profile_id, uplink.dev_eui, uplink.fport)
+        if route is None:
+            raise InvalidInputException(
+                f"No decoder route for DeviceProfileId={device_profile_id}, DevEui={uplink.dev_eui}, FPort={uplink.fport}")
+        return route
+    return default_routes[payload_decoder_name]
+
+
 def lambda_handler(event, context):
     """ Transforms a binary payload by invoking "decode_{event.type}" function
         Parameters 
@@ -94,6 +107,10 @@ def lambda_handler(event, context):
 
         PayloadDecoderName : string (obligatory parameter)
             The value of this attribute defines the name of a Python module which will be used to perform binary decoding. If value of "type" is for example "sample_device", then this function will perform an invocation of "sample_device.dict_from_payload" function. For this approach to work, you  have to import the necessary modules, e.g. by performing a "import sample_device01" command in the beginning of this file.
+            With the value "routed", the decoder is selected by DeviceProfileId or DevEui and FPort from the routing table in DECODER_ROUTES_FILE.
+
+        DeviceProfileId : str (optional parameter)
+            Device profile of the device, used to select the decoder if PayloadDecoderName is "routed"
 
         WirelessDeviceId : str (optional parameter)
             Wireless Device Id
@@ -134,48 +151,33 @@ def lambda_handler(event, context):
     """
     logger.info("Received event: %s" % json.dumps(event))
 
-    # Store event input and perform input validation
-    input_base64 = event.get("PayloadData")
+    # Validate the decoder configuration of the AWS IoT Rule
     payload_decoder_name = event.get("PayloadDecoderName")
+    validate_payload_decoder_name(payload_decoder_name)
 
-    # Validate existence of payload type
-    if payload_decoder_name is None:
-        raise InvalidInputException(
-            "PayloadDecoderName is not specified")
+    # Parse the uplink, select the decoder and invoke it. Invalid uplinks and uplinks without
+    # a decoder route are reported like decoding errors.
+    try:
+        uplink = Uplink.from_event(event)
+        input_base64 = uplink.payload_data
 
-    # Validate  if payload type is in the list of allowed values
-    if payload_decoder_name not in VALID_PAYLOAD_DECODER_NAMES:
-        raise InvalidInputException(
-            "PayloadDecoderName have one of the following values:"+(".".join(VALID_PAYLOAD_DECODER_NAMES)))
+        logger.info(f"Base64 input={input_base64}, Type={payload_decoder_name}")
 
-    logger.info(f"Base64 input={input_base64}, Type={payload_decoder_name}")
-
-    # Retrieve FPort from the metadata. In case FPort or surrounding attributes is missing,
-    # the function will intentionally not fail but proceed with fPort == None.
-    # The binary decoder function is expected to handle fPort == None.
-    fPort = None
-    if "WirelessMetadata" in event:
-        if "LoRaWAN" in event.get("WirelessMetadata"):
-            if "FPort" in event.get("WirelessMetadata").get("LoRaWAN"):
-                fPort = event.get("WirelessMetadata").get(
-                    "LoRaWAN").get("FPort")
-            else:
-                logger.warn(
-                    "Attribute 'WirelessMetadata.LoRaWAN' is missing. Will proceed with fPort == None.")
-        else:
+        # Retrieve FPort from the metadata. In case FPort or surrounding attributes is missing,
+        # the function will intentionally not fail but proceed with fPort == None.
+        # The binary decoder function is expected to handle fPort == None.
+        fPort = uplink.fport
+        if fPort is None:
             logger.warn(
-                "Attribute 'WirelessMetadata.LoRaWAN' is missing. Will proceed with fPort == None.")
-    else:
-        logger.warn(
-            "Attribute 'WirelessMetadata' is missing. Will proceed with fPort == None.")
+                "Attribute 'WirelessMetadata.LoRaWAN.FPort' is missing. Will proceed with fPort == None.")
 
-    # Derive a name of a payload conversion function based on the value of 'type' attribute
-    conversion_function_name = f"{payload_decoder_name}.dict_from_payload"
-    logger.info(f"Function name={conversion_function_name}")
+        # Select the payload conversion function based on the value of 'type' attribute or on the routing table
+        route = select_route(payload_decoder_name, event.get("DeviceProfileId"), uplink)
+        payload_decoder_name, conversion_function_name, conversion_function = route
+        logger.info(f"Function name={conversion_function_name}")
 
-    # Invoke a payload conversion function and return a result
-    try:
-        result = eval(conversion_function_name)(input_base64, fPort)
+        # Invoke a payload conversion function with the base64-decoded payload and return a result
+        result = conversion_function(base64.b64decode(input_base64), fPort)
         result["status"] = 200
         result["decoder_name"] = payload_decoder_name
         logger.info(result)
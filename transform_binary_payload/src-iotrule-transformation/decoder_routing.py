@@ -0,0 +1,265 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+#
+# Selection of the binary decoder for an uplink by device profile or DevEui prefix and FPort, so that one
+# AWS IoT Rule and one AWS Lambda function can serve a fleet of different device types.
+#
+# Routes are read from a JSON file:
+#
+#   {
+#       "Routes": [
+#           {"DeviceProfileId": "9c9ac1f5-...", "FPort": 24, "PayloadDecoderName": "nas_um3080", "Handler": "decode_status_message"},
+#           {"DeviceProfileId": "9c9ac1f5-...", "PayloadDecoderName": "nas_um3080"},
+#           {"DevEuiPrefix": "a84041", "PayloadDecoderName": "dragino_lht65"}
+#       ]
+#   }
+#
+# - A route matches either a DeviceProfileId or a DevEuiPrefix (hexadecimal, case-insensitive).
+# - FPort is optional. A route without FPort matches all FPorts.
+# - Handler is optional. It names a function "handler(decoded: bytes)" or "handler(decoded: bytes, fport: int)"
+#   of the decoder module, e.g. the message type specific function of a decoder. By default, the decoder's
+#   dict_from_bytes is used.
+#
+# Lookup order: DeviceProfileId before DevEuiPrefix, a longer DevEuiPrefix before a shorter one, and
+# a route with the FPort of the uplink before a route without FPort. All routes are resolved to
+# functions when the file is loaded, a lookup costs a few dict accesses.
+#
+
+import base64
+import inspect
+import json
+import os
+import re
+from collections import namedtuple
+
+DecoderRoute = namedtuple("DecoderRoute", ["decoder_name", "function_name", "function"])
+
+VALID_DEV_EUI_PREFIX_REGEX = re.compile("^[0-9a-fA-F]{1,16}$")
+VALID_HANDLER_NAME_REGEX = re.compile("^[a-z][a-z0-9_]*$")
+
+
+class InvalidRoutesException(Exception):
+    pass
+
+
+def bytes_decoder_name(module) -> str:
+    """ Returns the name of the function of a decoder module which is used by default """
+    for function_name in ["compiled_dict_from_bytes", "dict_from_bytes"]:
+        if hasattr(module, function_name):
+            return function_name
+    return "dict_from_payload"
+
+
+def bytes_decoder(module):
+    """ Returns the function (decoded: bytes, fport: int) -> dict of a binary decoder module, preferring the
+        decoder generated by decoder_codegen """
+    if hasattr(module, "compiled_dict_from_bytes"):
+        return module.compiled_dict_from_bytes
+    if hasattr(module, "dict_from_bytes"):
+        return module.dict_from_bytes
+    dict_from_payload = module.dict_from_payload
+    return lambda decoded, fport: dict_from_payload(base64.b64encode(decoded).decode("ascii"), fport)
+
+
+def handler_function(module, handler_name: str):
+    """ Returns the function (decoded: bytes, fport: int) -> dict for a handler of a decoder module, which is
+        called with the FPort if it accepts a second argument """
+    handler = getattr(module, handler_name)
+    try:
+        parameters = inspect.signature(handler).parameters.values()
+    except (TypeError, ValueError):
+        return handler
+    if any(p.kind == p.VAR_POSITIONAL for p in parameters) or \
+            sum(1 for p in parameters if p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD)) >= 2:
+        return handler
+    return lambda decoded, fport: handler(decoded)
+
+
+def default_route(decoder_name: str, module) -> DecoderRoute:
+    """ Returns the route to compiled_dict_from_bytes, dict_from_bytes or dict_from_payload of a decoder module """
+    return DecoderRoute(decoder_name, f"{decoder_name}.{bytes_decoder_name(module)}", bytes_decoder(module))
+
+
+class DecoderRoutingTable:
+    """ Index of decoder routes
+
+        Parameters
+        ----------
+        routes : list
+            Route objects as described above
+        decoders : dict
+            Decoder name -> decoder module. Routes may only refer to these decoders.
+    """
+
+    def __init__(self, routes: list, decoders: dict):
+        self._by_profile = {}
+        self._by_prefix = {}
+        prefix_lengths = set()
+
+        for position, route in enumerate(routes):
+            decoder_name = route.get("PayloadDecoderName")
+            if decoder_name not in decoders:
+                raise InvalidRoutesException(f"Route {position}: unknown PayloadDecoderName {decoder_name}")
+            fport = route.get("FPort")
+            if fport is not None and (not isinstance(fport, int) or isinstance(fport, bool) or not 0 < fport < 224):
+                raise InvalidRoutesException(f"Route {position}: FPort must be an integer from 1 to 223")
+
+            handler_name = route.get("Handler")
+            module = decoders[decoder_name]
+            if handler_name is None:
+                decoder_route = default_route(decoder_name, module)
+            elif VALID_HANDLER_NAME_REGEX.match(handler_name) and callable(getattr(module, handler_name, None)):
+                decoder_route = DecoderRoute(decoder_name, f"{decoder_name}.{handler_name}", handler_function(module, handler_name))
+            else:
+                raise InvalidRoutesException(f"Route {position}: {decoder_name} has no function {handler_name}")
+
+            profile_id = route.get("DeviceProfileId")
+            dev_eui_prefix = route.get("DevEuiPrefix")
+            if (profile_id is None) == (dev_eui_prefix is None):
+                raise InvalidRoutesException(f"Route {position}: either DeviceProfileId or DevEuiPrefix is required")
+            if profile_id is not None:
+                index, key = self._by_profile, (profile_id.lower(), fport)
+            elif VALID_DEV_EUI_PREFIX_REGEX.match(dev_eui_prefix):
+                index, key = self._by_prefix, (dev_eui_prefix.lower(), fport)
+                prefix_lengths.add(len(dev_eui_prefix))
+            else:
+                raise InvalidRoutesException(f"Route {position}: DevEuiPrefix must consist of 1 to 16 hexadecimal digits")
+
+            if key in index:
+                raise InvalidRoutesException(f"Route {position}: duplicate route for {key[0]} and FPort {fport}")
+            index[key] = decoder_route
+
+        self._prefix_lengths = sorted(prefix_lengths, reverse=True)
+
+    def __len__(self):
+        return len(self._by_profile) + len(self._by_prefix)
+
+    def lookup(self, device_profile_id: str = None, dev_eui: str = None, fport: int = None) -> DecoderRoute:
+        """ Returns the route for an uplink or None if no route matches """
+        if device_profile_id is not None:
+            device_profile_id = device_profile_id.lower()
+            route = self._by_profile.get((device_profile_id, fport)) or self._by_profile.get((device_profile_id, None))
+            if route is not None:
+                return route
+        if dev_eui is not None:
+            dev_eui = dev_eui.lower()
+            for length in self._prefix_lengths:
+                prefix = dev_eui[:length]
+                route = self._by_prefix.get((prefix, fport)) or self._by_prefix.get((prefix, None))
+                if route is not None:
+                    return route
+        return None
+
+
+def load_routing_table(path: str, decoders: dict) -> DecoderRoutingTable:
+    """ Loads routes from a JSON file. A missing file results in an empty routing table. """
+    if not os.path.exists(path):
+        return DecoderRoutingTable([], decoders)
+    with open(path) as f:
+        config = json.load(f)
+    return DecoderRoutingTable(config.get("Routes", []), decoders)
+
+
+class _TestDecoder:
+    """ Stand-in for a decoder module which decodes by FPort like nas_um3080 """
+
+    @staticmethod
+    def dict_from_bytes(decoded, fport=None):
+        return {"fport": fport, "length": len(decoded)}
+
+    @staticmethod
+    def decode_status_message(decoded):
+        return {"status": decoded[0]}
+
+    @staticmethod
+    def decode_usage_message(decoded, fport):
+        return {"usage": decoded[0], "fport": fport}
+
+
+TEST_PROFILE_ID = "9C9AC1F5-0000-4000-8000-000000000001"
+
+
+def test_lookup_order():
+    table = DecoderRoutingTable([
+        {"DeviceProfileId": TEST_PROFILE_ID, "FPort": 24, "PayloadDecoderName": "multi", "Handler": "decode_status_message"},
+        {"DeviceProfileId": TEST_PROFILE_ID, "PayloadDecoderName": "multi"},
+        {"DevEuiPrefix": "A84041", "PayloadDecoderName": "other"},
+        {"DevEuiPrefix": "A84041", "FPort": 25, "PayloadDecoderName": "multi", "Handler": "decode_usage_message"},
+        {"DevEuiPrefix": "a8404100", "FPort": 2, "PayloadDecoderName": "multi"}
+    ], {"multi": _TestDecoder, "other": _TestDecoder})
+    assert len(table) == 5
+
+    route = table.lookup(TEST_PROFILE_ID.lower(), "a840410000000001", 24)
+    assert route.function_name == "multi.decode_status_message"
+    assert route.function(b"\x07\x00", 24) == {"status": 7}
+    assert table.lookup(TEST_PROFILE_ID, "a840410000000001", 25).function_name == "multi.dict_from_bytes"
+
+    # Without device profile, the longest DevEui prefix with a matching FPort wins
+    assert table.lookup(None, "A840410000000001", 2).decoder_name == "multi"
+    assert table.lookup(None, "a840410000000001", 3).decoder_name == "other"
+    assert table.lookup("unknown", "a840420000000001", 2) is None
+
+    # Handlers which accept the FPort are called with it
+    assert table.lookup(None, "a840410000000001", 25).function(b"\x03", 25) == {"usage": 3, "fport": 25}
+
+
+def test_default_route_prefers_compiled_decoder():
+    class CompiledTestDecoder(_TestDecoder):
+        @staticmethod
+        def compiled_dict_from_bytes(decoded, fport=None):
+            return {"compiled": True}
+
+    route = default_route("compiled", CompiledTestDecoder)
+    assert route.function_name == "compiled.compiled_dict_from_bytes"
+    assert route.function(b"\x00", 1) == {"compiled": True}
+    assert default_route("multi", _TestDecoder).function_name == "multi.dict_from_bytes"
+
+
+def test_invalid_routes():
+    for routes in [[{"DevEuiPrefix": "a8", "PayloadDecoderName": "unknown"}],
+                   [{"PayloadDecoderName": "multi"}],
+                   [{"DevEuiPrefix": "xyz", "PayloadDecoderName": "multi"}],
+                   [{"DevEuiPrefix": "a8", "FPort": 0, "PayloadDecoderName": "multi"}],
+                   [{"DevEuiPrefix": "a8", "PayloadDecoderName": "multi", "Handler": "__init__"}],
+                   [{"DevEuiPrefix": "a8", "PayloadDecoderName": "multi"}, {"DevEuiPrefix": "A8", "PayloadDecoderName": "multi"}]]:
+        try:
+            DecoderRoutingTable(routes, {"multi": _TestDecoder})
+            assert False, routes
+        except InvalidRoutesException:
+            pass
+
+
+def test_example_routes():
+    import sys
+    here = os.path.dirname(os.path.abspath(__file__))
+    sys.path.append(os.path.join(here, "..", "src-payload-decoders", "python"))
+    import dragino_lht65
+    import elsys
+    import nas_um3080
+
+    table = load_routing_table(os.path.join(here, "decoder_routes.example.json"),
+                               {"dragino_lht65": dragino_lht65, "elsys": elsys, "nas_um3080": nas_um3080})
+    assert table.lookup(None, "70B3D5000000ABCD", 24).function_name == "nas_um3080.decode_status_message"
+    assert table.lookup(None, "a840410000000001", 2).decoder_name == "dragino_lht65"
+    assert table.lookup(None, "0000000000000001", 2) is None
+
+
+if __name__ == "__main__":
+    test_lookup_order()
+    test_default_route_prefers_compiled_decoder()
+    test_invalid_routes()
+    test_example_routes()
@@ -21,10 +21,67 @@
 
 import base64
 
+from decoder_schemas import BOOLEAN, INTEGER, OBJECT, STRING, Field, OutputSchema, register
+from status_tables import StatusTable, bit, bits
+
+CHANNEL_FIELDS = [Field("value", INTEGER), Field("currentState", BOOLEAN), Field("previousFrameState", BOOLEAN)]
+
+OUTPUT_SCHEMA = register("adeunis_dc_v2", OutputSchema([
+    Field("type", STRING),
+    Field("status", OBJECT, fields=[
+        Field("frameCounter", INTEGER),
+        Field("noError", BOOLEAN),
+        Field("lowBattery", BOOLEAN),
+        Field("configurationDone", BOOLEAN),
+        Field("timestamp", BOOLEAN)
+    ]),
+    Field("timestamp", INTEGER, unit="s", required=False)
+], variant_field="type", variants={
+    "0x40 Dry Contacts 2 data": [Field(channel, OBJECT, fields=CHANNEL_FIELDS) for channel in ["channelA", "channelB", "channelC", "channelD"]]
+}))
+
 # DEBUG MODE
 DEBUG_OUTPUT = False
 
 
+FRAME_TYPES = {
+    0x10: "0x10 Dry Contacts 2 configuration",
+    0x20: "0x20 Configuration",
+    0x2F: "0x2f Downlink ack",
+    0x30: "0x30 Dry Contacts 2 keep alive",
+    0x33: "0x33 Set register status",
+    0x40: "0x40 Dry Contacts 2 data",
+    0x59: "0x59 Dry Contacts 2 time counting data"
+}
+
+FRAME_TYPE_TABLE = StatusTable(lambda frame_code: FRAME_TYPES.get(frame_code, "Invalid frame code"))
+
+
+def decode_status(status: int) -> dict:
+    # bit0 - Configuration Done, bit1 - Low Battery, bit2 - Timestamp, bit3 - AppFlag1, bit4 - AppFlag2
+    config = bit(status, 0)
+    low_bat = bit(status, 1)
+    timestamp = bit(status, 2)
+    app_flag_1 = bit(status, 3)
+    app_flag_2 = bit(status, 4)
+
+    return {
+        # bit5-7 - Frame Counter
+        "frameCounter": bits(status, 0b11100000, 5),
+        # check if there is no error
+        "noError": not (config or low_bat or timestamp or app_flag_1 or app_flag_2),
+        "lowBattery": low_bat,
+        "configurationDone": config,
+        "timestamp": timestamp
+    }
+
+
+STATUS_TABLE = StatusTable(decode_status)
+
+# Details byte: current state (even bits) and state in the previous frame (odd bits) of channels A to D
+DETAILS_TABLE = StatusTable(lambda details: [bit(details, position) for position in range(8)])
+
+
 #    Data frame (0x40)
 #   | byte |  bit7  |  bit6  | bit5 | bit4 | bit3 | bit2 | bit1 | bit0 |
 #   |------|--------|--------|------|------|------|------|------|------|
@@ -65,9 +122,13 @@ def dict_from_payload(base64_input: str, fport: int = None):
         -------
         JSON object with key/value pairs of decoded attributes
     """
+    return dict_from_bytes(base64.b64decode(base64_input), fport)
+
+
+def dict_from_bytes(decoded: bytes, fport: int = None):
+    """ Decodes a frame of the Adeunis Dry Contacts v2, whose layout depends on the frame code in byte 0 """
     # Payload
     # The size of the payload varies depending on the information that is send.
-    decoded = base64.b64decode(base64_input)
     # Index for iterating over the payload bytes
     byte_index = 0
     # result dictionary
@@ -87,159 +148,50 @@ def dict_from_payload(base64_input: str, fport: int = None):
         frame_code = decoded[0]
 
         # getting the frame type
-        if frame_code == 0x10:
-            result["type"] = "0x10 Dry Contacts 2 configuration"
-        elif frame_code == 0x20:
-            result["type"] = "0x20 Configuration"
-        elif frame_code == 0x2F:
-            result["type"] = "0x2f Downlink ack"
-        elif frame_code == 0x30:
-            result["type"] = "0x30 Dry Contacts 2 keep alive"
-        elif frame_code == 0x33:
-            result["type"] = "0x33 Set register status"
-        elif frame_code == 0x40:
-            result["type"] = "0x40 Dry Contacts 2 data"
-        elif frame_code == 0x59:
-            result["type"] = "0x59 Dry Contacts 2 time counting data"
-        else:
-            result["type"] = "Invalid frame code"
+        result["type"] = FRAME_TYPE_TABLE[frame_code]
 
         # Status - one Byte
-        status = decoded[1]
-
-        # bit0 - Configuration Done
-        config = status & 0b00000001
-        if config & 0b1:
-            config = True
-        else:
-            config = False
-
-        # bit1 - Low Battery
-        low_bat = (status & 0b00000010) >> 1
-        if low_bat & 0b1:
-            low_bat = True
-        else:
-            low_bat = False
-
-        # bit2 - Timestamp
-        timestamp = (status & 0b00000100) >> 2
-        if timestamp & 0b1:
-            timestamp = True
-        else:
-            timestamp = False
-
-        # bit3 - AppFlag1
-        app_flag_1 = (status & 0b00001000) >> 3
-        if app_flag_1 & 0b1:
-            app_flag_1 = True
-        else:
-            app_flag_1 = False
-
-        # bit4 - AppFlag2
-        app_flag_2 = (status & 0b00010000) >> 4
-        if app_flag_2 & 0b1:
-            app_flag_2 = True
-        else:
-            app_flag_2 = False
-
-        # bit5-6 - Frame Counter
-        frame_counter = (status & 0b11100000) >> 5
-
-        # check if there is no error
-        no_error = not (config or low_bat or timestamp or app_flag_1 or app_flag_2)
+        status = STATUS_TABLE[decoded[1]]
 
         # building the result
-        result["status"] = {
-            "frameCounter": frame_counter,
-            "noError": no_error,
-            "lowBattery": low_bat,
-            "configurationDone": config,
-            "timestamp": timestamp
-        }
+        result["status"] = STATUS_TABLE.copy(decoded[1])
 
         if frame_code == 0x40:
+            # details - byte 10
+            # Define precisely the input/output state
+            a_current, a_previous, b_current, b_previous, c_current, c_previous, d_current, d_previous = \
+                DETAILS_TABLE[decoded[10]]
+
             # channel a - byte 2&3
-            channel_a = ((decoded[2] << 8) | decoded[3])
             result["channelA"] = {
-                "value": channel_a
+                "value": (decoded[2] << 8) | decoded[3],
+                "currentState": a_current,
+                "previousFrameState": a_previous
             }
 
             # channel b - byte 4&5
-            channel_b = ((decoded[4] << 8) | decoded[5])
             result["channelB"] = {
-                "value": channel_b
+                "value": (decoded[4] << 8) | decoded[5],
+                "currentState": b_current,
+                "previousFrameState": b_previous
             }
 
             # channel c - byte 6&7
-            channel_c = ((decoded[6] << 8) | decoded[7])
             result["channelC"] = {
-                "value": channel_c
+                "value": (decoded[6] << 8) | decoded[7],
+                "currentState": c_current,
+                "previousFrameState": c_previous
             }
 
             # channel d - byte 8&9
-            channel_d = ((decoded[8] << 8) | decoded[9])
             result["channelD"] = {
-                "value": channel_d
+                "value": (decoded[8] << 8) | decoded[9],
+                "currentState": d_current,
+                "previousFrameState": d_previous
             }
 
-            # details - byte 10
-            # Define precisely the input/output state
-            details = decoded[10]
-
-            # channel a
-            channel_a_current_state = details & 0b00000001
-            if channel_a_current_state & 0b1:
-                result["channelA"]["currentState"] = True
-            else:
-                result["channelA"]["currentState"] = False
-
-            channel_a_previous_frame = (details & 0b00000010) >> 1
-            if channel_a_previous_frame & 0b1:
-                result["channelA"]["previousFrameState"] = True
-            else:
-                result["channelA"]["previousFrameState"] = False
-
-            # channel b
-            channel_b_current_state = (details & 0b00000100) >> 2
-            if channel_b_current_state & 0b1:
-                result["channelB"]["currentState"] = True
-            else:
-                result["channelB"]["currentState"] = False
-
-            channel_b_previous_frame = (details & 0b00001000) >> 3
-            if channel_b_previous_frame & 0b1:
-                result["channelB"]["previousFrameState"] = True
-            else:
-                result["channelB"]["previousFrameState"] = False
-
-            # channel c
-            channel_c_current_state = (details & 0b00010000) >> 4
-            if channel_c_current_state & 0b1:
-                result["channelC"]["currentState"] = True
-            else:
-                result["channelC"]["currentState"] = False
-
-            channel_c_previous_frame = (details & 0b00100000) >> 5
-            if channel_c_previous_frame & 0b1:
-                result["channelC"]["previousFrameState"] = True
-            else:
-                result["channelC"]["previousFrameState"] = False
-
-            # channel d
-            channel_d_current_state = (details & 0b01000000) >> 6
-            if channel_d_current_state & 0b1:
-                result["channelD"]["currentState"] = True
-            else:
-                result["channelD"]["currentState"] = False
-
-            channel_d_previous_frame = (details & 0b10000000) >> 7
-            if channel_d_previous_frame & 0b1:
-                result["channelD"]["previousFrameState"] = True
-            else:
-                result["channelD"]["previousFrameState"] = False
-
             # timestamp in EPOCH 2013
-            if timestamp and len(decoded) > 10:
+            if status["timestamp"] and len(decoded) > 10:
                 timestamp_data = ((decoded[11] << 24) | decoded[12] << 16 | decoded[13] << 8 | decoded[14])
                 result["timestamp"] = timestamp_data
 
@@ -23,11 +23,60 @@ import base64
 import json
 
 import helpers
+from decoder_schemas import INTEGER, NUMBER, OBJECT, STRING, Field, OutputSchema, register
+from status_tables import StatusTable, bit, bits
+
+# The fields of an uplink depend on the presence bits of its status byte
+OUTPUT_SCHEMA = register("adeunis_ftd2", OutputSchema([
+    Field("trigger", STRING, required=False),
+    Field("temperature", INTEGER, unit="°C", required=False),
+    Field("latitude", NUMBER, unit="°", required=False),
+    Field("longitude", NUMBER, unit="°", required=False),
+    Field("gps_quality", OBJECT, required=False, fields=[
+        Field("reception_scale", STRING),
+        Field("number_satellites", INTEGER)
+    ]),
+    Field("uplink_frame_counter", INTEGER, required=False),
+    Field("downlink_frame_counter", INTEGER, required=False),
+    Field("battery_lvl", INTEGER, unit="mV", required=False),
+    Field("rssi/snr", OBJECT, required=False, fields=[
+        Field("rssi_dbm", INTEGER, unit="dBm"),
+        Field("snr_db", INTEGER, unit="dB")
+    ])
+]))
 
 # DEBUG MODE
 DEBUG_OUTPUT = False
 
 
+def decode_status_presence(status: int) -> dict:
+    # True = Data is present in the payload, False = Data is missing from the Payload
+    trigger = None
+    if bit(status, 5):
+        trigger = "Button"
+    elif bit(status, 6):
+        trigger = "Accelerometer"
+    return {
+        "rssi_snr": bit(status, 0),
+        "battery_lvl": bit(status, 1),
+        "downlink": bit(status, 2),
+        "uplink": bit(status, 3),
+        "gps": bit(status, 4),
+        "trigger": trigger,
+        "temperature": bit(status, 7)
+    }
+
+
+STATUS_PRESENCE_TABLE = StatusTable(decode_status_presence)
+
+RECEPTION_SCALES = {1: "Good", 2: "Average", 3: "Poor"}
+
+GPS_QUALITY_TABLE = StatusTable(lambda quality: {
+    "reception_scale": RECEPTION_SCALES.get(bits(quality, 0b11110000, 4), "Unknown"),
+    "number_satellites": bits(quality, 0b00001111)
+})
+
+
 #   | byte |  bit7  |  bit6  | bit5 | bit4 | bit3 | bit2 | bit1 | bit0 |
 #   |------|--------|--------|------|------|------|------|------|------|
 #   |   0  |   Status                                                  |
@@ -72,9 +121,13 @@ def dict_from_payload(base64_input: str, fport: int = None):
         -------
         JSON object with key/value pairs of decoded attributes
     """
+    return dict_from_bytes(base64.b64decode(base64_input), fport)
+
+
+def dict_from_bytes(decoded: bytes, fport: int = None):
+    """ Decodes a frame of the Adeunis Field Test Device 2, whose fields are flagged in the status byte """
     # Payload
     # The size of the payload varies depending on the information that is send.
-    decoded = base64.b64decode(base64_input)
     # Index for iterating over the payload bytes
     byte_index = 0
     # result dictionary
@@ -90,70 +143,21 @@ def dict_from_payload(base64_input: str, fport: int = None):
     # False = Data is missing from the Payload
     if len(decoded):
         # getting the first byte
-        status_presence = decoded[byte_index]
-        status_presence_rssi_snr = status_presence & 0b00000001
-        if status_presence_rssi_snr == 0b1:
-            status_presence_rssi_snr = True
-        elif status_presence_rssi_snr == 0b0:
-            status_presence_rssi_snr = False
-
-        status_presence_battery_lvl = (status_presence & 0b00000010) >> 1
-        if status_presence_battery_lvl == 0b1:
-            status_presence_battery_lvl = True
-        elif status_presence_battery_lvl == 0b0:
-            status_presence_battery_lvl = False
-
-        status_presence_downlink = (status_presence & 0b00000100) >> 2
-        if status_presence_downlink == 0b1:
-            status_presence_downlink = True
-        elif status_presence_downlink == 0b0:
-            status_presence_downlink = False
-
-        status_presence_uplink = (status_presence & 0b00001000) >> 3
-        if status_presence_uplink == 0b1:
-            status_presence_uplink = True
-        elif status_presence_uplink == 0b0:
-            status_presence_uplink = False
-
-        status_presence_gps = (status_presence & 0b00010000) >> 4
-        if status_presence_gps == 0b1:
-            status_presence_gps = True
-        elif status_presence_gps == 0b0:
-            status_presence_gps = False
-
-        status_presence_trigger_button = (status_presence & 0b00100000) >> 5
-        if status_presence_trigger_button == 0b001:
-            status_presence_trigger_button = True
-        elif status_presence_trigger_button == 0b000:
-            status_presence_trigger_button = False
-
-        status_presence_trigger_acc = (status_presence & 0b01000000) >> 6
-        if status_presence_trigger_acc == 0b1:
-            status_presence_trigger_acc = True
-        elif status_presence_trigger_acc == 0b0:
-            status_presence_trigger_acc = False
-
-        status_presence_temp = (status_presence & 0b10000000) >> 7
-        if status_presence_temp == 0b1:
-            status_presence_temp = True
-        elif status_presence_temp == 0b0:
-            status_presence_temp = False
+        status_presence = STATUS_PRESENCE_TABLE[decoded[byte_index]]
 
         # adding the trigger action to the result
-        if status_presence_trigger_button:
-            result["trigger"] = "Button"
-        elif status_presence_trigger_acc:
-            result["trigger"] = "Accelerometer"
+        if status_presence["trigger"] is not None:
+            result["trigger"] = status_presence["trigger"]
 
         byte_index += 1
 
         # Temperature - one Byte
-        if status_presence_temp and len(decoded) >= byte_index + 1:
+        if status_presence["temperature"] and len(decoded) >= byte_index + 1:
             result["temperature"] = helpers.bin8dec(decoded[byte_index])
             byte_index += 1
 
         # Latitude - 4 Bytes
-        if status_presence_gps and len(decoded) >= byte_index + 9:
+        if status_presence["gps"] and len(decoded) >= byte_index + 9:
             lat_bcd_deg_tenth = (decoded[byte_index] & 0b11110000) >> 4
             lat_bcd_deg_whole = decoded[byte_index] & 0b00001111
             byte_index += 1
@@ -210,38 +214,28 @@ def dict_from_payload(base64_input: str, fport: int = None):
             byte_index += 1
 
             # GPS quality - one Byte
-            result["gps_quality"] = {
-                "reception_scale": "Unknown",
-                "number_satellites": decoded[byte_index] & 0b00001111
-            }
-            reception_scale = (decoded[byte_index] & 0b11110000) >> 4
-            if reception_scale == 1:
-                result["gps_quality"]["reception_scale"] = "Good"
-            elif reception_scale == 2:
-                result["gps_quality"]["reception_scale"] = "Average"
-            elif reception_scale == 3:
-                result["gps_quality"]["reception_scale"] = "Poor"
+            result["gps_quality"] = GPS_QUALITY_TABLE.copy(decoded[byte_index])
 
             byte_index += 1
 
         # Uplink counter - one Byte
-        if status_presence_uplink and len(decoded) >= byte_index + 1:
+        if status_presence["uplink"] and len(decoded) >= byte_index + 1:
             result["uplink_frame_counter"] = decoded[byte_index]
             byte_index += 1
 
         # Downlink counter - one Byte
-        if status_presence_downlink and len(decoded) >= byte_index + 1:
+        if status_presence["downlink"] and len(decoded) >= byte_index + 1:
             result["downlink_frame_counter"] = decoded[byte_index]
             byte_index += 1
 
         # Battery level - two Bytes
-        if status_presence_battery_lvl and len(decoded) >= byte_index + 2:
+        if status_presence["battery_lvl"] and len(decoded) >= byte_index + 2:
             result["battery_lvl"] = ((decoded[byte_index] << 8) | decoded[byte_index + 1])
             byte_index += 2
 
         # RSSI - one Byte
         # SNR - one Byte
-        if status_presence_rssi_snr and len(decoded) >= byte_index + 2:
+        if status_presence["rssi_snr"] and len(decoded) >= byte_index + 2:
             result["rssi/snr"] = {
                 "rssi_dbm": decoded[byte_index],
                 "snr_db": helpers.bin8dec(decoded[byte_index + 1])
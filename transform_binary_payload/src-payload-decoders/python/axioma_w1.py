@@ -16,6 +16,23 @@
 
 import base64
 import datetime
+from decoder_schemas import BOOLEAN, INTEGER, OBJECT, STRING, Field, OutputSchema, register
+
+# log_data holds the historic volumes as timestamp_<n>/volume_<n> pairs
+OUTPUT_SCHEMA = register("axioma_w1", OutputSchema([
+    Field("timestamp", STRING),
+    Field("status", INTEGER),
+    Field("total_volume", INTEGER, unit="l"),
+    Field("log_data", OBJECT),
+    Field("alarm_low_temperature", BOOLEAN),
+    Field("alarm_leakage", BOOLEAN),
+    Field("alarm_burst", BOOLEAN),
+    Field("alarm_backflow", BOOLEAN),
+    Field("alarm_dry", BOOLEAN),
+    Field("alarm_manipulation", BOOLEAN),
+    Field("alarm_permanent", BOOLEAN),
+    Field("alarm_battery", BOOLEAN)
+]))
 
 
 def int_from_bytes_at_offset(bytes, block_offset, block_size):
@@ -124,13 +141,17 @@ def decode_alarm_data(decoded_payload):
 
 
 def dict_from_payload(payload, fport: int = None):
-    bytes = base64.b64decode(payload)
+    return dict_from_bytes(base64.b64decode(payload), fport)
+
+
+def dict_from_bytes(decoded: bytes, fport: int = None):
+    """ Decodes the primary data, the log of volumes and the alarms of an Axioma W1 water meter """
 
     decoded_payload = {}
     offset = 0
 
-    offset = decode_primary_data(bytes, offset, decoded_payload)
-    offset = decode_log_data(bytes, offset, decoded_payload)
+    offset = decode_primary_data(decoded, offset, decoded_payload)
+    offset = decode_log_data(decoded, offset, decoded_payload)
     decode_alarm_data(decoded_payload)
 
     return decoded_payload
@@ -0,0 +1,181 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+#
+# Bulk decoding of many payloads with one binary decoder, e.g. for backfill jobs.
+#
+#   results = decode_bulk("elsys", payloads, fports)
+#   for payload, decoded, error in zip(payloads, results.decoded, results.errors): ...
+#
+# The decoders are CPU-bound Python, so large lists of payloads are split into chunks which are
+# decoded by a pool of processes. Each chunk is sent to its process as one bytes object with the
+# payloads concatenated, an array of offsets and an array of FPorts, which is cheaper to pickle than
+# a list of many small bytes objects. The results are returned in the order of the payloads. Below
+# PARALLEL_THRESHOLD payloads, starting processes costs more than it saves and the payloads are
+# decoded in the calling process.
+#
+
+import base64
+import importlib
+import os
+from array import array
+from collections import namedtuple
+from itertools import accumulate
+from concurrent.futures import ProcessPoolExecutor
+
+PARALLEL_THRESHOLD = 50000
+CHUNK_SIZE = 10000
+
+# FPort in the packed arrays of FPorts for payloads without FPort
+_NO_FPORT = -1
+
+BulkDecodeResult = namedtuple("BulkDecodeResult", ["decoded", "errors"])
+BulkDecodeResult.__doc__ = """ Results of decode_bulk
+
+    decoded : list
+        Output of the decoder for each payload, None if the payload could not be decoded
+    errors : list
+        Error message for each payload ("<exception type>: <message>"), None if the payload was decoded
+"""
+
+
+def _decoder_function(decoder_name: str):
+    """ Returns the function (decoded: bytes, fport: int) -> dict of a decoder, preferring the decoder generated by decoder_codegen """
+    module = importlib.import_module(decoder_name)
+    if hasattr(module, "compiled_dict_from_bytes"):
+        return module.compiled_dict_from_bytes
+    if hasattr(module, "dict_from_bytes"):
+        return module.dict_from_bytes
+    dict_from_payload = module.dict_from_payload
+    return lambda decoded, fport: dict_from_payload(base64.b64encode(decoded).decode("ascii"), fport)
+
+
+def pack(payloads: list, fports: list = None) -> tuple:
+    """ Packs payloads and FPorts into (bytes, offsets, fports)
+
+        The payload i is data[offsets[i]:offsets[i + 1]]. A FPort of None is packed as -1.
+    """
+    offsets = array("I", [0])
+    offsets.extend(accumulate(map(len, payloads)))
+    packed_fports = array("h", [_NO_FPORT if fport is None else fport for fport in fports] if fports is not None
+                          else [_NO_FPORT] * len(payloads))
+    return b"".join(payloads), offsets, packed_fports
+
+
+def decode_packed(decoder_name: str, data: bytes, offsets: array, fports: array) -> BulkDecodeResult:
+    """ Decodes packed payloads, see pack() """
+    decode = _decoder_function(decoder_name)
+    decoded = []
+    errors = []
+    for i, fport in enumerate(fports):
+        try:
+            decoded.append(decode(data[offsets[i]:offsets[i + 1]], None if fport == _NO_FPORT else fport))
+            errors.append(None)
+        except Exception as e:
+            decoded.append(None)
+            errors.append(f"{type(e).__name__}: {e}")
+    return BulkDecodeResult(decoded, errors)
+
+
+def decode_bulk(decoder_name: str, payloads: list, fports: list = None, workers: int = None,
+                chunk_size: int = CHUNK_SIZE, parallel_threshold: int = PARALLEL_THRESHOLD,
+                executor: ProcessPoolExecutor = None) -> BulkDecodeResult:
+    """ Decodes a list of payloads with a binary decoder
+
+        Parameters
+        ----------
+        decoder_name : str
+            Name of the decoder module, e.g. "elsys"
+        payloads : list
+            Binary payloads
+        fports : list
+            FPort of each payload, None for decoders without FPort
+        workers : int
+            Number of processes, by default the number of CPUs
+        chunk_size : int
+            Number of payloads per task of a process
+        parallel_threshold : int
+            Minimum number of payloads to decode in parallel
+        executor : ProcessPoolExecutor
+            Pool to use instead of starting a pool per call, e.g. for jobs which decode many lists
+
+        Returns
+        -------
+        BulkDecodeResult with the outputs and errors in the order of the payloads
+    """
+    if fports is not None and len(fports) != len(payloads):
+        raise ValueError(f"Got {len(fports)} FPorts for {len(payloads)} payloads")
+    workers = workers or os.cpu_count() or 1
+    if len(payloads) < parallel_threshold or (workers <= 1 and executor is None):
+        return decode_packed(decoder_name, *pack(payloads, fports))
+
+    chunks = [pack(payloads[start:start + chunk_size], fports[start:start + chunk_size] if fports is not None else None)
+              for start in range(0, len(payloads), chunk_size)]
+    if executor is not None:
+        return _merge(executor, decoder_name, chunks)
+    with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+        return _merge(pool, decoder_name, chunks)
+
+
+def _merge(executor: ProcessPoolExecutor, decoder_name: str, chunks: list) -> BulkDecodeResult:
+    futures = [executor.submit(decode_packed, decoder_name, *chunk) for chunk in chunks]
+    decoded = []
+    errors = []
+    for future in futures:
+        result = future.result()
+        decoded.extend(result.decoded)
+        errors.extend(result.errors)
+    return BulkDecodeResult(decoded, errors)
+
+
+def test_pack():
+    data, offsets, fports = pack([b"\x01\x02", b"", b"\x03"], [1, None, 2])
+    assert data == b"\x01\x02\x03"
+    assert list(offsets) == [0, 2, 2, 3]
+    assert list(fports) == [1, _NO_FPORT, 2]
+    assert list(pack([b"\x01"])[2]) == [_NO_FPORT]
+
+
+def test_decode_bulk():
+    import random
+    rng = random.Random(0)
+    payloads = [bytes.fromhex("0100E202290400270506060308070D621900E21900A3")] * 50 + \
+        [bytes(rng.randrange(256) for _ in range(rng.randrange(1, 20))) for _ in range(150)]
+    rng.shuffle(payloads)
+    fports = [5] * len(payloads)
+
+    sequential = decode_bulk("elsys", payloads, fports)
+    assert len(sequential.decoded) == len(payloads)
+    assert sequential.decoded.count(None) == len(payloads) - sequential.errors.count(None)
+    assert any(error is not None for error in sequential.errors)
+    assert sum(1 for decoded in sequential.decoded if decoded and decoded.get("vdd") == 3426) >= 50
+
+    parallel = decode_bulk("elsys", payloads, fports, workers=2, chunk_size=32, parallel_threshold=0)
+    assert parallel == sequential
+
+    decoded = decode_bulk("dragino_lht65", [bytes.fromhex("CBF60B0D0376010ADD7FFF")], workers=2)
+    assert decoded.decoded[0]["humidity"] == 88.6
+
+    try:
+        decode_bulk("elsys", payloads, [5])
+        assert False
+    except ValueError:
+        pass
+
+
+if __name__ == "__main__":
+    test_pack()
+    test_decode_bulk()
@@ -0,0 +1,284 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+#
+# Generation of specialised decoders from a declarative payload layout.
+#
+# A decoder describes its messages as layouts of fields, e.g.
+#
+#   LAYOUT = TaggedLayout(tag_offset=0, messages={
+#       0x0A: [const("msg_type", "SendBatteryVoltage"), fixed_point("voltage", 2, 2)]
+#   })
+#   compiled_dict_from_bytes = compile_decoder("sentrius_rs1xx", LAYOUT)
+#
+# compile_decoder() generates the source of a module with one straight-line function per layout: every
+# field is a single expression on the payload bytes, without calls of helper functions, loops over
+# field descriptions or lookups of field types. The source is compiled in memory when the decoder
+# module is imported, once per process; nothing is written to the file system, which is read-only in
+# AWS Lambda. The source is registered with linecache, so tracebacks show the generated lines.
+#
+# No generated artifact is cached in the AWS Lambda layer: generating and compiling costs a few
+# milliseconds on every cold start (about 3 ms for elsys), but the decoder can never be out of date
+# with its layout and `sam build` needs no extra step.
+#
+# The hand-written decoder stays the reference. Tests check the equivalence of both with
+# assert_equivalent().
+#
+
+import linecache
+import random
+from collections import namedtuple
+
+# kind: "const", "uint", "sint", "fixed_point", "lookup" or "expression"
+LayoutField = namedtuple("LayoutField", ["name", "kind", "offset", "size", "divisor", "value", "accumulate"])
+
+# Message selected by the byte at tag_offset, e.g. the message type of sentrius_rs1xx
+TaggedLayout = namedtuple("TaggedLayout", ["tag_offset", "messages", "unknown_tag_message", "none_if_empty"],
+                          defaults=("Message type {} not implemented", False))
+
+# Sequence of type-length-value elements, e.g. elsys. length includes the type byte.
+TlvType = namedtuple("TlvType", ["code", "length", "fields"])
+TlvLayout = namedtuple("TlvLayout", ["types", "terminators", "unknown_type_message"],
+                       defaults=((), "Data field type {} not known."))
+
+
+def const(name: str, value) -> LayoutField:
+    return LayoutField(name, "const", None, None, None, value, False)
+
+
+def uint(name: str, offset: int, size: int = 1, divisor=None) -> LayoutField:
+    """ Unsigned big-endian integer of size bytes """
+    return LayoutField(name, "uint", offset, size, divisor, None, False)
+
+
+def sint(name: str, offset: int, size: int = 1, divisor=None, accumulate: bool = False) -> LayoutField:
+    """ Signed (two's complement) big-endian integer of 1 or 2 bytes
+
+        With accumulate, a repeated field becomes a list of its values.
+    """
+    if size not in (1, 2):
+        raise ValueError(f"Field {name}: signed integers must have 1 or 2 bytes")
+    return LayoutField(name, "sint", offset, size, divisor, None, accumulate)
+
+
+def fixed_point(name: str, offset: int, size: int) -> LayoutField:
+    """ Signed fractional part (1/100) followed by the signed integer part, as helpers.bytes_to_float """
+    if size not in (2, 4):
+        raise ValueError(f"Field {name}: fixed point values must have 2 or 4 bytes")
+    return LayoutField(name, "fixed_point", offset, size, None, None, False)
+
+
+def lookup(name: str, offset: int, table) -> LayoutField:
+    """ Entry of a 256-entry table for the byte at offset, e.g. status_tables.StatusTable.entries """
+    table = tuple(table)
+    if len(table) != 256:
+        raise ValueError(f"Field {name}: lookup tables must have 256 entries")
+    return LayoutField(name, "lookup", offset, 1, None, table, False)
+
+
+def expression(name: str, template: str) -> LayoutField:
+    """ Python expression with placeholders {b0}, {b1}, ... for the bytes at offset 0, 1, ... """
+    return LayoutField(name, "expression", 0, None, None, template, False)
+
+
+class _Generator:
+
+    def __init__(self):
+        self.tables = {}
+
+    def table(self, table: tuple) -> str:
+        if table not in self.tables:
+            self.tables[table] = f"_TABLE_{len(self.tables)}"
+        return self.tables[table]
+
+    @staticmethod
+    def byte(base: str, offset: int) -> str:
+        return f"decoded[{base}{offset}]" if base else f"decoded[{offset}]"
+
+    def uint(self, base: str, offset: int, size: int) -> str:
+        parts = [self.byte(base, offset + k) + (f" << {8 * (size - 1 - k)}" if k < size - 1 else "") for k in range(size)]
+        return parts[0] if size == 1 else "(" + " | ".join(parts) + ")"
+
+    def sint(self, base: str, offset: int, size: int) -> str:
+        sign = 0x80 if size == 1 else 0x8000
+        return f"(({self.uint(base, offset, size)} ^ {hex(sign)}) - {hex(sign)})"
+
+    def value(self, field: LayoutField, base: str) -> str:
+        if field.kind == "const":
+            return repr(field.value)
+        if field.kind == "uint":
+            value = self.uint(base, field.offset, field.size)
+        elif field.kind == "sint":
+            value = self.sint(base, field.offset, field.size)
+        elif field.kind == "fixed_point":
+            half = field.size // 2
+            value = f"{self.sint(base, field.offset + half, half)} + ({self.sint(base, field.offset, half)} / 100)"
+        elif field.kind == "lookup":
+            value = f"{self.table(field.value)}[{self.byte(base, field.offset)}]"
+        else:
+            value = field.value.format(**{f"b{k}": self.byte(base, k) for k in range(256)})
+        if field.divisor is not None:
+            value = f"{value} / {field.divisor}"
+        return value
+
+    def tagged(self, layout: TaggedLayout) -> list:
+        lines = ["def dict_from_bytes(decoded, fport=None):"]
+        if layout.none_if_empty:
+            lines += ["    if not len(decoded):", "        return None"]
+        lines.append(f"    tag = decoded[{layout.tag_offset}]")
+        for position, (tag, fields) in enumerate(layout.messages.items()):
+            lines.append(f"    {'if' if position == 0 else 'elif'} tag == {hex(tag)}:")
+            lines.append("        return {")
+            lines += [f"            {field.name!r}: {self.value(field, '')}," for field in fields]
+            lines.append("        }")
+        lines.append(f"    raise Exception({layout.unknown_tag_message!r}.format(tag))")
+        return lines
+
+    def tlv(self, layout: TlvLayout) -> list:
+        lines = ["def dict_from_bytes(decoded, fport=None):",
+                 "    result = {}",
+                 "    i = 0",
+                 "    length = len(decoded)",
+                 "    while i < length:",
+                 "        tag = decoded[i]"]
+        for position, tlv_type in enumerate(layout.types):
+            lines.append(f"        {'if' if position == 0 else 'elif'} tag == {hex(tlv_type.code)}:")
+            for field in tlv_type.fields:
+                if field.accumulate:
+                    lines += [f"            value = {self.value(field, 'i + ')}",
+                              f"            previous = result.get({field.name!r})",
+                              "            if previous is None:",
+                              f"                result[{field.name!r}] = value",
+                              "            elif type(previous) is list:",
+                              "                previous.append(value)",
+                              "            else:",
+                              f"                result[{field.name!r}] = [previous, value]"]
+                else:
+                    lines.append(f"            result[{field.name!r}] = {self.value(field, 'i + ')}")
+            lines.append(f"            i += {tlv_type.length}")
+        if layout.terminators:
+            lines += [f"        elif tag in {tuple(layout.terminators)!r}:", "            break"]
+        lines += ["        else:",
+                  f"            raise Exception({layout.unknown_type_message!r}.format(hex(tag)))",
+                  "    return result"]
+        return lines
+
+
+def generate_source(decoder_name: str, layout) -> str:
+    """ Returns the source of a module with the function dict_from_bytes(decoded, fport=None) for a layout """
+    generator = _Generator()
+    if isinstance(layout, TaggedLayout):
+        function_lines = generator.tagged(layout)
+    elif isinstance(layout, TlvLayout):
+        function_lines = generator.tlv(layout)
+    else:
+        raise TypeError(f"Unknown layout {type(layout).__name__}")
+
+    lines = [f"# Generated by decoder_codegen.py from the layout of {decoder_name}.", ""]
+    lines += [f"{name} = {table!r}" for table, name in generator.tables.items()]
+    return "\n".join(lines + ["", ""] + function_lines) + "\n"
+
+
+def compile_decoder(decoder_name: str, layout):
+    """ Returns the generated function dict_from_bytes(decoded, fport=None) for a layout
+
+        Parameters
+        ----------
+        decoder_name : str
+            Name of the hand-written decoder, used in the file name of tracebacks
+        layout : TaggedLayout or TlvLayout
+            Layout of the payload
+    """
+    source = generate_source(decoder_name, layout)
+    filename = f"<generated {decoder_name}>"
+    linecache.cache[filename] = (len(source), None, source.splitlines(True), filename)
+    namespace = {}
+    exec(compile(source, filename, "exec"), namespace)
+    return namespace["dict_from_bytes"]
+
+
+def _outcome(function, payload: bytes, fport):
+    try:
+        return "result", function(payload, fport)
+    except Exception:
+        return "exception", None
+
+
+def assert_equivalent(reference, compiled, payloads: list, fport=None, mutations: int = 2000, seed: int = 0) -> None:
+    """ Asserts that both functions return equal results or both raise an exception for the payloads, for
+        mutations of the payloads and for random payloads """
+    rng = random.Random(seed)
+    candidates = list(payloads)
+    for _ in range(mutations):
+        if payloads and rng.random() < 0.7:
+            mutated = bytearray(rng.choice(payloads))
+            for _ in range(rng.randint(1, 3)):
+                if mutated:
+                    mutated[rng.randrange(len(mutated))] = rng.randrange(256)
+            if mutated and rng.random() < 0.2:
+                del mutated[rng.randrange(len(mutated)):]
+            candidates.append(bytes(mutated))
+        else:
+            candidates.append(bytes(rng.randrange(256) for _ in range(rng.randint(0, 24))))
+
+    for payload in candidates:
+        for data in (payload, memoryview(payload)):
+            expected = _outcome(reference, data, fport)
+            actual = _outcome(compiled, data, fport)
+            assert expected == actual, f"{payload.hex()}: expected {expected}, got {actual}"
+
+
+def test_tagged_layout():
+    import traceback
+    layout = TaggedLayout(tag_offset=0, none_if_empty=True, messages={
+        0x01: [const("type", "a"), uint("counter", 1, 2), sint("temperature", 3, 2, divisor=10)],
+        0x02: [const("type", "b"), fixed_point("voltage", 1, 2), lookup("state", 3, ["on" if v & 1 else "off" for v in range(256)])]
+    })
+    dict_from_bytes = compile_decoder("test_tagged", layout)
+    assert dict_from_bytes(bytes.fromhex("010102FF38"), None) == {"type": "a", "counter": 258, "temperature": -20.0}
+    assert dict_from_bytes(memoryview(bytes.fromhex("021E0101")), None) == {"type": "b", "voltage": 1.3, "state": "on"}
+    assert dict_from_bytes(b"", None) is None
+    try:
+        dict_from_bytes(b"\x03", None)
+        assert False
+    except Exception as e:
+        assert str(e) == "Message type 3 not implemented"
+        assert "raise Exception('Message type {} not implemented'.format(tag))" in "".join(traceback.format_exception(type(e), e, e.__traceback__))
+
+
+def test_tlv_layout():
+    layout = TlvLayout(types=[
+        TlvType(0x01, 3, [sint("temperature", 1, 2, divisor=10, accumulate=True)]),
+        TlvType(0x02, 2, [uint("humidity", 1)]),
+        TlvType(0x09, 4, [expression("sum", "{b1} + {b2} + {b3}")])
+    ], terminators=(0x3E,))
+    namespace = {}
+    exec(generate_source("test_tlv", layout), namespace)
+    dict_from_bytes = namespace["dict_from_bytes"]
+    assert dict_from_bytes(bytes.fromhex("0100FA022A"), None) == {"temperature": 25.0, "humidity": 42}
+    assert dict_from_bytes(bytes.fromhex("0100FA01FF060100013E01"), None) == {"temperature": [25.0, -25.0, 0.1]}
+    assert dict_from_bytes(bytes.fromhex("09010203"), None) == {"sum": 6}
+    for payload in ["0100", "07"]:
+        try:
+            dict_from_bytes(bytes.fromhex(payload), None)
+            assert False
+        except Exception:
+            pass
+
+
+if __name__ == "__main__":
+    test_tagged_layout()
+    test_tlv_layout()
@@ -0,0 +1,230 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+#
+# Registry of the output schemas of the binary decoders.
+#
+# Each decoder declares the fields of its output once, e.g.
+#
+#   OUTPUT_SCHEMA = register("dragino_lht65", OutputSchema([
+#       Field("battery_value", NUMBER, unit="V"),
+#       Field("humidity", NUMBER, unit="%")
+#   ]))
+#
+# Fields which depend on the FPort or on the message type are declared as variants. Consumers of
+# decoded payloads (e.g. writers to Amazon Timestream) can prepare their record layout per variant
+# from fields_for() instead of inspecting the type of every value. validate() checks that an output
+# conforms to the schema and is used by the tests of the decoders.
+#
+
+import importlib
+
+NUMBER = "number"
+INTEGER = "integer"
+STRING = "string"
+BOOLEAN = "boolean"
+OBJECT = "object"
+ARRAY = "array"
+
+_TYPE_CHECKS = {
+    NUMBER: lambda value: isinstance(value, (int, float)) and not isinstance(value, bool),
+    INTEGER: lambda value: isinstance(value, int) and not isinstance(value, bool),
+    STRING: lambda value: isinstance(value, str),
+    BOOLEAN: lambda value: isinstance(value, bool),
+    OBJECT: lambda value: isinstance(value, dict),
+    ARRAY: lambda value: isinstance(value, list)
+}
+
+
+class Field:
+    """ Field of a decoder output
+
+        Parameters
+        ----------
+        name : str
+            Key in the decoder output
+        type : str or tuple of str
+            NUMBER, INTEGER, STRING, BOOLEAN, OBJECT or ARRAY, or a tuple of them if the type varies
+        unit : str
+            Unit of the value, optional
+        required : bool
+            False if the field is only present in some outputs
+        fields : list
+            Fields of an OBJECT. Without fields, the keys of the object are not validated.
+    """
+    __slots__ = ("name", "types", "unit", "required", "fields")
+
+    def __init__(self, name: str, type, unit: str = None, required: bool = True, fields: list = None):
+        types = type if isinstance(type, tuple) else (type,)
+        for t in types:
+            if t not in _TYPE_CHECKS:
+                raise ValueError(f"Field {name} has unknown type {t}")
+        self.name = name
+        self.types = types
+        self.unit = unit
+        self.required = required
+        self.fields = {field.name: field for field in fields} if fields is not None else None
+
+    @property
+    def type(self):
+        return self.types[0] if len(self.types) == 1 else self.types
+
+    def __repr__(self):
+        return f"Field({self.name!r}, {self.type!r})"
+
+
+class OutputSchema:
+    """ Output schema of a decoder
+
+        Parameters
+        ----------
+        fields : list
+            Fields of all outputs
+        fport_variants : dict
+            FPort -> list of additional fields of outputs for this FPort
+        variant_field : str
+            Name of a field which identifies the message type, e.g. "mode"
+        variants : dict
+            Value of variant_field -> list of additional fields of outputs with this value
+    """
+
+    def __init__(self, fields: list, fport_variants: dict = None, variant_field: str = None, variants: dict = None):
+        self.fields = tuple(fields)
+        self.fport_variants = {fport: tuple(variant) for fport, variant in (fport_variants or {}).items()}
+        self.variant_field = variant_field
+        self.variants = {value: tuple(variant) for value, variant in (variants or {}).items()}
+        self._compiled = {}
+
+    def fields_for(self, fport: int = None, variant=None) -> dict:
+        """ Returns the fields (name -> Field) of outputs for an FPort and a value of variant_field """
+        key = (fport if fport in self.fport_variants else None, variant if variant in self.variants else None)
+        fields = self._compiled.get(key)
+        if fields is None:
+            fields = {field.name: field for field in
+                      self.fields + self.fport_variants.get(key[0], ()) + self.variants.get(key[1], ())}
+            self._compiled[key] = fields
+        return fields
+
+    def fields_of(self, result: dict, fport: int = None) -> dict:
+        """ Returns the fields (name -> Field) of a decoder output """
+        variant = result.get(self.variant_field) if self.variant_field is not None else None
+        return self.fields_for(fport, variant)
+
+
+def optional(fields: list) -> list:
+    """ Returns copies of fields which are not required, e.g. for fields which are only present in some outputs """
+    return [Field(field.name, field.type, field.unit, False, field.fields and list(field.fields.values())) for field in fields]
+
+
+_registry = {}
+
+
+def register(decoder_name: str, schema: OutputSchema) -> OutputSchema:
+    """ Registers the output schema of a decoder and returns it """
+    _registry[decoder_name] = schema
+    return schema
+
+
+def schema_of(decoder_name: str) -> OutputSchema:
+    """ Returns the output schema of a decoder, importing the decoder if necessary, or None """
+    if decoder_name not in _registry:
+        try:
+            importlib.import_module(decoder_name)
+        except ImportError:
+            return None
+    return _registry.get(decoder_name)
+
+
+def _validate_fields(fields: dict, value: dict, path: str, errors: list) -> None:
+    for name, field in fields.items():
+        if name not in value:
+            if field.required:
+                errors.append(f"{path}{name}: missing")
+            continue
+        if not any(_TYPE_CHECKS[t](value[name]) for t in field.types):
+            errors.append(f"{path}{name}: expected {field.type}, got {type(value[name]).__name__}")
+        elif field.fields is not None and isinstance(value[name], dict):
+            _validate_fields(field.fields, value[name], f"{path}{name}.", errors)
+    for name in value:
+        if name not in fields:
+            errors.append(f"{path}{name}: not declared")
+
+
+def validate(schema: OutputSchema, result: dict, fport: int = None) -> list:
+    """ Validates a decoder output against a schema
+
+        Returns
+        -------
+        List of violations, empty if the output conforms to the schema
+    """
+    if not isinstance(result, dict):
+        return [f"expected an object, got {type(result).__name__}"]
+    errors = []
+    _validate_fields(schema.fields_of(result, fport), result, "", errors)
+    return errors
+
+
+# Names of the decoders in this layer. The transformation function accepts these names as PayloadDecoderName
+# and imports the module of each name, the test below validates the outputs of each against its schema.
+DECODER_NAMES = ["sample_device", "axioma_w1", "tabs_objectlocator", "tabs_temphumsensor",
+                 "dragino_lht65", "dragino_lgt92", "dragino_lse01", "dragino_lbt1", "dragino_lds01", "dragino_laq4",
+                 "dragino_lsn50", "dragino_llms01",
+                 "elsys", "globalsat_lt100", "nas_um3080", "adeunis_ftd2", "adeunis_dc_v2",
+                 "sentrius_rs1xx", "meteo_helix", "st_nucleo_wl55jc"]
+
+
+def test_validate():
+    schema = OutputSchema([Field("battery", NUMBER, unit="V"), Field("extTemp2", (NUMBER, ARRAY), required=False)],
+                          fport_variants={2: [Field("status", OBJECT, fields=[Field("lowBattery", BOOLEAN)])]},
+                          variant_field="mode", variants={1: [Field("uuid", STRING)]})
+    assert validate(schema, {"battery": 3}) == []
+    assert validate(schema, {"battery": 3.1, "extTemp2": [1.5, 2.5]}) == []
+    assert validate(schema, {"battery": True}) == ["battery: expected number, got bool"]
+    assert validate(schema, {"battery": 3, "status": {"lowBattery": True}}, fport=2) == []
+    assert validate(schema, {"battery": 3, "status": {"lowBattery": 1}}, fport=2) == ["status.lowBattery: expected boolean, got int"]
+    assert validate(schema, {"battery": 3, "mode": 1, "uuid": "a"}) == ["mode: not declared"]
+    assert validate(schema, {"battery": 3}, fport=2) == ["status: missing"]
+    assert schema.fields_for(2) is schema.fields_for(2)
+
+
+def test_decoder_outputs_conform_to_schemas():
+    import random
+    import decoder_schemas  # The registry of the decoders, also if this file runs as __main__
+    rng = random.Random(42)
+    fports = [None, 1, 2, 3, 5, 10, 20, 24, 25, 99, 100, 136]
+    for decoder_name in DECODER_NAMES:
+        schema = decoder_schemas.schema_of(decoder_name)
+        assert schema is not None, decoder_name
+        decoder = importlib.import_module(decoder_name)
+        decoded_count = 0
+        for _ in range(3000):
+            payload = bytes(rng.randrange(256) for _ in range(rng.randrange(1, 60)))
+            fport = rng.choice(fports)
+            try:
+                result = decoder.dict_from_bytes(payload, fport)
+            except Exception:
+                continue
+            if result is None:  # dragino_lds01 has no output for unknown modes
+                continue
+            decoded_count += 1
+            errors = validate(schema, result, fport)
+            assert errors == [], f"{decoder_name} {payload.hex()} {fport}: {errors}"
+        assert decoded_count > 0, decoder_name
+
+
+if __name__ == "__main__":
+    test_validate()
+    test_decoder_outputs_conform_to_schemas()
@@ -16,6 +16,24 @@
 
 
 import base64
+from decoder_schemas import INTEGER, NUMBER, STRING, Field, OutputSchema, register
+
+OUTPUT_SCHEMA = register("dragino_laq4", OutputSchema([
+    Field("battery_value", NUMBER, unit="V"),
+    Field("work_mode", STRING)
+], variant_field="work_mode", variants={
+    "CO2": [Field("alarm_status", STRING),
+            Field("TVOC_ppb", INTEGER, unit="ppb"),
+            Field("CO2_ppm", INTEGER, unit="ppm"),
+            Field("temperature", NUMBER, unit="°C"),
+            Field("humidity", NUMBER, unit="%")],
+    "ALARM": [Field("temperature_min", INTEGER, unit="°C"),
+              Field("temperature_max", INTEGER, unit="°C"),
+              Field("humidity_min", INTEGER, unit="%"),
+              Field("humidity_max", INTEGER, unit="%"),
+              Field("CO2_min", INTEGER, unit="ppm"),
+              Field("CO2_max", INTEGER, unit="ppm")]
+}))
 
 
 def dict_from_payload(base64_input: str, fport: int = None):
@@ -34,8 +52,11 @@ def dict_from_payload(base64_input: str, fport: int = None):
             JSON object with key/value pairs of decoded attributes
 
         """
+    return dict_from_bytes(base64.b64decode(base64_input), fport)
+
 
-    decoded = base64.b64decode(base64_input)
+def dict_from_bytes(decoded: bytes, fport: int = None):
+    """ Decodes a Dragino LAQ4 uplink with battery, alarm, TVOC, CO2, temperature and humidity """
 
     # Battery voltage
     battery_value = ((decoded[0] << 8 | decoded[1]) & 0x3FFF) / 1000
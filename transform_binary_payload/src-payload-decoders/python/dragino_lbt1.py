@@ -18,29 +18,27 @@
 import base64
 import json
 import logging
+from decoder_schemas import INTEGER, NUMBER, STRING, Field, OutputSchema, register
+
+OUTPUT_SCHEMA = register("dragino_lbt1", OutputSchema([
+    Field("battery_value", NUMBER, unit="V"),
+    Field("step_count", INTEGER),
+    Field("mode", INTEGER)
+], variant_field="mode", variants={
+    1: [Field("uuid", STRING)],
+    2: [Field("uuid", STRING), Field("addr", STRING)],
+    3: [Field("uuid", STRING),
+        Field("major", INTEGER),
+        Field("minor", INTEGER),
+        Field("power", INTEGER, unit="dBm"),
+        Field("rssi", INTEGER, unit="dBm")]
+}))
 
 # Setup logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
-def convert_bytes_to_uint(input):
-    print(f"c input is {input} of len {len(input)}")
-    result = 0
-    for i in range(0, len(input)):
-        factor = (i+1) ** 8
-        print(
-            f"input[{i}] is {input[i]}, 0x{hex(input[i])}, factor is {factor}")
-        result += input[i]*factor
-    return result
-
-
-def to_ascii(input):
-    bytes_object = bytes.fromhex(input)
-    ascii_string = bytes_object.decode("ASCII")
-    return ascii_string
-
-
 def dict_from_payload(base64_input: str, fport: int = None):
     """ Decodes a base64-encoded binary payload into JSON.
             Parameters 
@@ -57,55 +55,36 @@ def dict_from_payload(base64_input: str, fport: int = None):
             JSON object with key/value pairs of decoded attributes
 
         """
-    decoded = base64.b64decode(base64_input)
-    logger.debug(f"Input hex is {decoded.hex()}")
+    return dict_from_bytes(base64.b64decode(base64_input), fport)
 
-    battery_value = (decoded[0] << 8 | decoded[1]) / 1000
-    step_count = ((decoded[2] & 0x0F) << 16) | (decoded[3] << 8) | (decoded[4])
-    mode = decoded[5]
 
-    uuid = 0
+def dict_from_bytes(decoded: bytes, fport: int = None):
+    """ Decodes a Dragino LBT1 uplink with battery, step count and the beacon fields of its mode """
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Input hex is {decoded.hex()}")
+
+    result = {
+        "battery_value": (decoded[0] << 8 | decoded[1]) / 1000,
+        "step_count": ((decoded[2] & 0x0F) << 16) | (decoded[3] << 8) | (decoded[4]),
+        "mode": decoded[5]
+    }
+
+    # The beacon fields are sent as ASCII characters. The region is copied once from the payload, numbers
+    # are sent as hexadecimal digits and parsed by int() directly from the bytes.
+    mode = decoded[5]
     if mode == 3:
-        uuid = decoded[6:18]
-        major = decoded[18:22]
-        minor = decoded[22:26]
-        power = decoded[26:28]
-        rssi = decoded[28:32]
-
-        result = {
-            "battery_value": battery_value,
-            "step_count": step_count,
-            "mode": mode,
-            "uuid": uuid.decode(),
-            "major": int(to_ascii(major.hex()), 16),
-            "minor": int(to_ascii(minor.hex()), 16),
-            "power": int(to_ascii(power.hex()), 16)-256,
-            "rssi": int(to_ascii(rssi.hex()), 16)
-        }
+        beacon = bytes(decoded[6:32])
+        result["uuid"] = beacon[0:12].decode()
+        result["major"] = int(beacon[12:16], 16)
+        result["minor"] = int(beacon[16:20], 16)
+        result["power"] = int(beacon[20:22], 16) - 256
+        result["rssi"] = int(beacon[22:26], 16)
     elif mode == 2:
-        uuid = decoded[6:6+32]
-        addr = decoded[38:39+12]
-        result = {
-            "battery_value": battery_value,
-            "step_count": step_count,
-            "mode": mode,
-            "uuid": uuid.decode(),
-            "addr": addr.decode()
-        }
+        beacon = bytes(decoded[6:51])
+        result["uuid"] = beacon[0:32].decode()
+        result["addr"] = beacon[32:45].decode()
     elif mode == 1:
-        uuid = decoded[6:11]
-        result = {
-            "battery_value": battery_value,
-            "step_count": step_count,
-            "mode": mode,
-            "uuid": uuid.decode(),
-        }
-    else:
-        result = {
-            "battery_value": battery_value,
-            "step_count": step_count,
-            "mode": mode,
-        }
+        result["uuid"] = bytes(decoded[6:11]).decode()
 
     return result
 
@@ -148,6 +127,10 @@ def test_uplink_decoding():
         for key in testcase.get("output"):
             assert testcase.get("output").get(key) == output.get(key)
 
+        # Same result for a payload in a larger buffer
+        decoded = base64.b64decode(base64_input)
+        assert dict_from_bytes(memoryview(b"\x00" + decoded + b"\x00")[1:-1]) == output
+
 
 if __name__ == "__main__":
     test_uplink_decoding()
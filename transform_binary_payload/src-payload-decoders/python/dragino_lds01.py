@@ -16,6 +16,18 @@
 
 
 import base64
+from decoder_schemas import INTEGER, Field, OutputSchema, register
+
+OUTPUT_SCHEMA = register("dragino_lds01", OutputSchema([
+    Field("mod", INTEGER),
+    Field("battery", INTEGER, unit="mV")
+], variant_field="mod", variants={
+    1: [Field("door_open_status", INTEGER),
+        Field("open_times", INTEGER),
+        Field("open_duration", INTEGER, unit="min")],
+    2: [Field("leak_times", INTEGER),
+        Field("leak_duration", INTEGER, unit="min")]
+}))
 
 
 def dict_from_payload(base64_input: str, fport: int = None):
@@ -34,23 +46,26 @@ def dict_from_payload(base64_input: str, fport: int = None):
             JSON object with key/value pairs of decoded attributes
 
         """
+    return dict_from_bytes(base64.b64decode(base64_input), fport)
+
 
-    bytes = base64.b64decode(base64_input)
-    battery = (bytes[0] << 8 | bytes[1]) & 0x3FFF
+def dict_from_bytes(decoded: bytes, fport: int = None):
+    """ Decodes a Dragino LDS01 uplink with the door open or water leak counters of its mode """
+    battery = (decoded[0] << 8 | decoded[1]) & 0x3FFF
     door_open_status = 0
 
-    if bytes[0] & 0x40:
+    if decoded[0] & 0x40:
         water_leak_status = 1
 
     water_leak_status = 0
-    if bytes[0] & 0x80:
+    if decoded[0] & 0x80:
         door_open_status = 1
 
-    mod = bytes[2]
+    mod = decoded[2]
 
     if mod == 1:
-        open_times = bytes[3] << 16 | bytes[4] << 8 | bytes[5]
-        open_duration = bytes[6] << 16 | bytes[7] << 8 | bytes[8]
+        open_times = decoded[3] << 16 | decoded[4] << 8 | decoded[5]
+        open_duration = decoded[6] << 16 | decoded[7] << 8 | decoded[8]
         result = {
             "mod": mod,
             "battery": battery,
@@ -62,8 +77,8 @@ def dict_from_payload(base64_input: str, fport: int = None):
         return result
 
     if mod == 2:
-        leak_times = bytes[3] << 16 | bytes[4] << 8 | bytes[5]
-        leak_duration = bytes[6] << 16 | bytes[7] << 8 | bytes[8]
+        leak_times = decoded[3] << 16 | decoded[4] << 8 | decoded[5]
+        leak_duration = decoded[6] << 16 | decoded[7] << 8 | decoded[8]
 
         result = {
             "mod": mod,
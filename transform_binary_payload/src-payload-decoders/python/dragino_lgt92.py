@@ -17,6 +17,15 @@
 
 import base64
 import binascii
+from decoder_schemas import BOOLEAN, INTEGER, NUMBER, Field, OutputSchema, register
+
+OUTPUT_SCHEMA = register("dragino_lgt92", OutputSchema([
+    Field("latitude", NUMBER, unit="°"),
+    Field("longitude", NUMBER, unit="°"),
+    Field("alarm", BOOLEAN),
+    Field("battery", NUMBER, unit="V"),
+    Field("firmware", INTEGER)
+]))
 
 
 def dict_from_payload(base64_input: str, fport: int = None):
@@ -35,16 +44,20 @@ def dict_from_payload(base64_input: str, fport: int = None):
             JSON object with key/value pairs of decoded attributes
 
         """
-    bytes = base64.b64decode(base64_input)
+    return dict_from_bytes(base64.b64decode(base64_input), fport)
+
+
+def dict_from_bytes(decoded: bytes, fport: int = None):
+    """ Decodes the position, alarm flag, battery and firmware version of a Dragino LGT92 uplink """
 
-    lat = int.from_bytes(bytes[0:4], byteorder='big', signed=True)/1000000
-    long = int.from_bytes(bytes[4:8], byteorder='big', signed=True)/1000000
+    lat = int.from_bytes(decoded[0:4], byteorder='big', signed=True)/1000000
+    long = int.from_bytes(decoded[4:8], byteorder='big', signed=True)/1000000
 
-    alarm = (bytes[8] & 0x40) > 0
+    alarm = (decoded[8] & 0x40) > 0
 
-    battery = ((bytes[8] & 0x3f) << 8 | bytes[9]) / 1000
+    battery = ((decoded[8] & 0x3f) << 8 | decoded[9]) / 1000
 
-    fw = 150+(bytes[10] & 0x1f)
+    fw = 150+(decoded[10] & 0x1f)
     result = {
         "latitude": lat,
         "longitude": long,
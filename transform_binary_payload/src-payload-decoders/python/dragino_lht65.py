@@ -17,6 +17,22 @@
 
 import base64
 
+from decoder_schemas import NUMBER, STRING, Field, OutputSchema, register
+from status_tables import StatusTable, bits
+
+OUTPUT_SCHEMA = register("dragino_lht65", OutputSchema([
+    Field("battery_status", STRING),
+    Field("battery_value", NUMBER, unit="V"),
+    Field("temperature_internal", NUMBER, unit="°C"),
+    Field("humidity", NUMBER, unit="%"),
+    Field("temperature_external", NUMBER, unit="°C")
+]))
+
+BATTERY_STATUSES = {0b00: "very low", 0b01: "low", 0b10: "OK", 0b11: "Good"}
+
+# Battery status from bit 6-7 of byte 0
+BATTERY_STATUS_TABLE = StatusTable(lambda value: BATTERY_STATUSES[bits(value, 0b11000000, 6)])
+
 
 def dict_from_payload(base64_input: str, fport: int = None):
     """ Decodes a base64-encoded binary payload into JSON.
@@ -34,24 +50,18 @@ def dict_from_payload(base64_input: str, fport: int = None):
             JSON object with key/value pairs of decoded attributes
 
         """
+    return dict_from_bytes(base64.b64decode(base64_input), fport)
+
 
-    decoded = base64.b64decode(base64_input)
+def dict_from_bytes(decoded: bytes, fport: int = None):
+    """ Decodes the battery, the internal sensor and the external sensor of a Dragino LHT65 uplink """
 
     # Batter status flag
     # 00(b): Ultra Low ( BAT <= 2.50v)
     # 01(b): Low (2.50v <=BAT <= 2.55v)
     # 10(b): OK Good (2.55v <= BAT <=2.65v)
     # 11(b): Good (BAT >= 2.65v)
-    battery_status_flag = (decoded[0] & 0b11000000) >> 6
-    battery_status = "unknown"
-    if battery_status_flag == 0b00:
-        battery_status = "very low"
-    elif battery_status_flag == 0b01:
-        battery_status = "low"
-    elif battery_status_flag == 0b10:
-        battery_status = "OK"
-    elif battery_status_flag == 0b11:
-        battery_status = "Good"
+    battery_status = BATTERY_STATUS_TABLE[decoded[0]]
 
     # Battery voltage
     battery_value = ((decoded[0] << 8 | decoded[1]) & 0x3FFF) / 1000
@@ -16,6 +16,13 @@
 
 
 import base64
+from decoder_schemas import NUMBER, Field, OutputSchema, register
+
+OUTPUT_SCHEMA = register("dragino_llms01", OutputSchema([
+    Field("battery_value", NUMBER, unit="V"),
+    Field("leaf_moisture", NUMBER, unit="%"),
+    Field("leaf_temp", NUMBER, unit="°C")
+]))
 
 
 def dict_from_payload(base64_input: str, fport: int = None):
@@ -34,11 +41,13 @@ def dict_from_payload(base64_input: str, fport: int = None):
             JSON object with key/value pairs of decoded attributes
 
         """
+    return dict_from_bytes(base64.b64decode(base64_input), fport)
 
 
+def dict_from_bytes(decoded: bytes, fport: int = None):
+    """ Decodes the battery, leaf moisture and leaf temperature of a Dragino LLMS01 uplink """
     # Used the Dragino LSN50 Decoder as reference
     # https://www.dragino.com/downloads/downloads/LoRa_End_Node/LSN50v2-D20/Decoder/LSN50v2-D20-Decoder.txt
-    decoded = base64.b64decode(base64_input)
 
     print(decoded)
 
@@ -16,6 +16,15 @@
 
 
 import base64
+from decoder_schemas import NUMBER, Field, OutputSchema, register
+
+OUTPUT_SCHEMA = register("dragino_lse01", OutputSchema([
+    Field("battery_value", NUMBER, unit="V"),
+    Field("temperature_internal", NUMBER, unit="°C"),
+    Field("water_soil", NUMBER, unit="%"),
+    Field("temperature_soil", NUMBER, unit="°C"),
+    Field("conduct_soil", NUMBER, unit="uS/cm")
+]))
 
 
 def dict_from_payload(base64_input: str, fport: int = None):
@@ -34,8 +43,11 @@ def dict_from_payload(base64_input: str, fport: int = None):
             JSON object with key/value pairs of decoded attributes
 
         """
+    return dict_from_bytes(base64.b64decode(base64_input), fport)
+
 
-    decoded = base64.b64decode(base64_input)
+def dict_from_bytes(decoded: bytes, fport: int = None):
+    """ Decodes the battery and the soil moisture, temperature and conductivity of a Dragino LSE01 uplink """
 
     value = (decoded[0] << 8 | decoded[1]) & 0x3FFF
     battery_value = value  # /Battery,units:V
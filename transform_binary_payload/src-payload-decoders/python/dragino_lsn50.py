@@ -16,6 +16,16 @@
 
 
 import base64
+from decoder_schemas import NUMBER, STRING, Field, OutputSchema, register
+
+OUTPUT_SCHEMA = register("dragino_lsn50", OutputSchema([
+    Field("battery_value", NUMBER, unit="V"),
+    Field("temperature1", NUMBER, unit="°C"),
+    Field("adc", NUMBER, unit="V"),
+    Field("istatus", STRING),
+    Field("temperature2", NUMBER, unit="°C"),
+    Field("temperature3", NUMBER, unit="°C")
+]))
 
 
 def dict_from_payload(base64_input: str, fport: int = None):
@@ -34,10 +44,13 @@ def dict_from_payload(base64_input: str, fport: int = None):
             JSON object with key/value pairs of decoded attributes
 
         """
+    return dict_from_bytes(base64.b64decode(base64_input), fport)
+
 
+def dict_from_bytes(decoded: bytes, fport: int = None):
+    """ Decodes the battery, ADC, interrupt status and temperatures of a Dragino LSN50 uplink """
     # Used the Dragino JS Decoder as reference
     # https://www.dragino.com/downloads/downloads/LoRa_End_Node/LLMS01/Decoder/LLMS01_Datacake_Decode_V1.0.0.js
-    decoded = base64.b64decode(base64_input)
 
     battery_value = (((decoded[0] << 8) + decoded[1]) / 1000) # /Battery,units:V
     temperature1 = (((decoded[2] << 8) + decoded[3]) / 10)
@@ -23,6 +23,46 @@
 import base64
 import json
 import helpers
+from decoder_codegen import TlvLayout, TlvType, assert_equivalent, compile_decoder, expression, sint, uint
+from decoder_schemas import ARRAY, INTEGER, NUMBER, Field, OutputSchema, register
+
+# Every data field is optional, an uplink contains the fields for its TLV elements
+OUTPUT_SCHEMA = register("elsys", OutputSchema([Field(name, type, unit=unit, required=False) for name, type, unit in [
+    ("temperature", NUMBER, "°C"),
+    ("humidity", INTEGER, "%"),
+    ("accX", INTEGER, None),
+    ("accY", INTEGER, None),
+    ("accZ", INTEGER, None),
+    ("light", INTEGER, "lx"),
+    ("motion", INTEGER, None),
+    ("co2", INTEGER, "ppm"),
+    ("vdd", INTEGER, "mV"),
+    ("analog1", INTEGER, "mV"),
+    ("gpsLat", NUMBER, "°"),
+    ("gpsLong", NUMBER, "°"),
+    ("pulse1", INTEGER, None),
+    ("pulse1Abs", INTEGER, None),
+    ("extTemp1", NUMBER, "°C"),
+    ("extDigital", INTEGER, None),
+    ("extDistance", INTEGER, "mm"),
+    ("accMotion", INTEGER, None),
+    ("irTempInt", NUMBER, "°C"),
+    ("irTempExt", NUMBER, "°C"),
+    ("occupancy", INTEGER, None),
+    ("waterleak", INTEGER, None),
+    ("grideye", ARRAY, "°C"),
+    ("pressure", NUMBER, "hPa"),
+    ("soundPeak", INTEGER, "dB"),
+    ("soundAvg", INTEGER, "dB"),
+    ("pulse2", INTEGER, None),
+    ("pulse2Abs", INTEGER, None),
+    ("analog2", INTEGER, "mV"),
+    # A list if the uplink contains several external temperatures
+    ("extTemp2", (NUMBER, ARRAY), "°C"),
+    ("extDigital2", INTEGER, None),
+    ("extAnalogUv", INTEGER, "uV"),
+    ("debug", INTEGER, None)
+]]))
 
 DEBUG_OUTPUT = False
 
@@ -92,7 +132,11 @@ TYPE_RFU = 0x3F
 
 
 def dict_from_payload(base64_input: str, fport: int = None):
-    decoded = base64.b64decode(base64_input)
+    return dict_from_bytes(base64.b64decode(base64_input), fport)
+
+
+def dict_from_bytes(decoded: bytes, fport: int = None):
+    """ Decodes the type-value pairs of an Elsys sensor uplink, fields which are not sent are omitted """
 
     if DEBUG_OUTPUT:
         print(f"Input: {decoded.hex().upper()}")
@@ -175,14 +219,10 @@ def dict_from_payload(base64_input: str, fport: int = None):
         elif decoded[i] == TYPE_WATERLEAK:  # Ext water leak
             result['waterleak'] = (decoded[i + 1])
             i += 2
-        elif decoded[i] == TYPE_GRIDEYE:  # Grideye data
+        elif decoded[i] == TYPE_GRIDEYE:  # Grideye data: reference temperature and 8x8 pixels in 1/10 °C above it
             ref = decoded[i + 1]
-            i += 1
-            grideye = []
-            for j in range(64):
-                grideye[j] = ref + (decoded[1+i+j] / 10.0)
-            i += 65
-            result['grideye'] = grideye
+            result['grideye'] = [ref + (decoded[i + j] / 10.0) for j in range(2, 66)]
+            i += 66
         elif decoded[i] == TYPE_PRESSURE:  # Pressure
             temp = ((decoded[i + 1] << 24) | (decoded[i + 2] << 16) |
                     (decoded[i + 3] << 8) | (decoded[i + 4]))
@@ -235,28 +275,75 @@ def dict_from_payload(base64_input: str, fport: int = None):
     return result
 
 
+# Layout of the data fields for the generated decoder
+TLV_LAYOUT = TlvLayout(types=[
+    TlvType(TYPE_TEMP, 3, [sint("temperature", 1, 2, divisor=10)]),
+    TlvType(TYPE_RH, 2, [uint("humidity", 1)]),
+    TlvType(TYPE_ACC, 4, [sint("accX", 1), sint("accY", 2), sint("accZ", 3)]),
+    TlvType(TYPE_LIGHT, 3, [uint("light", 1, 2)]),
+    TlvType(TYPE_MOTION, 2, [uint("motion", 1)]),
+    TlvType(TYPE_CO2, 3, [uint("co2", 1, 2)]),
+    TlvType(TYPE_VDD, 3, [uint("vdd", 1, 2)]),
+    TlvType(TYPE_ANALOG1, 3, [uint("analog1", 1, 2)]),
+    TlvType(TYPE_GPS, 7, [expression("gpsLat", "({b1} | {b2} << 8 | {b3} << 16 | (0xFF << 24 if {b3} & 0x80 else 0x00)) / 10000"),
+                          expression("gpsLong", "({b4} | {b5} << 8 | {b6} << 16 | (0xFF << 24 if {b6} & 0x80 else 0x00)) / 10000")]),
+    TlvType(TYPE_PULSE1, 3, [uint("pulse1", 1, 2)]),
+    TlvType(TYPE_PULSE1_ABS, 5, [uint("pulse1Abs", 1, 4)]),
+    TlvType(TYPE_EXT_TEMP1, 3, [sint("extTemp1", 1, 2, divisor=10)]),
+    TlvType(TYPE_EXT_DIGITAL, 2, [uint("extDigital", 1)]),
+    TlvType(TYPE_EXT_DISTANCE, 3, [uint("extDistance", 1, 2)]),
+    TlvType(TYPE_ACC_MOTION, 2, [uint("accMotion", 1)]),
+    TlvType(TYPE_IR_TEMP, 5, [sint("irTempInt", 1, 2, divisor=10), sint("irTempExt", 3, 2, divisor=10)]),
+    TlvType(TYPE_OCCUPANCY, 2, [uint("occupancy", 1)]),
+    TlvType(TYPE_WATERLEAK, 2, [uint("waterleak", 1)]),
+    TlvType(TYPE_GRIDEYE, 66, [expression("grideye",
+                                          "[" + ", ".join(f"{{b1}} + ({{b{j}}} / 10.0)" for j in range(2, 66)) + "]")]),
+    TlvType(TYPE_PRESSURE, 5, [uint("pressure", 1, 4, divisor=1000)]),
+    TlvType(TYPE_SOUND, 3, [uint("soundPeak", 1), uint("soundAvg", 2)]),
+    TlvType(TYPE_PULSE2, 3, [uint("pulse2", 1, 2)]),
+    TlvType(TYPE_PULSE2_ABS, 5, [uint("pulse2Abs", 1, 4)]),
+    TlvType(TYPE_ANALOG2, 3, [uint("analog2", 1, 2)]),
+    TlvType(TYPE_EXT_TEMP2, 3, [sint("extTemp2", 1, 2, divisor=10, accumulate=True)]),
+    TlvType(TYPE_EXT_DIGITAL2, 2, [uint("extDigital2", 1)]),
+    TlvType(TYPE_EXT_ANALOG_UV, 5, [uint("extAnalogUv", 1, 4)]),
+    TlvType(TYPE_DEBUG, 5, [uint("debug", 1, 4)])
+], terminators=(TYPE_SETTINGS,))
+
+# Generated straight-line decoder, equivalent to dict_from_bytes without DEBUG_OUTPUT
+compiled_dict_from_bytes = compile_decoder("elsys", TLV_LAYOUT)
+
+
 # Tests
-if __name__ == "__main__":
-    test_definition = [
-        {
-            "input_encoding": "hex",
-            "input_value": "0100E202290400270506060308070D621900E21900A3",
-            "output": {
-                "temperature": 22.6,
-                "humidity": 41,
-                "light": 39,
-                "motion": 6,
-                "co2": 776,
-                "vdd": 3426,
-                "extTemp2": [
-                    22.6,
-                    16.3
-                ]
-            }
+TEST_DEFINITION = [
+    {
+        "input_encoding": "hex",
+        "input_value": "0100E202290400270506060308070D621900E21900A3",
+        "output": {
+            "temperature": 22.6,
+            "humidity": 41,
+            "light": 39,
+            "motion": 6,
+            "co2": 776,
+            "vdd": 3426,
+            "extTemp2": [
+                22.6,
+                16.3
+            ]
         }
-    ]
+    },
+    {
+        "input_encoding": "hex",
+        "input_value": "1314" + "05" * 63 + "FF" + "0100E2",
+        "output": {
+            "grideye": [20.5] * 63 + [45.5],
+            "temperature": 22.6
+        }
+    }
+]
 
-    for testcase in test_definition:
+
+def test_uplink_decoding():
+    for testcase in TEST_DEFINITION:
         base64_input = None
         if testcase.get("input_encoding") == "base64":
             base64_input = testcase.get("input_value")
@@ -271,3 +358,20 @@ if __name__ == "__main__":
             else:
                 print(
                     f'"{testcase.get("input_value")}": Successfull test for key "{key}", value "{testcase.get("output").get(key)}"')
+
+
+def test_compiled_decoder():
+    payloads = [base64.b64decode(testcase["input_value"]) if testcase["input_encoding"] == "base64"
+                else bytes.fromhex(testcase["input_value"]) for testcase in TEST_DEFINITION]
+    # Sequences of all data field types, including repeated external temperatures and sensor settings
+    payloads += [bytes.fromhex("0100E20229030102FF0400270506060308070D6208001009010203040506"),
+                 bytes.fromhex("0A00010B000000010C80000D010E00100F0110FF3800FA11011202140001886A"),
+                 bytes.fromhex("1550401600021700000003180010190101190102190103"),
+                 bytes.fromhex("1A011B000000FF3D123456783E0102"),
+                 bytes.fromhex("0100E21314" + "05" * 63 + "FF" + "022A")]
+    assert_equivalent(dict_from_bytes, compiled_dict_from_bytes, payloads, mutations=5000)
+
+
+if __name__ == "__main__":
+    test_uplink_decoding()
+    test_compiled_decoder()
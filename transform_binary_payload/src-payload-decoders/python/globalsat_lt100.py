@@ -23,6 +23,17 @@
 import base64
 import json
 import helpers
+from decoder_schemas import INTEGER, NUMBER, STRING, Field, OutputSchema, register
+from status_tables import StatusTable, bits
+
+OUTPUT_SCHEMA = register("globalsat_lt100", OutputSchema([
+    Field("deviceType", INTEGER),
+    Field("gpsFix", STRING),
+    Field("reportType", STRING),
+    Field("batteryCapacity", INTEGER, unit="%"),
+    Field("lat", NUMBER, unit="°"),
+    Field("long", NUMBER, unit="°")
+]))
 
 DEBUG_OUTPUT = False
 
@@ -61,8 +72,31 @@ DEBUG_OUTPUT = False
 #   |               | 20=Power off(temperature)             |
 
 
+GPS_FIXES = {0b00: "not fix", 0b01: "2D", 0b10: "3D"}
+
+REPORT_TYPES = {
+    2: "Periodic mode report",
+    4: "Motion mode static report",
+    5: "Motion mode moving report",
+    6: "Motion mode static to motion report",
+    7: "Motion mode moving to static report",
+    14: "SOS alarm report",
+    15: "Low battery alarm report",
+    17: "Power on (temperature)",
+    19: "Power off (low battery)",
+    20: "Power off (temperature)"
+}
+
+GPS_FIX_REPORT_TYPE_TABLE = StatusTable(lambda value: (GPS_FIXES.get(bits(value, 0b11000000, 6), "unknown"),
+                                                       REPORT_TYPES.get(bits(value, 0b00111111), "unknown")))
+
+
 def dict_from_payload(base64_input: str, fport: int = None):
-    decoded = base64.b64decode(base64_input)
+    return dict_from_bytes(base64.b64decode(base64_input), fport)
+
+
+def dict_from_bytes(decoded: bytes, fport: int = None):
+    """ Decodes the device type, GPS fix, report type, battery and position of a Globalsat LT-100 uplink """
 
     if DEBUG_OUTPUT:
         print(f"Input: {decoded.hex().upper()}")
@@ -70,39 +104,8 @@ def dict_from_payload(base64_input: str, fport: int = None):
     # Get device type from byte 0
     device_type = decoded[0]
 
-    # Get gps fix from byte 1, bit 6-7
-    gps_fix_flag = (decoded[1] & 0b11000000) >> 6
-    gps_fix = "unknown"
-    if gps_fix_flag == 0b00:
-        gps_fix = "not fix"
-    elif gps_fix_flag == 0b01:
-        gps_fix = "2D"
-    elif gps_fix_flag == 0b10:
-        gps_fix = "3D"
-
-    # Get report type from byte 1, bit 0-5
-    report_type_flag = (decoded[1] & 0b00111111)
-    report_type = "unknown"
-    if report_type_flag == 2:
-        report_type = "Periodic mode report"
-    elif report_type_flag == 4:
-        report_type = "Motion mode static report"
-    elif report_type_flag == 5:
-        report_type = "Motion mode moving report"
-    elif report_type_flag == 6:
-        report_type = "Motion mode static to motion report"
-    elif report_type_flag == 7:
-        report_type = "Motion mode moving to static report"
-    elif report_type_flag == 14:
-        report_type = "SOS alarm report"
-    elif report_type_flag == 15:
-        report_type = "Low battery alarm report"
-    elif report_type_flag == 17:
-        report_type = "Power on (temperature)"
-    elif report_type_flag == 19:
-        report_type = "Power off (low battery)"
-    elif report_type_flag == 20:
-        report_type = "Power off (temperature)"
+    # Get gps fix from byte 1, bit 6-7 and report type from byte 1, bit 0-5
+    gps_fix, report_type = GPS_FIX_REPORT_TYPE_TABLE[decoded[1]]
 
     # Get battery capacity from byte 2
     battery_capacity = int(decoded[2])
@@ -20,6 +20,23 @@
 # https://www.baranidesign.com/meteohelix-message-decoder
 
 import base64
+from decoder_schemas import INTEGER, NUMBER, STRING, Field, OutputSchema, register
+
+# All fields are missing if the sensor reports an error
+OUTPUT_SCHEMA = register("meteo_helix", OutputSchema([
+    Field("Type", INTEGER, required=False),
+    Field("Battery", NUMBER, unit="V", required=False),
+    Field("Temperature", NUMBER, unit="°C", required=False),
+    Field("T_min", NUMBER, unit="°C", required=False),
+    Field("T_max", NUMBER, unit="°C", required=False),
+    Field("Humidity", NUMBER, unit="%", required=False),
+    Field("Pressure", INTEGER, unit="Pa", required=False),
+    Field("Irradiation", INTEGER, unit="W/m²", required=False),
+    Field("Irr_max", INTEGER, unit="W/m²", required=False),
+    Field("Rain", INTEGER, unit="mm", required=False),
+    Field("Rain_min_time", INTEGER, unit="s", required=False),
+    Field("Error", STRING, required=False)
+]))
 
 # DEBUG MODE
 DEBUG_OUTPUT = False
@@ -81,8 +98,11 @@ def dict_from_payload(base64_input: str, fport: int = None):
         -------
         JSON object with key/value pairs of decoded attributes
     """
+    return dict_from_bytes(base64.b64decode(base64_input), fport)
 
-    decoded = base64.b64decode(base64_input)
+
+def dict_from_bytes(decoded: bytes, fport: int = None):
+    """ Decodes the bit fields of a Meteo Helix weather station uplink """
 
     # Printing the debug output
     if DEBUG_OUTPUT:
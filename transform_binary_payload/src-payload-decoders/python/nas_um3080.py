@@ -34,12 +34,47 @@
 import base64
 import json
 import helpers
+from decoder_schemas import INTEGER, OBJECT, STRING, Field, OutputSchema, optional, register
+
+DIGITAL_FIELDS = [Field("value", INTEGER),
+                  Field("triggerMode", STRING),
+                  Field("triggerAlert", STRING),
+                  Field("mediumType", STRING),
+                  Field("counter", INTEGER)]
+
+USAGE_FIELDS = [Field("digital1Status", STRING),
+                Field("digital2Status", STRING),
+                Field("digital1", OBJECT, required=False, fields=DIGITAL_FIELDS),
+                Field("digital2", OBJECT, required=False, fields=DIGITAL_FIELDS)]
+
+STATUS_FIELDS = USAGE_FIELDS + [Field("userTriggered", STRING),
+                                Field("battery", INTEGER),
+                                Field("temperature", INTEGER, unit="°C"),
+                                Field("rssi", INTEGER, unit="dBm")]
+
+# FPort 24: status message, FPort 25: usage message, FPort 99: boot or shutdown message. A shutdown message
+# may contain a status message.
+OUTPUT_SCHEMA = register("nas_um3080", OutputSchema([], fport_variants={
+    24: STATUS_FIELDS,
+    25: USAGE_FIELDS,
+    99: [Field("messageType", STRING)]
+}, variant_field="messageType", variants={
+    "boot": [Field("serial", STRING),
+             Field("firmwareVersion", STRING),
+             Field("resetReason", STRING),
+             Field("batteryInfo", STRING)],
+    "shutdown": [Field("reason", STRING)] + optional(STATUS_FIELDS)
+}))
 
 DEBUG_OUTPUT = False
 
 
 def dict_from_payload(base64_input: str, fport: int = None):
-    decoded = base64.b64decode(base64_input)
+    return dict_from_bytes(base64.b64decode(base64_input), fport)
+
+
+def dict_from_bytes(decoded: bytes, fport: int = None):
+    """ Decodes a NAS UM3080 uplink by its FPort: 24 status, 25 usage, 99 boot or debug message """
 
     if DEBUG_OUTPUT:
         print(f"Input: {decoded.hex().upper()}")
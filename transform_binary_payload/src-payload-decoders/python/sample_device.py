@@ -18,6 +18,12 @@
 import base64
 import time
 import math
+from decoder_schemas import NUMBER, Field, OutputSchema, register
+
+OUTPUT_SCHEMA = register("sample_device", OutputSchema([
+    Field("temperature", NUMBER, unit="°C"),
+    Field("humidity", NUMBER, unit="%")
+]))
 
 
 def dict_from_payload(base64_input: str, fport: int = None):
@@ -36,8 +42,11 @@ def dict_from_payload(base64_input: str, fport: int = None):
             JSON object with key/value pairs of decoded attributes
 
         """
+    return dict_from_bytes(base64.b64decode(base64_input), fport)
+
 
-    decoded = base64.b64decode(base64_input)
+def dict_from_bytes(decoded: bytes, fport: int = None):
+    """ Simulates a decoder: returns a temperature and humidity which vary with the time, the payload is ignored """
 
     temperature = round(20 + (math.cos(time.time()/10)*10), 2)
     humidity = round(50 + (math.sin(time.time()/10)*10), 2)
@@ -23,6 +23,30 @@ import base64
 import json
 
 import helpers
+from decoder_codegen import TaggedLayout, assert_equivalent, compile_decoder, const, fixed_point, lookup, uint
+from decoder_schemas import INTEGER, NUMBER, STRING, Field, OutputSchema, register
+
+OUTPUT_SCHEMA = register("sentrius_rs1xx", OutputSchema([
+    Field("msg_type", STRING),
+    Field("options", STRING)
+], variant_field="msg_type", variants={
+    "SendTempRHData": [Field("humidity", NUMBER, unit="%"),
+                       Field("temperature", NUMBER, unit="°C"),
+                       Field("battery_capacity", INTEGER, unit="%"),
+                       Field("alarm_msg_count", INTEGER),
+                       Field("backlog_msg_count", INTEGER)],
+    "SendFWVersion": [Field("year", INTEGER),
+                      Field("month", INTEGER),
+                      Field("day", INTEGER),
+                      Field("version_major", INTEGER),
+                      Field("version_minor", INTEGER),
+                      Field("part_number", INTEGER)],
+    "SendBatteryVoltage": [Field("voltage", NUMBER, unit="V")],
+    "SendRTDData": [Field("temperature", NUMBER, unit="°C"),
+                    Field("battery_capacity", INTEGER, unit="%"),
+                    Field("alarm_msg_count", INTEGER),
+                    Field("backlog_msg_count", INTEGER)]
+}))
 
 # DEBUG MODE
 DEBUG_OUTPUT = False
@@ -119,8 +143,11 @@ def dict_from_payload(base64_input: str, fport: int = None):
         -------
         JSON object with key/value pairs of decoded attributes
     """
+    return dict_from_bytes(base64.b64decode(base64_input), fport)
 
-    decoded = base64.b64decode(base64_input)
+
+def dict_from_bytes(decoded: bytes, fport: int = None):
+    """ Decodes a Sentrius RS1xx uplink by its message type in byte 0 """
 
     # Printing the debug output
     if DEBUG_OUTPUT:
@@ -257,86 +284,122 @@ def opt_sens2serv(opt_byte):
         return "Undefined option"
 
 
+# Layout of the messages above for the generated decoder
+OPTIONS_TABLE = tuple(opt_sens2serv(value) for value in range(256))
+BATTERY_CAPACITY_TABLE = tuple(battery_capacity(value) for value in range(256))
+
+MESSAGE_LAYOUT = TaggedLayout(tag_offset=0, none_if_empty=True, messages={
+    0x01: [const("msg_type", "SendTempRHData"),
+           lookup("options", 1, OPTIONS_TABLE),
+           fixed_point("humidity", 2, 2),
+           fixed_point("temperature", 4, 2),
+           lookup("battery_capacity", 6, BATTERY_CAPACITY_TABLE),
+           uint("alarm_msg_count", 7, 2),
+           uint("backlog_msg_count", 9, 2)],
+    0x07: [const("msg_type", "SendFWVersion"),
+           lookup("options", 1, OPTIONS_TABLE),
+           uint("year", 2),
+           uint("month", 3),
+           uint("day", 4),
+           uint("version_major", 5),
+           uint("version_minor", 6),
+           uint("part_number", 7, 4)],
+    0x0A: [const("msg_type", "SendBatteryVoltage"),
+           lookup("options", 1, OPTIONS_TABLE),
+           fixed_point("voltage", 2, 2)],
+    0x0B: [const("msg_type", "SendRTDData"),
+           lookup("options", 1, OPTIONS_TABLE),
+           fixed_point("temperature", 2, 4),
+           lookup("battery_capacity", 6, BATTERY_CAPACITY_TABLE),
+           uint("alarm_msg_count", 7, 2),
+           uint("backlog_msg_count", 9, 2)]
+})
+
+# Generated straight-line decoder, equivalent to dict_from_bytes without DEBUG_OUTPUT
+compiled_dict_from_bytes = compile_decoder("sentrius_rs1xx", MESSAGE_LAYOUT)
+
+
 # Tests
-if __name__ == "__main__":
-    test_definition = [
-        {
-            "input_encoding": "hex",
-            "input_value": "01001E0141190200000000",
-            "output": {
-                "msg_type": "SendTempRHData",
-                "options": "Undefined option",
-                "humidity": 1.3,
-                "temperature": 25.65,
-                "battery_capacity": 20,
-                "alarm_msg_count": 0,
-                "backlog_msg_count": 0
-            }
-        },
-        {
-            "input_encoding": "base64",
-            "input_value": "BwkUAxoGAABJPnI=",
-            "output": {
-                "msg_type": "SendFWVersion",
-                "options": "Undefined option",
-                "year": 20,
-                "month": 3,
-                "day": 26,
-                "version_major": 6,
-                "version_minor": 0,
-                "part_number": 4800114
-            }
-        },
-        {
-            "input_encoding": "hex",
-            "input_value": "0A000A03",
-            "output": {
-                "msg_type": "SendBatteryVoltage",
-                "options": "Undefined option",
-                "voltage": 3.1
-            }
-        },
-        {
-            "input_encoding": "base64",
-            "input_value": "CxEAAAAABAAAAAA=",
-            "output": {
-                "msg_type": "SendRTDData",
-                "options": "Undefined option",
-                "temperature": 0.0,
-                "battery_capacity": 60,
-                "alarm_msg_count": 0,
-                "backlog_msg_count": 0
-            }
-        },
-        {
-            "input_encoding": "hex",
-            "input_value": "07 00 00 01 01 00 00 00 49 3E 6F",
-            "output": {
-                "msg_type": "SendFWVersion",
-                "options": "Undefined option",
-                "year": 0,
-                "month": 1,
-                "day": 1,
-                "version_major": 0,
-                "version_minor": 0,
-                "part_number": 4800111
-            }
-        },
-        {
-            "input_encoding": "hex",
-            "input_value": "0B 01 00 00 00 10 02 00 00 00 00",
-            "output": {
-                "msg_type": "SendRTDData",
-                "options": "Sensor request for server time",
-                "temperature": 16.0,
-                "battery_capacity": 20,
-                "alarm_msg_count": 0,
-                "backlog_msg_count": 0
-            }
-        },
-    ]
-
-    for testcase in test_definition:
+TEST_DEFINITION = [
+    {
+        "input_encoding": "hex",
+        "input_value": "01001E0141190200000000",
+        "output": {
+            "msg_type": "SendTempRHData",
+            "options": "Undefined option",
+            "humidity": 1.3,
+            "temperature": 25.65,
+            "battery_capacity": 20,
+            "alarm_msg_count": 0,
+            "backlog_msg_count": 0
+        }
+    },
+    {
+        "input_encoding": "base64",
+        "input_value": "BwkUAxoGAABJPnI=",
+        "output": {
+            "msg_type": "SendFWVersion",
+            "options": "Undefined option",
+            "year": 20,
+            "month": 3,
+            "day": 26,
+            "version_major": 6,
+            "version_minor": 0,
+            "part_number": 4800114
+        }
+    },
+    {
+        "input_encoding": "hex",
+        "input_value": "0A000A03",
+        "output": {
+            "msg_type": "SendBatteryVoltage",
+            "options": "Undefined option",
+            "voltage": 3.1
+        }
+    },
+    {
+        "input_encoding": "base64",
+        "input_value": "CxEAAAAABAAAAAA=",
+        "output": {
+            "msg_type": "SendRTDData",
+            "options": "Undefined option",
+            "temperature": 0.0,
+            "battery_capacity": 60,
+            "alarm_msg_count": 0,
+            "backlog_msg_count": 0
+        }
+    },
+    {
+        "input_encoding": "hex",
+        "input_value": "07 00 00 01 01 00 00 00 49 3E 6F",
+        "output": {
+            "msg_type": "SendFWVersion",
+            "options": "Undefined option",
+            "year": 0,
+            "month": 1,
+            "day": 1,
+            "version_major": 0,
+            "version_minor": 0,
+            "part_number": 4800111
+        }
+    },
+    {
+        "input_encoding": "hex",
+        "input_value": "0B 01 00 00 00 10 02 00 00 00 00",
+        "output": {
+            "msg_type": "SendRTDData",
+            "options": "Sensor request for server time",
+            "temperature": 16.0,
+            "battery_capacity": 20,
+            "alarm_msg_count": 0,
+            "backlog_msg_count": 0
+        }
+    },
+]
+
+
+def test_uplink_decoding():
+    for testcase in TEST_DEFINITION:
         base64_input = None
         if testcase.get("input_encoding") == "base64":
             base64_input = testcase.get("input_value")
@@ -351,3 +414,14 @@ if __name__ == "__main__":
             else:
                 print(
                     f'"{testcase.get("input_value")}" : Successful test for key "{key}", value "{testcase.get("output").get(key)}"')
+
+
+def test_compiled_decoder():
+    payloads = [base64.b64decode(testcase["input_value"]) if testcase["input_encoding"] == "base64"
+                else bytes.fromhex(testcase["input_value"]) for testcase in TEST_DEFINITION]
+    assert_equivalent(dict_from_bytes, compiled_dict_from_bytes, payloads)
+
+
+if __name__ == "__main__":
+    test_uplink_decoding()
+    test_compiled_decoder()
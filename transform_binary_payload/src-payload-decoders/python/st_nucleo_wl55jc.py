@@ -18,6 +18,14 @@
 import base64
 import time
 import math
+from decoder_schemas import INTEGER, NUMBER, STRING, Field, OutputSchema, register
+
+OUTPUT_SCHEMA = register("st_nucleo_wl55jc", OutputSchema([
+    Field("led", STRING),
+    Field("pressure", NUMBER, unit="hPa"),
+    Field("temperature", INTEGER, unit="°C"),
+    Field("humidity", NUMBER, unit="%")
+]))
 
 
 def dict_from_payload(base64_input: str, fport: int = None):
@@ -36,8 +44,11 @@ def dict_from_payload(base64_input: str, fport: int = None):
             JSON object with key/value pairs of decoded attributes
 
         """
+    return dict_from_bytes(base64.b64decode(base64_input), fport)
+
 
-    decoded = base64.b64decode(base64_input)
+def dict_from_bytes(decoded: bytes, fport: int = None):
+    """ Decodes the LED state, pressure, temperature and humidity of the ST NUCLEO-WL55JC demo application """
 
     led = "Off" if decoded[0] == 0 else "On"
     pressure = int.from_bytes(decoded[1:3], byteorder='big', signed=False) / 10
@@ -0,0 +1,107 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+#
+# Lookup tables for status bytes.
+#
+# Instead of masking, shifting and mapping each bit field of a status byte on every uplink, a decoder
+# describes the decoding of one byte value once. StatusTable evaluates it for all 256 values when the
+# module is imported, decoding a status byte is then a single index operation.
+#
+# Entries are immutable (dicts become read-only mappings, lists become tuples), so they can be shared
+# between uplinks. Use copy() to put a dict entry into a decoder result.
+#
+
+from types import MappingProxyType
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _thaw(value):
+    if isinstance(value, MappingProxyType):
+        return {key: _thaw(item) for key, item in value.items()}
+    return value
+
+
+def _is_flat(value) -> bool:
+    return isinstance(value, MappingProxyType) and not any(isinstance(item, (MappingProxyType, tuple)) for item in value.values())
+
+
+class StatusTable:
+    """ Decoded values of a status byte for all 256 byte values
+
+        Parameters
+        ----------
+        decode_byte : function
+            Function (value: int) -> decoded value, e.g. a dict of flags or a string
+    """
+    __slots__ = ("entries", "_flat")
+
+    def __init__(self, decode_byte):
+        self.entries = tuple(_freeze(decode_byte(value)) for value in range(256))
+        # Flat dicts are copied by MappingProxyType.copy(), which is much faster than _thaw()
+        self._flat = all(_is_flat(entry) for entry in self.entries)
+
+    def __getitem__(self, value: int):
+        """ Returns the immutable entry for a byte value """
+        return self.entries[value]
+
+    def copy(self, value: int):
+        """ Returns the entry for a byte value as mutable dict, e.g. for a decoder result """
+        if self._flat:
+            return self.entries[value].copy()
+        return _thaw(self.entries[value])
+
+
+def bit(value: int, position: int) -> bool:
+    return bool(value >> position & 1)
+
+
+def bits(value: int, mask: int, shift: int = 0) -> int:
+    return (value & mask) >> shift
+
+
+def test_status_table():
+    table = StatusTable(lambda value: {"counter": bits(value, 0b11100000, 5), "flags": [bit(value, 0), bit(value, 1)]})
+    assert table[0b10100001] == {"counter": 5, "flags": (True, False)}
+
+    result = table.copy(0b10100001)
+    result["value"] = 1
+    assert "value" not in table[0b10100001]
+    try:
+        table[0b10100001]["counter"] = 0
+        assert False
+    except TypeError:
+        pass
+
+
+def test_enum_table():
+    names = {0b00: "not fix", 0b01: "2D", 0b10: "3D"}
+    table = StatusTable(lambda value: names.get(bits(value, 0b11000000, 6), "unknown"))
+    assert table[0x82] == "3D"
+    assert table[0xC0] == "unknown"
+    assert table.copy(0x40) == "2D"
+
+
+if __name__ == "__main__":
+    test_status_table()
+    test_enum_table()
@@ -42,6 +42,19 @@
 
 import base64
 import json
+from decoder_schemas import BOOLEAN, INTEGER, NUMBER, Field, OutputSchema, register
+
+OUTPUT_SCHEMA = register("tabs_objectlocator", OutputSchema([
+    Field("status_flag_button_triggered", BOOLEAN),
+    Field("status_flag_moving_mode", BOOLEAN),
+    Field("status_flag_gnss_fix", BOOLEAN),
+    Field("status_flag_gnss_error", BOOLEAN),
+    Field("battery_value", NUMBER, unit="V"),
+    Field("temp", INTEGER, unit="°C"),
+    Field("lat", NUMBER, unit="°"),
+    Field("long", NUMBER, unit="°"),
+    Field("position_accuracy", INTEGER, unit="m")
+]))
 
 DEBUG_OUTPUT = False
 
@@ -62,7 +75,11 @@ def dict_from_payload(base64_input: str, fport: int = None):
             JSON object with key/value pairs of decoded attributes
 
         """
-    decoded = base64.b64decode(base64_input)
+    return dict_from_bytes(base64.b64decode(base64_input), fport)
+
+
+def dict_from_bytes(decoded: bytes, fport: int = None):
+    """ Decodes the status flags, battery, temperature and position of a TABS object locator uplink """
 
     if DEBUG_OUTPUT:
         print(f"Input: {decoded.hex().upper()}")
@@ -50,6 +50,14 @@
 
 import base64
 import json
+from decoder_schemas import INTEGER, NUMBER, STRING, Field, OutputSchema, register
+
+OUTPUT_SCHEMA = register("tabs_temphumsensor", OutputSchema([
+    Field("status_sensor_type", STRING),
+    Field("battery_value", NUMBER, unit="V"),
+    Field("temp", INTEGER, unit="°C"),
+    Field("RH", INTEGER, unit="%")
+]))
 
 DEBUG_OUTPUT = False
 
@@ -70,7 +78,11 @@ def dict_from_payload(base64_input: str, fport: int = None):
             JSON object with key/value pairs of decoded attributes
 
         """
-    decoded = base64.b64decode(base64_input)
+    return dict_from_bytes(base64.b64decode(base64_input), fport)
+
+
+def dict_from_bytes(decoded: bytes, fport: int = None):
+    """ Decodes the sensor type, battery, temperature and humidity of a TABS temperature and humidity sensor uplink """
 
     if DEBUG_OUTPUT:
         print(f"Input: {decoded.hex().upper()}")
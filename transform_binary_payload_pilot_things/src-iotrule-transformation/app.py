@@ -20,7 +20,15 @@ import logging
 import re
 import requests
 import base64
+import importlib
 import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from decode_cache import DecodeCache
 
 # Function name for logging
 FUNCTION_NAME = "ConvertBinaryPayload"
@@ -36,6 +44,125 @@ class InvalidInputException(Exception):
 # Define regex used to pre-validate product ID
 VALID_PRODUCT_ID_REGEX = re.compile("^[0-9a-fA-F]{8}-([0-9a-fA-F]{4}-){3}[0-9a-fA-F]{12}$")
 
+# Configuration of the decoding service client
+SERVICE_URL = os.environ.get("PILOT_THINGS_SERVICE_URL", "https://sensor-library.pilot-things.net/decode")
+API_KEY = os.environ.get("PILOT_THINGS_SERVICE_API_KEY")
+CONNECT_TIMEOUT_SECONDS = float(os.environ.get("PILOT_THINGS_CONNECT_TIMEOUT_SECONDS", "2"))
+READ_TIMEOUT_SECONDS = float(os.environ.get("PILOT_THINGS_READ_TIMEOUT_SECONDS", "5"))
+MAX_RETRIES = int(os.environ.get("PILOT_THINGS_MAX_RETRIES", "3"))
+RETRY_BACKOFF_FACTOR = float(os.environ.get("PILOT_THINGS_RETRY_BACKOFF_FACTOR", "0.2"))
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+
+# Results of the decoding service are cached per product ID and payload. Use a size of 0 to disable.
+DECODE_CACHE_SIZE = int(os.environ.get("DECODE_CACHE_SIZE", "1024"))
+DECODE_CACHE_TTL_SECONDS = float(os.environ.get("DECODE_CACHE_TTL_SECONDS", "300"))
+
+# Optional JSON object mapping product IDs to names of Python binary decoders (e.g. {"<product id>": "dragino_lht65"}).
+# Payloads of these products are decoded in-process by "<decoder name>.dict_from_bytes" (or
+# "<decoder name>.dict_from_payload" for decoders without it) instead of the decoding service. The decoders must be available to this function, e.g. by attaching the
+# payload decoder layer of the transform_binary_payload sample.
+LOCAL_DECODERS = os.environ.get("LOCAL_DECODERS", "{}")
+
+# Maximum number of concurrent requests to the decoding service in batch mode
+BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", "8"))
+VALID_DECODER_NAME_REGEX = re.compile("^[a-z0-9_]+$")
+
+
+def retry_budget_seconds(max_retries: int = MAX_RETRIES, backoff_factor: float = RETRY_BACKOFF_FACTOR,
+                         connect_timeout: float = CONNECT_TIMEOUT_SECONDS, read_timeout: float = READ_TIMEOUT_SECONDS) -> float:
+    """ Returns the longest time a request to the decoding service can take with all retries, i.e. the
+        connect and read timeouts of every attempt plus the exponential backoff between the attempts.
+        The timeout of the AWS Lambda function in template.yaml must be longer. """
+    backoff = sum(backoff_factor * (2 ** (retry - 1)) for retry in range(2, max_retries + 1))
+    return (max_retries + 1) * (connect_timeout + read_timeout) + backoff
+
+
+def create_session(max_retries: int = MAX_RETRIES, backoff_factor: float = RETRY_BACKOFF_FACTOR, pool_maxsize: int = 10) -> requests.Session:
+    """ Creates a session for the decoding service. The session keeps connections alive between
+        invocations of a warm AWS Lambda execution environment and retries throttled (429) and
+        failed (5xx) requests with exponential backoff. A Retry-After header is not respected, so that
+        a request never takes longer than retry_budget_seconds(). """
+    retry = Retry(total=max_retries,
+                  backoff_factor=backoff_factor,
+                  status_forcelist=RETRY_STATUS_CODES,
+                  allowed_methods=frozenset(["POST"]),
+                  respect_retry_after_header=False,
+                  raise_on_status=False)
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=1, pool_maxsize=pool_maxsize)
+    new_session = requests.Session()
+    new_session.mount("https://", adapter)
+    new_session.mount("http://", adapter)
+    new_session.headers.update({'x-api-key': API_KEY})
+    return new_session
+
+
+session = create_session(pool_maxsize=max(BATCH_MAX_CONCURRENCY, 1))
+
+decode_cache = DecodeCache(max_size=DECODE_CACHE_SIZE, ttl_seconds=DECODE_CACHE_TTL_SECONDS)
+
+
+def bytes_decoder(module):
+    """ Returns a function (payload: bytes, fport: int) -> dict of a binary decoder module """
+    if hasattr(module, "compiled_dict_from_bytes"):
+        return module.compiled_dict_from_bytes
+    if hasattr(module, "dict_from_bytes"):
+        return module.dict_from_bytes
+    dict_from_payload = module.dict_from_payload
+    return lambda payload, fport: dict_from_payload(base64.b64encode(payload).decode("ascii"), fport)
+
+
+def load_local_decoders(mapping: dict) -> dict:
+    """ Imports local binary decoders and returns a dict of product ID (lower case) to (decoder name, function),
+        the functions take the base64-decoded payload """
+    decoders = {}
+    for product_id, decoder_name in mapping.items():
+        if not VALID_DECODER_NAME_REGEX.match(decoder_name):
+            logger.warning(f"Ignoring invalid local decoder name {decoder_name} for product ID {product_id}")
+            continue
+        try:
+            decoders[product_id.lower()] = (decoder_name, bytes_decoder(importlib.import_module(decoder_name)))
+        except (ImportError, AttributeError) as e:
+            logger.warning(f"Local decoder {decoder_name} for product ID {product_id} is not available, using decoding service: {e}")
+    return decoders
+
+
+local_decoders = load_local_decoders(json.loads(LOCAL_DECODERS))
+
+
+def decode_remote(product_id: str, input_hex: str) -> dict:
+    """ Invokes the decoding service and returns the decoded payload """
+    r = session.post(SERVICE_URL,
+                     json={
+                         'productId': product_id,
+                         'payload': input_hex
+                     },
+                     timeout=(CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS))
+    # Check for errors
+    r.raise_for_status()
+    return r.json()
+
+
+def decode(product_id: str, payload: bytes) -> dict:
+    """ Decodes a base64-decoded payload (bytes or memoryview) with a local decoder if one is configured
+        for the product ID, otherwise with the decoding service. Results of the decoding service are cached. """
+    local_decoder = local_decoders.get(product_id.lower())
+    if local_decoder is not None:
+        (decoder_name, dict_from_bytes) = local_decoder
+        result = dict_from_bytes(payload, None)
+        result["decoder_name"] = decoder_name
+        return result
+
+    # The decoding service expects a hexadecimal string
+    input_hex = payload.hex()
+
+    cache_key = (product_id.lower(), input_hex)
+    result = decode_cache.get(cache_key)
+    if result is None:
+        result = decode_remote(product_id, input_hex)
+        decode_cache.put(cache_key, result)
+    return result
+
+
 def lambda_handler(event, context):
     """ Transforms a binary payload by the Pilot Things decoding service.
         Parameters 
@@ -46,6 +173,10 @@ def lambda_handler(event, context):
         PayloadDecoderProductId : str (obligatory parameter)
             The value of this attribute defines the GUID of the decoder which will be used by the Pilot Things decoding service.
 
+        Uplinks : list (optional)
+            List of objects with PayloadData and PayloadDecoderProductId to decode in one invocation,
+            see decode_batch. If provided, PayloadData and PayloadDecoderProductId are ignored.
+
         Returns
         -------
         This function returns a JSON object with the following keys:
@@ -60,11 +191,25 @@ def lambda_handler(event, context):
     """
     logger.info("Received event: %s" % json.dumps(event))
 
+    if "Uplinks" in event:
+        return decode_batch(event["Uplinks"])
+
     # Store event input and perform input validation
     input_base64 = event.get("PayloadData")
     product_id = event.get("PayloadDecoderProductId")
-    api_key = os.environ["PILOT_THINGS_SERVICE_API_KEY"]
+    validate_product_id(product_id)
+
+    logger.info(f"Base64 input={input_base64}, Product ID={product_id}")
+
+    # Decode the payload and return a result
+    result = decode(product_id, base64.b64decode(input_base64))
+    result["status"] = 200
+    result["product_id"] = product_id
+    logger.info(result)
+    return result
+
 
+def validate_product_id(product_id: str) -> None:
     # Validate existence of payload type
     if product_id is None:
         raise InvalidInputException("PayloadDecoderProductId is not specified")
@@ -73,21 +218,82 @@ def lambda_handler(event, context):
     if not VALID_PRODUCT_ID_REGEX.match(product_id):
         raise InvalidInputException("PayloadDecoderProductId must be a GUID")
 
-    logger.info(f"Base64 input={input_base64}, Product ID={product_id}")
 
-    # Convert Base64 to a hexadecimal string
-    input_hex = base64.b64decode(input_base64).hex()
+def decode_batch(uplinks: list) -> dict:
+    """ Decodes many uplinks, e.g. to re-decode historical data.
 
-    # Invoke the decoding service and return a result
-    r = requests.post("https://sensor-library.pilot-things.net/decode", headers={'x-api-key': api_key}, json={
-        'productId': product_id,
-        'payload': input_hex
-    })
-    # Check for errors
-    r.raise_for_status()
+        Parameters
+        ----------
+        uplinks : list
+            List of objects with the attributes PayloadData and PayloadDecoderProductId
 
-    result = r.json()
-    result["status"] = 200
-    result["product_id"] = product_id
-    logger.info(result)
+        Uplinks are grouped by product ID and identical payloads are decoded only once. Distinct
+        payloads are base64-decoded into one contiguous buffer and passed to the decoders as
+        memoryview slices of it. They are sent to the decoding service concurrently, with at most
+        BATCH_MAX_CONCURRENCY requests in flight.
+
+        Returns
+        -------
+        A JSON object with "status" 200 and "results", a list with one result per uplink in input order.
+        The result for an uplink which could not be decoded has status 500, errorType and errorMessage.
+    """
+    results = [None] * len(uplinks)
+
+    # product ID -> PayloadData -> positions of the uplinks in the input list
+    groups = OrderedDict()
+    for position, uplink in enumerate(uplinks):
+        product_id = uplink.get("PayloadDecoderProductId")
+        try:
+            validate_product_id(product_id)
+        except InvalidInputException as e:
+            results[position] = error_result(e, product_id)
+            continue
+        groups.setdefault(product_id.lower(), OrderedDict()).setdefault(uplink.get("PayloadData"), []).append(position)
+
+    buffer, slices = bytearray(), []
+    for product_id, payloads in groups.items():
+        for input_base64, positions in payloads.items():
+            start = len(buffer)
+            try:
+                buffer += base64.b64decode(input_base64)
+            except Exception as e:
+                for position in positions:
+                    results[position] = error_result(e, uplinks[position].get("PayloadDecoderProductId"))
+                continue
+            slices.append((product_id, start, len(buffer), positions))
+    view = memoryview(buffer)
+
+    with ThreadPoolExecutor(max_workers=max(BATCH_MAX_CONCURRENCY, 1)) as executor:
+        futures = [(executor.submit(decode, product_id, view[start:end]), positions)
+                   for product_id, start, end, positions in slices]
+
+        for future, positions in futures:
+            try:
+                decoded = future.result()
+            except Exception as e:
+                for position in positions:
+                    results[position] = error_result(e, uplinks[position].get("PayloadDecoderProductId"))
+                continue
+
+            for i, position in enumerate(positions):
+                result = decoded if i == 0 else deepcopy(decoded)
+                result["status"] = 200
+                result["product_id"] = uplinks[position].get("PayloadDecoderProductId")
+                results[position] = result
+
+    logger.info(f"Decoded batch of {len(uplinks)} uplinks with {len(futures)} distinct payloads")
+    return {
+        "status": 200,
+        "results": results
+    }
+
+
+def error_result(exception: Exception, product_id: str) -> dict:
+    result = {
+        "status": 500,
+        "product_id": product_id,
+        "errorType": type(exception).__name__,
+        "errorMessage": str(exception)
+    }
+    logger.error(result)
     return result
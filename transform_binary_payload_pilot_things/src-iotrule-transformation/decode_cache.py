@@ -0,0 +1,91 @@
+# Copyright Pilot Things. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+from collections import OrderedDict
+from copy import deepcopy
+from threading import Lock
+from time import monotonic
+
+
+class DecodeCache:
+    """ Bounded cache of decoding results with a time to live.
+
+        Results are stored per (product id, hexadecimal payload). When the cache is full, the least
+        recently used entry is evicted. Callers get a copy of a cached result, so they can add
+        attributes to it without changing the cache.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl_seconds: float = 300):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, now: float = None):
+        """ Returns a copy of the cached result or None """
+        if self.max_size <= 0:
+            return None
+        now = monotonic() if now is None else now
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return deepcopy(entry[1])
+
+    def put(self, key, result: dict, now: float = None) -> None:
+        if self.max_size <= 0:
+            return
+        now = monotonic() if now is None else now
+        with self._lock:
+            self._entries[key] = (now + self.ttl_seconds, deepcopy(result))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def test_decode_cache():
+    cache = DecodeCache(max_size=2, ttl_seconds=10)
+    cache.put(("p", "01"), {"value": 1}, now=0)
+    cache.put(("p", "02"), {"value": 2}, now=0)
+
+    result = cache.get(("p", "01"), now=1)
+    assert result == {"value": 1}
+    result["status"] = 200
+    assert cache.get(("p", "01"), now=1) == {"value": 1}
+
+    # ("p", "02") is the least recently used entry and gets evicted
+    cache.put(("p", "03"), {"value": 3}, now=2)
+    assert cache.get(("p", "02"), now=2) is None
+    assert len(cache) == 2
+
+    # Entries expire after ttl_seconds
+    assert cache.get(("p", "03"), now=12) is None
+    assert cache.hits == 2 and cache.misses == 2
+
+
+if __name__ == "__main__":
+    test_decode_cache()
@@ -0,0 +1,178 @@
+# Copyright Pilot Things. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+#
+# Tests for the Pilot Things decoding client against a local HTTP stand-in for the decoding service.
+# Run with: pytest test_app.py
+#
+
+import json
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PRODUCT_ID = "00000000-0000-0000-0000-000000000001"
+LOCAL_PRODUCT_ID = "00000000-0000-0000-0000-000000000002"
+
+
+class DecodingServiceStandIn(BaseHTTPRequestHandler):
+    """ Answers like the decoding service. Status codes in 'failures' are returned before succeeding. """
+    protocol_version = "HTTP/1.1"
+    failures = []
+    requests = []
+    connections = set()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        DecodingServiceStandIn.requests.append(body)
+        DecodingServiceStandIn.connections.add(self.client_address)
+        if DecodingServiceStandIn.failures:
+            self.send_response(DecodingServiceStandIn.failures.pop(0))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        response = json.dumps({"payload_hex": body["payload"], "api_key": self.headers.get("x-api-key")}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        pass
+
+
+server = ThreadingHTTPServer(("127.0.0.1", 0), DecodingServiceStandIn)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+
+os.environ["PILOT_THINGS_SERVICE_URL"] = f"http://127.0.0.1:{server.server_port}/decode"
+os.environ["PILOT_THINGS_SERVICE_API_KEY"] = "test-api-key"
+os.environ["PILOT_THINGS_RETRY_BACKOFF_FACTOR"] = "0"
+os.environ["LOCAL_DECODERS"] = json.dumps({LOCAL_PRODUCT_ID: "json"})
+
+import app  # noqa: E402
+
+
+def reset_stand_in(failures=()):
+    DecodingServiceStandIn.failures = list(failures)
+    DecodingServiceStandIn.requests = []
+    DecodingServiceStandIn.connections = set()
+    app.decode_cache = app.DecodeCache(max_size=app.DECODE_CACHE_SIZE, ttl_seconds=app.DECODE_CACHE_TTL_SECONDS)
+
+
+def test_decoding_reuses_connection():
+    reset_stand_in()
+    for payload in ["AQI=", "AwQ="]:
+        result = app.lambda_handler({"PayloadData": payload, "PayloadDecoderProductId": PRODUCT_ID}, None)
+        assert result["status"] == 200
+        assert result["api_key"] == "test-api-key"
+    assert [r["payload"] for r in DecodingServiceStandIn.requests] == ["0102", "0304"]
+    assert len(DecodingServiceStandIn.connections) == 1
+
+
+def test_decoding_retries_throttling_and_server_errors():
+    reset_stand_in(failures=[429, 503])
+    result = app.lambda_handler({"PayloadData": "AQI=", "PayloadDecoderProductId": PRODUCT_ID}, None)
+    assert result["status"] == 200
+    assert len(DecodingServiceStandIn.requests) == 3
+
+
+def test_decoding_results_are_cached():
+    reset_stand_in()
+    for _ in range(3):
+        result = app.lambda_handler({"PayloadData": "AQI=", "PayloadDecoderProductId": PRODUCT_ID}, None)
+        assert result["payload_hex"] == "0102"
+    assert len(DecodingServiceStandIn.requests) == 1
+
+
+def test_local_decoder():
+    reset_stand_in()
+    # A module without "dict_from_bytes" or "dict_from_payload" is not used as local decoder
+    assert app.local_decoders == {}
+    app.local_decoders = {LOCAL_PRODUCT_ID: ("local", lambda payload, fport: {"input": payload.hex()})}
+    try:
+        result = app.lambda_handler({"PayloadData": "AQI=", "PayloadDecoderProductId": LOCAL_PRODUCT_ID.upper()}, None)
+    finally:
+        app.local_decoders = {}
+    assert result == {"input": "0102", "decoder_name": "local", "status": 200, "product_id": LOCAL_PRODUCT_ID.upper()}
+    assert DecodingServiceStandIn.requests == []
+
+
+def test_local_decoder_with_base64_signature():
+    class LegacyDecoder:
+        @staticmethod
+        def dict_from_payload(base64_input, fport):
+            return {"input": base64_input}
+
+    assert app.bytes_decoder(LegacyDecoder)(memoryview(b"\x00\x01\x02")[1:], None) == {"input": "AQI="}
+
+
+def test_batch_decoding_keeps_input_order():
+    reset_stand_in()
+    uplinks = [
+        {"PayloadData": "AQI=", "PayloadDecoderProductId": PRODUCT_ID},
+        {"PayloadData": "AwQ=", "PayloadDecoderProductId": PRODUCT_ID.upper()},
+        {"PayloadData": "AQI=", "PayloadDecoderProductId": "not-a-guid"},
+        {"PayloadData": "BQY=", "PayloadDecoderProductId": PRODUCT_ID},
+        {"PayloadData": "AQI=", "PayloadDecoderProductId": PRODUCT_ID},
+        {"PayloadData": "not base64", "PayloadDecoderProductId": PRODUCT_ID}
+    ]
+    result = app.lambda_handler({"Uplinks": uplinks}, None)
+    assert result["status"] == 200
+    assert [r["status"] for r in result["results"]] == [200, 200, 500, 200, 200, 500]
+    assert [r.get("payload_hex") for r in result["results"]] == ["0102", "0304", None, "0506", "0102", None]
+    assert result["results"][1]["product_id"] == PRODUCT_ID.upper()
+    assert result["results"][2]["errorType"] == "InvalidInputException"
+    # Identical payloads of the same product are decoded once
+    assert len(DecodingServiceStandIn.requests) == 3
+
+
+def test_decoding_fails_after_retries():
+    reset_stand_in(failures=[500] * (app.MAX_RETRIES + 1))
+    try:
+        app.lambda_handler({"PayloadData": "AQI=", "PayloadDecoderProductId": PRODUCT_ID}, None)
+        assert False, "HTTPError expected"
+    except app.requests.HTTPError as e:
+        assert e.response.status_code == 500
+
+
+def test_function_timeout_covers_retry_budget():
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "template.yaml")) as f:
+        template = f.read()
+    function = template.split("TransformLoRaWANBinaryPayloadUsingPilotThingsFunctionPython:")[1]
+
+    def setting(name):
+        return float(re.search(name + r": (\d+(\.\d+)?)", function).group(1))
+
+    budget = app.retry_budget_seconds(max_retries=int(setting("PILOT_THINGS_MAX_RETRIES")),
+                                      backoff_factor=0.2,
+                                      connect_timeout=setting("PILOT_THINGS_CONNECT_TIMEOUT_SECONDS"),
+                                      read_timeout=setting("PILOT_THINGS_READ_TIMEOUT_SECONDS"))
+    assert budget == 29.2
+    assert setting("Timeout") > budget
+
+
+if __name__ == "__main__":
+    test_decoding_reuses_connection()
+    test_decoding_retries_throttling_and_server_errors()
+    test_decoding_results_are_cached()
+    test_local_decoder()
+    test_local_decoder_with_base64_signature()
+    test_batch_decoding_keeps_input_order()
+    test_decoding_fails_after_retries()
+    test_function_timeout_covers_retry_budget()
@@ -0,0 +1,439 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+#
+# In-process device heartbeat tracker.
+#
+# An alternative to one AWS IoT Events detector per device (see cdkstack/lorawan_device_heartbeat_detectormodel.py)
+# for large fleets. Like the detector model, a device is healthy after an uplink and becomes unhealthy if no
+# uplink arrives for notify_if_inactive_seconds, which is reported with a "missingheartbeat" notification.
+#
+# - Devices are stored in a compact table: a slot number per device ID and arrays with last seen time,
+#   deadline and flags per slot.
+# - Deadlines are kept in a hierarchical timer wheel. A heartbeat only updates the deadline of the device
+#   (O(1)), the wheel entry is moved lazily when its slot expires. Expired slots are scanned in batches
+#   when the clock advances.
+# - Optionally, the timeout of each device is learned from its uplink interval by an IntervalEstimator
+#   (see interval_estimator.py) instead of using notify_if_inactive_seconds for all devices.
+#
+# Benchmark:
+#   python heartbeat_tracker.py --devices 1000000
+#
+
+import argparse
+import math
+import random
+import time
+from array import array
+from collections import namedtuple
+
+from interval_estimator import IntervalEstimator
+
+# Notification types, as published by the detector model
+TYPE_UPLINK = "uplink"
+TYPE_MISSING_HEARTBEAT = "missingheartbeat"
+
+UPLINK_TOPIC = "awsiotcorelorawan/events/uplink"
+MISSING_HEARTBEAT_TOPIC = "awsiotcorelorawan/events/presence/missingheartbeat/"
+
+Notification = namedtuple("Notification", ["timestamp", "deviceid", "type", "mqtt_topic", "payload"])
+
+# Flags per device
+FLAG_SCHEDULED = 0x01
+FLAG_UNHEALTHY = 0x02
+
+# Wheel entries are item | generation << GENERATION_SHIFT
+GENERATION_SHIFT = 32
+ITEM_MASK = (1 << GENERATION_SHIFT) - 1
+
+
+def notification(timestamp: float, deviceid: str, notification_type: str) -> Notification:
+    topic = MISSING_HEARTBEAT_TOPIC + deviceid if notification_type == TYPE_MISSING_HEARTBEAT else UPLINK_TOPIC
+    payload = '{"deviceid":"' + deviceid + '", "type":"' + notification_type + '"}'
+    return Notification(timestamp, deviceid, notification_type, topic, payload)
+
+
+class TimerWheel:
+    """ Hierarchical timer wheel for integer items with deadlines in ticks
+
+        Parameters
+        ----------
+        deadline_ticks : array
+            Current deadline tick per item. The wheel reads it when a slot expires, so deadlines can
+            be moved later without touching the wheel. Use reschedule() if a deadline moves earlier.
+        start_tick : int
+            First tick to be processed
+        slot_bits : int
+            Each level has 2**slot_bits slots
+        levels : int
+            Number of levels. Deadlines beyond 2**(slot_bits*levels) ticks are parked in the top level
+            and rescheduled when its slot expires.
+    """
+
+    def __init__(self, deadline_ticks: array, start_tick: int = 0, slot_bits: int = 6, levels: int = 4):
+        self.deadline_ticks = deadline_ticks
+        self.tick = start_tick
+        self.slot_bits = slot_bits
+        self.levels = levels
+        self.slot_mask = (1 << slot_bits) - 1
+        self.wheels = [[[] for _ in range(1 << slot_bits)] for _ in range(levels)]
+        # Number of items per level
+        self.counts = [0] * levels
+        self.size = 0
+        # Per item: generation of the current entry, entries of older generations are dropped
+        self.generations = array("L")
+        # Per item: tick at which the current entry expires
+        self.scheduled_ticks = array("q")
+
+    def schedule(self, item: int) -> None:
+        while item >= len(self.generations):
+            self.generations.append(0)
+            self.scheduled_ticks.append(0)
+        self._place(item | (self.generations[item] << GENERATION_SHIFT), item)
+
+    def reschedule(self, item: int) -> None:
+        """ Schedules an item again after its deadline was moved earlier """
+        self.generations[item] += 1
+        self.schedule(item)
+
+    def _place(self, entry: int, item: int) -> None:
+        deadline_tick = self.deadline_ticks[item]
+        delta = deadline_tick - self.tick
+        if delta < 0:
+            deadline_tick = self.tick
+            delta = 0
+        self.scheduled_ticks[item] = deadline_tick
+        level = 0
+        while level < self.levels - 1 and delta >> (self.slot_bits * (level + 1)):
+            level += 1
+        self.wheels[level][(deadline_tick >> (self.slot_bits * level)) & self.slot_mask].append(entry)
+        self.counts[level] += 1
+        self.size += 1
+
+    def advance(self, tick: int) -> list:
+        """ Processes all ticks up to and including tick and returns the items whose deadline expired """
+        expired = []
+        deadline_ticks = self.deadline_ticks
+        generations = self.generations
+        level0 = self.wheels[0]
+        while self.tick <= tick:
+            if self.size == 0:
+                self.tick = tick + 1
+                break
+            current = self.tick
+            # Move entries of higher levels which start at this tick down, top level first
+            for level in range(self.levels - 1, 0, -1):
+                if current & ((1 << (self.slot_bits * level)) - 1) == 0:
+                    self._cascade(level, (current >> (self.slot_bits * level)) & self.slot_mask)
+
+            slot_index = current & self.slot_mask
+            slot = level0[slot_index]
+            if slot:
+                level0[slot_index] = []
+                self.counts[0] -= len(slot)
+                self.size -= len(slot)
+                for entry in slot:
+                    item = entry & ITEM_MASK
+                    if entry >> GENERATION_SHIFT != generations[item]:
+                        continue
+                    if deadline_ticks[item] <= current:
+                        expired.append(item)
+                    else:
+                        # Deadline was moved later since the item was scheduled
+                        self._place(entry, item)
+            self.tick = current + 1
+
+            # Skip ticks until the next cascade if the lower levels are empty
+            level = 0
+            while level < self.levels - 1 and self.counts[level] == 0:
+                level += 1
+            if level > 0:
+                step = 1 << (self.slot_bits * level)
+                self.tick = min((self.tick + step - 1) & ~(step - 1), tick + 1)
+        return expired
+
+    def _cascade(self, level: int, slot_index: int) -> None:
+        slot = self.wheels[level][slot_index]
+        if not slot:
+            return
+        self.wheels[level][slot_index] = []
+        self.counts[level] -= len(slot)
+        self.size -= len(slot)
+        for entry in slot:
+            item = entry & ITEM_MASK
+            if entry >> GENERATION_SHIFT == self.generations[item]:
+                self._place(entry, item)
+
+
+class HeartbeatTracker:
+    """ Tracks the last uplink of devices and reports devices without uplink for inactive_seconds
+
+        Parameters
+        ----------
+        inactive_seconds : float
+            Seconds without uplink after which a device is reported, like notify_if_inactive_seconds
+        resolution_seconds : float
+            Duration of a timer wheel tick. Missing heartbeats are detected up to this late, but are
+            reported with the exact deadline as timestamp.
+        on_notification : function
+            Called with each Notification
+        notify_uplinks : bool
+            If True, uplinks of healthy devices are reported like the detector model does on
+            awsiotcorelorawan/events/uplink
+        interval_estimator : IntervalEstimator
+            If provided, the timeout of a device is learned from its uplink intervals. inactive_seconds
+            is used until enough intervals were observed.
+    """
+
+    def __init__(self, inactive_seconds: float, resolution_seconds: float = 1.0, on_notification=None, notify_uplinks: bool = True,
+                 interval_estimator: IntervalEstimator = None):
+        self.inactive_seconds = inactive_seconds
+        self.interval_estimator = interval_estimator
+        self.resolution_seconds = resolution_seconds
+        self.on_notification = on_notification
+        self.notify_uplinks = notify_uplinks
+
+        # Compact device table
+        self.slots = {}
+        self.device_ids = []
+        self.last_seen = array("d")
+        self.deadlines = array("d")
+        self.deadline_ticks = array("q")
+        self.flags = bytearray()
+
+        self.wheel = None
+        self.now = None
+        self._next_tick_time = None
+
+    def __len__(self):
+        return len(self.device_ids)
+
+    def _tick(self, timestamp: float) -> int:
+        return math.ceil(timestamp / self.resolution_seconds)
+
+    def heartbeat(self, device_id: str, timestamp: float, timeout_seconds: float = None) -> bool:
+        """ Records an uplink of a device
+
+            Returns
+            -------
+            True if the device was unhealthy before
+        """
+        if self.now is None or timestamp >= self._next_tick_time:
+            self.advance(timestamp)
+        elif timestamp < self.now:
+            raise ValueError(f"Timestamp {timestamp} is before the current time {self.now}")
+
+        slot = self.slots.get(device_id)
+        if slot is None:
+            slot = len(self.device_ids)
+            self.slots[device_id] = slot
+            self.device_ids.append(device_id)
+            self.last_seen.append(timestamp)
+            self.deadlines.append(0.0)
+            self.deadline_ticks.append(0)
+            self.flags.append(0)
+            flags = 0
+        else:
+            flags = self.flags[slot]
+            # The time without uplinks of an unhealthy device is not an uplink interval
+            if self.interval_estimator is not None and not flags & FLAG_UNHEALTHY:
+                self.interval_estimator.update(slot, timestamp - self.last_seen[slot])
+            self.last_seen[slot] = timestamp
+
+        if timeout_seconds is None and self.interval_estimator is not None:
+            timeout_seconds = self.interval_estimator.timeout(slot)
+        deadline = timestamp + (self.inactive_seconds if timeout_seconds is None else timeout_seconds)
+        deadline_tick = self._tick(deadline)
+        self.deadlines[slot] = deadline
+        self.deadline_ticks[slot] = deadline_tick
+
+        # Unhealthy devices are not in the timer wheel
+        if not flags & FLAG_SCHEDULED:
+            self.flags[slot] = FLAG_SCHEDULED
+            self.wheel.schedule(slot)
+        elif deadline_tick < self.wheel.scheduled_ticks[slot]:
+            self.wheel.reschedule(slot)
+
+        if flags & FLAG_UNHEALTHY:
+            return True
+        if self.notify_uplinks and self.on_notification is not None:
+            self.on_notification(notification(timestamp, device_id, TYPE_UPLINK))
+        return False
+
+    def heartbeat_uplink(self, uplink) -> bool:
+        """ Records an uplink.Uplink (see transform_binary_payload/src-payload-decoders/python/uplink.py)
+            of a device, using the WirelessDeviceId and the timestamp of the LoRaWAN network server """
+        return self.heartbeat(uplink.wireless_device_id, uplink.timestamp_ms() / 1000)
+
+    def advance(self, timestamp: float) -> list:
+        """ Moves the clock forward and reports devices whose deadline is before the timestamp
+
+            Returns
+            -------
+            List of device IDs which became unhealthy
+        """
+        if self.now is not None and timestamp < self.now:
+            raise ValueError(f"Timestamp {timestamp} is before the current time {self.now}")
+        tick = math.floor(timestamp / self.resolution_seconds)
+        if self.wheel is None:
+            self.wheel = TimerWheel(self.deadline_ticks, start_tick=tick)
+        self.now = timestamp
+        self._next_tick_time = (tick + 1) * self.resolution_seconds
+
+        inactive = []
+        # Deadline ticks are rounded up, so expired devices are never reported early
+        for slot in self.wheel.advance(tick):
+            self.flags[slot] = FLAG_UNHEALTHY
+            inactive.append(self.device_ids[slot])
+            if self.on_notification is not None:
+                self.on_notification(notification(self.deadlines[slot], self.device_ids[slot], TYPE_MISSING_HEARTBEAT))
+        return inactive
+
+    def is_healthy(self, device_id: str) -> bool:
+        slot = self.slots.get(device_id)
+        return slot is not None and not self.flags[slot] & FLAG_UNHEALTHY
+
+    def unhealthy_count(self) -> int:
+        return sum(1 for flags in self.flags if flags & FLAG_UNHEALTHY)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the heartbeat tracker with simulated devices")
+    parser.add_argument("--devices", type=int, default=1000000, help="Number of devices")
+    parser.add_argument("--rounds", type=int, default=3, help="Number of uplinks per device")
+    parser.add_argument("--interval", type=float, default=3600, help="Seconds between two uplinks of a device")
+    parser.add_argument("--inactive", type=float, default=5400, help="Seconds without uplink until a device is reported")
+    parser.add_argument("--silentfraction", type=float, default=0.01, help="Fraction of devices which stop sending after the first uplink")
+    parser.add_argument("--adaptive", action="store_true", help="Learn the timeout of each device from its uplink interval")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    device_ids = [f"device-{i:08d}" for i in range(args.devices)]
+    silent = set(rng.sample(range(args.devices), int(args.devices * args.silentfraction)))
+    notifications = []
+    tracker = HeartbeatTracker(args.inactive, on_notification=notifications.append, notify_uplinks=False,
+                               interval_estimator=IntervalEstimator() if args.adaptive else None)
+
+    heartbeats = 0
+    start = time.perf_counter()
+    for round_number in range(args.rounds):
+        for i, device_id in enumerate(device_ids):
+            if round_number > 0 and i in silent:
+                continue
+            tracker.heartbeat(device_id, round_number * args.interval + i * args.interval / args.devices)
+            heartbeats += 1
+    heartbeat_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    tracker.advance(args.rounds * args.interval)
+    scan_elapsed = time.perf_counter() - start
+
+    print(f"{heartbeats} heartbeats of {len(tracker)} devices in {heartbeat_elapsed:.2f}s "
+          f"({heartbeats / heartbeat_elapsed:,.0f} heartbeats/s, {heartbeat_elapsed / heartbeats * 1e6:.2f} us per heartbeat)")
+    print(f"Final expiry scan in {scan_elapsed:.2f}s, {len(notifications)} missing heartbeats reported, "
+          f"{tracker.unhealthy_count()} devices unhealthy")
+
+
+def test_missing_heartbeat():
+    notifications = []
+    tracker = HeartbeatTracker(inactive_seconds=60, on_notification=notifications.append)
+    tracker.heartbeat("dev1", 0)
+    tracker.heartbeat("dev2", 10)
+    tracker.heartbeat("dev1", 50)
+    assert [n.type for n in notifications] == [TYPE_UPLINK] * 3
+    assert notifications[0].mqtt_topic == UPLINK_TOPIC
+    notifications.clear()
+
+    assert tracker.advance(69.9) == []
+    assert tracker.advance(100) == ["dev2"]
+    assert not tracker.is_healthy("dev2")
+    assert tracker.is_healthy("dev1")
+    assert [(n.timestamp, n.deviceid, n.type) for n in notifications] == [(70, "dev2", TYPE_MISSING_HEARTBEAT)]
+    assert notifications[0].mqtt_topic == MISSING_HEARTBEAT_TOPIC + "dev2"
+    assert notifications[0].payload == '{"deviceid":"dev2", "type":"missingheartbeat"}'
+
+    # Reported once, healthy again on the next uplink
+    assert tracker.advance(200) == ["dev1"]
+    assert tracker.advance(1000) == []
+    assert tracker.heartbeat("dev2", 1000) is True
+    assert tracker.is_healthy("dev2")
+    assert tracker.advance(1059) == []
+    assert tracker.advance(1060) == ["dev2"]
+
+
+def test_timer_wheel_levels():
+    deadline_ticks = array("q", [5, 64, 4095, 4096, 300000, 20000000])
+    wheel = TimerWheel(deadline_ticks, levels=4)
+    for item in range(len(deadline_ticks)):
+        wheel.schedule(item)
+    fired = {}
+    for tick in range(0, 300007, 7):
+        for item in wheel.advance(tick):
+            fired[item] = tick
+    assert fired == {0: 7, 1: 70, 2: 4095, 3: 4102, 4: 300006}
+    assert wheel.size == 1
+    assert wheel.advance(20000000) == [5]
+
+
+def test_adaptive_timeout():
+    notifications = []
+    tracker = HeartbeatTracker(inactive_seconds=5400, on_notification=notifications.append, notify_uplinks=False,
+                               interval_estimator=IntervalEstimator())
+    uplinks = [(i * 3600 + (i % 2) * 300, "meter") for i in range(6)]
+    uplinks += [(j * 60, "sensor") for j in range(6 * 60)]
+    for timestamp, device_id in sorted(uplinks):
+        tracker.heartbeat(device_id, timestamp)
+
+    # The sensor is reported after about two missing uplinks instead of 5400 seconds
+    last_sensor_uplink = 5 * 3600 + 59 * 60
+    assert tracker.advance(last_sensor_uplink + 120) == []
+    assert tracker.advance(last_sensor_uplink + 200) == ["sensor"]
+
+    # Jitter of the meter does not cause false alarms, although it exceeds the global 5400 seconds
+    tracker.heartbeat("meter", 6 * 3600 + 1800)
+    assert tracker.advance(6 * 3600 + 1800 + 6000) == []
+    assert tracker.is_healthy("meter")
+    assert [n.deviceid for n in notifications] == ["sensor"]
+
+
+def test_heartbeat_uplink():
+    class Uplink:
+        wireless_device_id = "57728ff8-5d1d-4130-9de2-f004d8722bc2"
+
+        def timestamp_ms(self):
+            return 1607352108000
+
+    tracker = HeartbeatTracker(inactive_seconds=60, notify_uplinks=False)
+    assert tracker.heartbeat_uplink(Uplink()) is False
+    assert tracker.last_seen[0] == 1607352108
+    assert tracker.advance(1607352108 + 60) == [Uplink.wireless_device_id]
+
+
+def test_timer_wheel_reschedule():
+    deadline_ticks = array("q", [1000])
+    wheel = TimerWheel(deadline_ticks)
+    wheel.schedule(0)
+    deadline_ticks[0] = 100
+    wheel.reschedule(0)
+    assert wheel.advance(99) == []
+    assert wheel.advance(100) == [0]
+    # The entry of the previous deadline is stale
+    assert wheel.advance(2000) == []
+    assert wheel.size == 0
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+#
+# Streaming estimate of the uplink interval per device, used to derive per-device inactivity timeouts.
+#
+# Per device slot, the estimator keeps a fixed amount of memory:
+# - an exponentially weighted moving average (EWMA) of the interval and of its absolute deviation
+# - a percentile sketch: a histogram of 32 logarithmic buckets (ratio sqrt(2), from 8 seconds to ~12 days)
+#   with one byte per bucket. All buckets of a device are halved when one of them is full, so older
+#   intervals fade out and a changed cadence is learned.
+#
+# The timeout of a device is (missed_uplinks + 1) times the larger of the percentile of the interval
+# and EWMA + 3 deviations, limited to [min_timeout_seconds, max_timeout_seconds].
+#
+
+import math
+from array import array
+
+BUCKETS = 32
+BUCKET_BASE_SECONDS = 8.0
+BUCKETS_PER_DOUBLING = 2
+BUCKET_MAX_COUNT = 255
+
+
+def bucket_of(interval: float) -> int:
+    if interval <= BUCKET_BASE_SECONDS:
+        return 0
+    return min(int(math.log2(interval / BUCKET_BASE_SECONDS) * BUCKETS_PER_DOUBLING), BUCKETS - 1)
+
+
+def bucket_upper_bound(bucket: int) -> float:
+    return BUCKET_BASE_SECONDS * 2 ** ((bucket + 1) / BUCKETS_PER_DOUBLING)
+
+
+class IntervalEstimator:
+    """ Learns the uplink interval of devices identified by a slot number (0, 1, 2, ...)
+
+        Parameters
+        ----------
+        alpha : float
+            Weight of a new interval in the EWMA
+        percentile : float
+            Percentile of the interval distribution used for the timeout, e.g. 0.95
+        missed_uplinks : int
+            Number of consecutive uplinks which may be lost before a device is reported
+        min_samples : int
+            Number of intervals to observe before timeout() returns a value
+        min_timeout_seconds, max_timeout_seconds : float
+            Limits of the learned timeout
+        min_interval_seconds : float
+            Shorter intervals are ignored, e.g. one uplink received by several gateways
+    """
+
+    def __init__(self, alpha: float = 0.2, percentile: float = 0.95, missed_uplinks: int = 1, min_samples: int = 3,
+                 min_timeout_seconds: float = 60, max_timeout_seconds: float = 7 * 24 * 3600, min_interval_seconds: float = 1):
+        self.alpha = alpha
+        self.percentile = percentile
+        self.missed_uplinks = missed_uplinks
+        self.min_samples = min_samples
+        self.min_timeout_seconds = min_timeout_seconds
+        self.max_timeout_seconds = max_timeout_seconds
+        self.min_interval_seconds = min_interval_seconds
+
+        self.ewma = array("d")
+        self.deviation = array("d")
+        self.samples = array("L")
+        self.histogram = bytearray()
+
+    def _ensure_slot(self, slot: int) -> None:
+        while slot >= len(self.samples):
+            self.ewma.append(0.0)
+            self.deviation.append(0.0)
+            self.samples.append(0)
+            self.histogram.extend(bytes(BUCKETS))
+
+    def update(self, slot: int, interval: float) -> None:
+        """ Adds the interval between two uplinks of a device """
+        if interval < self.min_interval_seconds:
+            return
+        self._ensure_slot(slot)
+
+        samples = self.samples[slot]
+        if samples == 0:
+            self.ewma[slot] = interval
+        else:
+            error = interval - self.ewma[slot]
+            self.ewma[slot] += self.alpha * error
+            self.deviation[slot] += self.alpha * (abs(error) - self.deviation[slot])
+        self.samples[slot] = samples + 1
+
+        offset = slot * BUCKETS
+        index = offset + bucket_of(interval)
+        if self.histogram[index] == BUCKET_MAX_COUNT:
+            for i in range(offset, offset + BUCKETS):
+                self.histogram[i] >>= 1
+        self.histogram[index] += 1
+
+    def percentile_interval(self, slot: int) -> float:
+        """ Returns the upper bound of the histogram bucket containing the percentile """
+        offset = slot * BUCKETS
+        # Walk down from the highest non-empty bucket, usually the percentile is found within a few buckets
+        counts = self.histogram[offset:offset + BUCKETS].rstrip(b"\x00")
+        tail_threshold = sum(counts) * (1 - self.percentile)
+        tail = 0
+        for bucket in range(len(counts) - 1, -1, -1):
+            tail += counts[bucket]
+            if tail > tail_threshold:
+                return bucket_upper_bound(bucket)
+        return 0.0
+
+    def timeout(self, slot: int) -> float:
+        """ Returns the learned inactivity timeout of a device or None if not enough intervals were observed """
+        if slot >= len(self.samples) or self.samples[slot] < self.min_samples:
+            return None
+        interval = max(self.percentile_interval(slot), self.ewma[slot] + 3 * self.deviation[slot])
+        timeout = interval * (self.missed_uplinks + 1)
+        return min(max(timeout, self.min_timeout_seconds), self.max_timeout_seconds)
+
+
+def test_learns_interval():
+    estimator = IntervalEstimator()
+    assert estimator.timeout(0) is None
+    for _ in range(10):
+        estimator.update(0, 60)
+        estimator.update(1, 3600)
+    assert estimator.ewma[0] == 60
+    assert 60 <= estimator.percentile_interval(0) < 60 * 2 ** 0.5
+    assert 120 <= estimator.timeout(0) < 180
+    assert 7200 <= estimator.timeout(1) < 7200 * 2 ** 0.5
+
+    # Duplicate uplinks do not count as interval
+    estimator.update(0, 0.1)
+    assert estimator.samples[0] == 10
+
+
+def test_jitter_and_cadence_change():
+    estimator = IntervalEstimator()
+    for i in range(100):
+        estimator.update(0, 600 + (i % 5) * 30)
+    assert estimator.timeout(0) >= 2 * 720
+
+    # After many shorter intervals, the histogram decays and the timeout follows
+    for _ in range(2000):
+        estimator.update(0, 60)
+    assert estimator.timeout(0) < 200
+    assert max(estimator.histogram[:BUCKETS]) <= BUCKET_MAX_COUNT
+
+
+if __name__ == "__main__":
+    test_learns_interval()
+    test_jitter_and_cadence_change()